@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark sentinel_query_download.py, get_s1_orbits.py and the orbit and frame functions against local stand-ins for
+the ASF search API and data pool, the AWS Sentinel-1 SLC bucket, and the Copernicus GNSS orbit API.
+The stand-in servers have configurable latency, bandwidth and failure rate, and serve synthetic granules and orbit files.
+The results of each run are appended to a JSON-lines file and compared with the previous run of the same case,
+so that regressions show up.
+
+Created October 2026
+"""
+
+import os,sys,re,csv,io,json,time,random,shutil,hashlib,zipfile,argparse,datetime,tempfile,threading,subprocess
+import http.server,urllib.parse
+import s1_download_func,s1_frame_func,s1_metrics_func
+
+code_dir = os.path.dirname(os.path.abspath(__file__))
+
+# paths served by the stand-in servers
+search_path = '/services/search/param'
+asf_data_path = '/asf/'
+aws_data_path = '/aws/datasets/slc/v1.1/'
+aws_list_path = '/aws-list/'
+orbit_api_path = '/gnss/odata/v1/Products'
+
+# size of the repeated block that synthetic files are made of
+block_size = 65536
+
+
+######################## Synthetic data ########################
+
+class SyntheticArchive:
+    """
+    A stack of nfiles granules on one track, one every 12 days from start, each of file_size bytes with deterministic content,
+    and a precise orbit file for every day. File contents are generated on request, so large archives take no memory or disk.
+    A fraction aws_coverage of the granules (chosen at random, but always the same ones) is also in the AWS bucket.
+    """
+    def __init__(self, nfiles, file_size, start=datetime.datetime(2019,1,1,13,10,59), orbit_size=1000000, aws_coverage=1.0):
+        self.file_size = file_size
+        self.orbit_size = orbit_size
+        self.start = start
+        self.granules = {}
+        for i in range(nfiles):
+            date = start + datetime.timedelta(days=12*i)
+            # Sentinel-1 repeats its 175 orbits every 12 days
+            orbit = 25000 + 175*i
+            name = 'S1A_IW_SLC__1SDV_%s_%s_%06d_%06X_%04X'%(date.strftime('%Y%m%dT%H%M%S'),
+                (date + datetime.timedelta(seconds=27)).strftime('%Y%m%dT%H%M%S'), orbit, 0x30000 + i, i)
+            self.granules[name] = {'date': date, 'block': make_block(name), 'md5': None, 'aws': random.Random(name).random() < aws_coverage}
+        self.names = sorted(self.granules)
+
+    def md5(self, name):
+        granule = self.granules[name]
+        if granule['md5'] is None:
+            md5 = hashlib.md5()
+            for offset in range(0, self.file_size, block_size):
+                md5.update(self.read(name, offset, min(block_size, self.file_size - offset)))
+            granule['md5'] = md5.hexdigest()
+        return granule['md5']
+
+    def read(self, name, offset, nbytes):
+        block = self.granules[name]['block'] if name in self.granules else make_block(name)
+        first = offset % len(block)
+        return (block*((first + nbytes)//len(block) + 1))[first:first + nbytes]
+
+    def rows(self, start=None, end=None, host=''):
+        """
+        ASF search results (as csv rows) for the granules acquired between start and end.
+        """
+        rows = []
+        for name in self.names:
+            date = self.granules[name]['date']
+            if (start and date < start) or (end and date > end):
+                continue
+            rows.append({'Granule Name': name, 'Platform': 'Sentinel-1A', 'Sensor': 'C-SAR', 'Beam Mode': 'IW',
+                         'Path Number': '56', 'Frame Number': '477', 'Acquisition Date': date.strftime('%Y-%m-%dT%H:%M:%S.000000'),
+                         'Processing Level': 'SLC', 'Size (MB)': '%.4f'%(self.file_size/2**20), 'MD5': self.md5(name),
+                         'URL': host + asf_data_path + name + '.zip'})
+        return rows
+
+    def aws_folder(self, date):
+        """
+        Names of the granules in the AWS folder for a date (YYYY/MM/DD).
+        """
+        return [name for name in self.names if self.granules[name]['aws'] and self.granules[name]['date'].strftime('%Y/%m/%d') == date]
+
+    def orbit_files(self, sat_ab, orbit_type, start, end):
+        """
+        Precise orbit files (one per day, valid from 22:59:42 the day before to 00:59:42 the day after) overlapping start to end.
+        Restituted orbit files are not provided.
+        """
+        if orbit_type != 'AUX_POEORB':
+            return []
+        names = []
+        day = datetime.datetime(start.year, start.month, start.day) - datetime.timedelta(days=1)
+        while day <= end + datetime.timedelta(days=1):
+            valid_start = day - datetime.timedelta(hours=1, seconds=18)
+            valid_end = day + datetime.timedelta(days=1, minutes=59, seconds=42)
+            if valid_start < end and valid_end > start:
+                names.append('S1%s_OPER_AUX_POEORB_OPOD_%s_V%s_%s.EOF'%(sat_ab, (day + datetime.timedelta(days=20)).strftime('%Y%m%dT120000'),
+                             valid_start.strftime('%Y%m%dT%H%M%S'), valid_end.strftime('%Y%m%dT%H%M%S')))
+            day += datetime.timedelta(days=1)
+        return names
+
+
+def make_block(name):
+    return hashlib.sha256(name.encode()).digest()*(block_size//32)
+
+
+######################## Stand-in servers ########################
+
+class ServiceProfile:
+    """
+    Behaviour of one stand-in service: latency in seconds before each response, bandwidth in bytes/s per connection
+    (0 for no limit), and the fraction of requests that fail, either with an error status or by dropping the connection partway.
+    """
+    def __init__(self, latency=0, bandwidth=0, failure_rate=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+
+    def as_dict(self):
+        return {'latency': self.latency, 'bandwidth': self.bandwidth, 'failure_rate': self.failure_rate}
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the ASF search API, ASF and AWS granule downloads (with byte ranges), listings of the AWS daily folders,
+    and the Copernicus orbit search and download.
+    """
+    protocol_version = 'HTTP/1.1'
+    archive = None
+    profiles = {}
+    limiter = None
+    rng = random.Random(0)
+    rng_lock = threading.Lock()
+    counts = {}
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        if url.path == search_path:
+            self.serve_search(query)
+        elif url.path.startswith(asf_data_path):
+            self.serve_file('asf', os.path.basename(url.path)[:-4], self.archive.file_size)
+        elif url.path.startswith(aws_data_path):
+            self.serve_file('aws', os.path.basename(url.path)[:-4], self.archive.file_size)
+        elif url.path == aws_list_path:
+            self.serve_aws_list(query)
+        elif url.path == orbit_api_path:
+            self.serve_orbit_search(query)
+        elif url.path.startswith(orbit_api_path + "('"):
+            name = urllib.parse.unquote(url.path[len(orbit_api_path) + 2:].split("')")[0])
+            self.serve_file('orbit', name, self.archive.orbit_size, disposition=name)
+        else:
+            self.send_status(404)
+
+    do_POST = do_GET
+
+    def start_response(self, service):
+        """
+        Apply the latency of the service, and decide whether this request fails. Returns None, 'error' or 'drop'.
+        """
+        profile = self.profiles[service]
+        with self.rng_lock:
+            self.counts[service] = self.counts.get(service,0) + 1
+            roll = self.rng.random()
+            failure = None if roll >= profile.failure_rate else ('error' if roll < profile.failure_rate/2 else 'drop')
+        if profile.latency:
+            time.sleep(profile.latency)
+        if failure == 'error':
+            self.send_status(503)
+        return failure
+
+    def send_status(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length','0')
+        self.end_headers()
+
+    def send_body(self, service, data_source, length, drop=False):
+        """
+        Send length bytes, read in blocks from data_source(offset, nbytes), at the bandwidth of the service.
+        If drop is set, the connection is closed halfway through.
+        """
+        profile = self.profiles[service]
+        start = time.time()
+        limit = length//2 if drop else length
+        sent = 0
+        while sent < limit:
+            nbytes = min(block_size, limit - sent)
+            if self.limiter is not None:
+                self.limiter.consume(nbytes)
+            self.wfile.write(data_source(sent, nbytes))
+            sent += nbytes
+            if profile.bandwidth:
+                delay = sent/profile.bandwidth - (time.time() - start)
+                if delay > 0:
+                    time.sleep(delay)
+        if drop:
+            self.close_connection = True
+
+    def serve_search(self, query):
+        if self.start_response('asf'):
+            return
+        fmt = '%Y-%m-%dT%H:%M:%SUTC'
+        start = datetime.datetime.strptime(query['start'], fmt) if 'start' in query else None
+        end = datetime.datetime.strptime(query['end'], fmt) if 'end' in query else None
+        rows = self.archive.rows(start, end, 'http://%s:%d'%self.server.server_address)
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=list(rows[0].keys()) if rows else ['Granule Name','URL'], quoting=csv.QUOTE_ALL)
+        writer.writeheader()
+        writer.writerows(rows)
+        data = buffer.getvalue().encode()
+        self.send_response(200)
+        self.send_header('Content-Type','text/csv; charset=utf-8')
+        self.send_header('Content-Length',str(len(data)))
+        self.end_headers()
+        self.send_body('asf', lambda offset,nbytes: data[offset:offset + nbytes], len(data))
+
+    def serve_file(self, service, name, size, disposition=None):
+        failure = self.start_response(service)
+        if failure == 'error':
+            return
+        if service != 'orbit' and (name not in self.archive.granules or (service == 'aws' and not self.archive.granules[name]['aws'])):
+            self.send_status(404)
+            return
+        start, end = 0, size - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range',''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range','bytes */%d'%size)
+                self.send_header('Content-Length','0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range','bytes %d-%d/%d'%(start,end,size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length',str(end - start + 1))
+        if disposition:
+            self.send_header('Content-Disposition','attachment; filename="%s"'%disposition)
+        self.end_headers()
+        self.send_body(service, lambda offset,nbytes: self.archive.read(name, start + offset, nbytes), end - start + 1, failure == 'drop')
+
+    def serve_aws_list(self, query):
+        """
+        S3 ListObjectsV2 response with the granule folders under a daily prefix (all in one page).
+        """
+        if self.start_response('aws'):
+            return
+        prefix = query.get('prefix','')
+        date = prefix[len(aws_data_path) - 1:].rstrip('/')
+        entries = ''.join('<CommonPrefixes><Prefix>%s%s/</Prefix></CommonPrefixes>'%(prefix,name) for name in self.archive.aws_folder(date))
+        data = ('<?xml version="1.0" encoding="UTF-8"?><ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                '<Prefix>%s</Prefix><IsTruncated>false</IsTruncated>%s</ListBucketResult>'%(prefix,entries)).encode()
+        self.send_response(200)
+        self.send_header('Content-Type','application/xml')
+        self.send_header('Content-Length',str(len(data)))
+        self.end_headers()
+        self.send_body('aws', lambda offset,nbytes: data[offset:offset + nbytes], len(data))
+
+    def serve_orbit_search(self, query):
+        if self.start_response('orbit'):
+            return
+        flt = query.get('$filter','')
+        sat_ab = re.search(r"startswith\(Name,'S1(\w)'\)", flt).group(1)
+        orbit_type = re.search(r"substringof\('(\w+)',Name\)", flt).group(1)
+        fmt = '%Y-%m-%dT%H:%M:%S'
+        # files that start before the end of the window, and end after its start
+        end = datetime.datetime.strptime(re.search(r"ContentDate/Start lt datetime'([^']+)'", flt).group(1), fmt)
+        start = datetime.datetime.strptime(re.search(r"ContentDate/End gt datetime'([^']+)'", flt).group(1), fmt)
+        names = self.archive.orbit_files(sat_ab, orbit_type, start, end)
+        skip = int(query.get('$skip',0))
+        names = names[skip:skip + int(query.get('$top',100))]
+        entries = ''.join('<entry><title>%s</title><m:properties><d:Id>%s</d:Id></m:properties></entry>'%(name,name) for name in names)
+        data = ('<?xml version="1.0" encoding="utf-8"?><feed xmlns="http://www.w3.org/2005/Atom" '
+                'xmlns:m="http://schemas.microsoft.com/ado/2007/08/dataservices/metadata" '
+                'xmlns:d="http://schemas.microsoft.com/ado/2007/08/dataservices">%s</feed>'%entries).encode()
+        self.send_response(200)
+        self.send_header('Content-Type','application/atom+xml')
+        self.send_header('Content-Length',str(len(data)))
+        self.end_headers()
+        self.send_body('orbit', lambda offset,nbytes: data[offset:offset + nbytes], len(data))
+
+
+def start_servers(archive, profiles, total_bandwidth=0, seed=0, port=0):
+    """
+    Start the stand-in servers in a background thread. Returns the server, and the environment variables that point
+    sentinel_query_download.py and the orbit functions to it.
+    """
+    handler = type('Handler', (StandInHandler,), {'archive': archive, 'profiles': profiles, 'rng': random.Random(seed), 'counts': {},
+                                                  'limiter': s1_download_func.BandwidthLimiter(total_bandwidth) if total_bandwidth else None})
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host = 'http://127.0.0.1:%d'%server.server_address[1]
+    env = {'S1_ASF_SEARCH_URL': host + search_path + '?', 'S1_AWS_BASE_URL': host + aws_data_path, 'S1_AWS_LIST_URL': host + aws_list_path,
+           'S1_ORBIT_API_URL': host + orbit_api_path, 'S1_ORBIT_QUERY_CACHE': ''}
+    return server, env
+
+
+######################## Benchmark cases ########################
+
+def bench_download(archive, env, workdir, nproc, nfiles, site='ASF', engine='python', scheduler='pool', segments=1, hedge=0, aws_index=False):
+    """
+    Run sentinel_query_download.py --download for the first nfiles granules in an empty directory.
+    """
+    os.makedirs(workdir)
+    end = archive.granules[archive.names[nfiles-1]]['date'] + datetime.timedelta(hours=1)
+    config = ['[api_search]', 'output = csv', 'platform = Sentinel-1A', 'processingLevel = SLC', 'beamMode = IW',
+              'start = %s'%archive.start.strftime('%Y-%m-%dT00:00:00UTC'), 'end = %s'%end.strftime('%Y-%m-%dT%H:%M:%SUTC'),
+              '[download]', 'download_site = %s'%site, 'nproc = %d'%nproc, 'download_engine = %s'%engine,
+              'scheduler = %s'%scheduler, 'segments = %d'%segments, 'hedge = %g'%hedge, 'metrics_log = metrics.jsonl',
+              'aws_index = %s'%('aws_index.sqlite' if aws_index else ''),
+              '[asf_download]', 'http-user = benchmark', 'http-password = benchmark']
+    with open(os.path.join(workdir,'benchmark.config'),'w') as f:
+        f.write('\n'.join(config) + '\n')
+    seconds = run_script(['sentinel_query_download.py','benchmark.config','--download'], workdir, env)
+    downloaded = [os.path.join(root,name) for root,dirs,names in os.walk(workdir) for name in names if name.endswith('.zip')]
+    complete = [name for name in downloaded if os.path.getsize(name) == archive.file_size]
+    events = s1_metrics_func.read_events(os.path.join(workdir,'metrics.jsonl')) if os.path.isfile(os.path.join(workdir,'metrics.jsonl')) else []
+    times = sorted(event['seconds'] for event in events if event['stage'] == 'download' and event.get('status') == 'ok')
+    query = [event['seconds'] for event in events if event['stage'] == 'query']
+    return {'seconds': seconds, 'files': len(complete), 'failed': nfiles - len(complete),
+            'MB_per_s': round(len(complete)*archive.file_size/1e6/seconds, 3),
+            'query_seconds': round(sum(query), 3),
+            'granule_seconds_p50': round(percentile(times, 50), 3), 'granule_seconds_p95': round(percentile(times, 95), 3)}
+
+
+def bench_orbits(archive, env, workdir, nproc, nfiles):
+    """
+    Run get_s1_orbits.py for the first nfiles granules with an empty orbit directory (cold), and again once the files are there (warm).
+    """
+    os.makedirs(workdir)
+    granules = [name + '.SAFE' for name in archive.names[:nfiles]]
+    cold = run_script(['get_s1_orbits.py','-o','orbits','-n',str(nproc)] + granules, workdir, env)
+    warm = run_script(['get_s1_orbits.py','-o','orbits','-n',str(nproc)] + granules, workdir, env)
+    found = len([name for name in os.listdir(os.path.join(workdir,'orbits')) if name.endswith('.EOF')])
+    return {'seconds': cold, 'warm_seconds': warm, 'orbit_files': found}
+
+
+def bench_frames(archive, workdir, nproc, nfiles):
+    """
+    Time the frame functions in this process: extracting nfiles zip files (all files, and one swath and polarization only),
+    and grouping the files by orbit with find_images_by_orbit, with a local orbit file for each day.
+    create_frame_tops.csh itself is not run.
+    """
+    zipdir = os.path.join(workdir,'zips')
+    orbitdir = os.path.join(workdir,'orbits')
+    os.makedirs(zipdir)
+    os.makedirs(orbitdir)
+    zips = []
+    for name in archive.names[:nfiles]:
+        zips.append(write_synthetic_zip(archive, name, zipdir))
+        date = archive.granules[name]['date']
+        for eof in archive.orbit_files('A', 'AUX_POEORB', date, date):
+            open(os.path.join(orbitdir,eof),'w').close()
+    results = {}
+    start = time.time()
+    s1_frame_func.unzip_images_to_dir(zips, os.path.join(workdir,'unzip_all'), nproc=nproc)
+    results['seconds'] = round(time.time() - start, 3)
+    results['MB_per_s'] = round(sum(os.path.getsize(name) for name in zips)/1e6/results['seconds'], 3)
+    start = time.time()
+    s1_frame_func.unzip_images_to_dir(zips, os.path.join(workdir,'unzip_iw1_vv'), swaths=[1], polarizations=['vv'], nproc=nproc)
+    results['subset_seconds'] = round(time.time() - start, 3)
+    start = time.time()
+    images, eofs = s1_frame_func.find_images_by_orbit([zipdir], [orbitdir], 'zip')
+    results['find_images_seconds'] = round(time.time() - start, 3)
+    results['orbits'] = len([eof for eof in eofs.values() if eof])
+    return results
+
+
+def write_synthetic_zip(archive, name, zipdir):
+    """
+    Write a zip file with the layout of a SAFE file: a manifest, and a measurement file for each of 3 swaths and 2 polarizations.
+    """
+    filename = os.path.join(zipdir, name + '.zip')
+    part_size = archive.file_size//6
+    with zipfile.ZipFile(filename, 'w', zipfile.ZIP_STORED) as zf:
+        zf.writestr(name + '.SAFE/manifest.safe', '<xfdu/>')
+        for swath in [1,2,3]:
+            for pol in ['vh','vv']:
+                member = '%s.SAFE/measurement/s1a-iw%d-slc-%s-%s.tiff'%(name, swath, pol, name[17:32].lower())
+                with zf.open(member, 'w') as f:
+                    for offset in range(0, part_size, block_size):
+                        f.write(archive.read(name, offset, min(block_size, part_size - offset)))
+    return filename
+
+
+def run_script(arguments, workdir, env):
+    """
+    Run one of the scripts in workdir with the given environment, and return the elapsed time in seconds.
+    """
+    logname = os.path.join(workdir, 'log_%s.txt'%os.path.splitext(arguments[0])[0])
+    start = time.time()
+    with open(logname,'a') as log:
+        subprocess.call([sys.executable, os.path.join(code_dir, arguments[0])] + arguments[1:], cwd=workdir,
+                        env=dict(os.environ, **env), stdout=log, stderr=log)
+    return round(time.time() - start, 3)
+
+
+def percentile(values, percent):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(round(percent/100*(len(values) - 1))))]
+
+
+######################## Results ########################
+
+def get_commit():
+    try:
+        return subprocess.run(['git','rev-parse','--short','HEAD'], cwd=code_dir, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def case_key(case, params):
+    return case + ' ' + json.dumps(params, sort_keys=True)
+
+
+def load_results(results_file):
+    """
+    Read earlier results, keeping the last one of each case and set of parameters.
+    """
+    previous = {}
+    if os.path.isfile(results_file):
+        for result in s1_metrics_func.read_events(results_file):
+            previous[case_key(result['case'], result['params'])] = result
+    return previous
+
+
+def report(result, previous, tolerance):
+    """
+    Print a result with the change from the previous run of the same case. Returns True if it is slower by more than tolerance.
+    """
+    params = ', '.join('%s=%s'%(key,value) for key,value in sorted(result['params'].items()) if key not in ['servers'])
+    line = '%-8s %-60s %8.2f s'%(result['case'], params, result['results']['seconds'])
+    extra = ', '.join('%s=%s'%(key,value) for key,value in result['results'].items() if key != 'seconds')
+    old = previous.get(case_key(result['case'], result['params']))
+    regression = False
+    if old and old['results']['seconds'] > 0:
+        change = result['results']['seconds']/old['results']['seconds'] - 1
+        regression = change > tolerance
+        line += ' (%+.0f%% vs %s%s)'%(100*change, old['commit'] or old['date'], ', REGRESSION' if regression else '')
+    print(line)
+    print('         ' + extra)
+    return regression
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark downloads, orbit searches and frame functions against local stand-in servers for ASF, AWS and the Copernicus orbit API.')
+    parser.add_argument('cases',type=str,nargs='*',default=['download','orbits','frames'],help='Cases to run: download, orbits and/or frames (default: all)')
+    parser.add_argument('-n','--nproc',type=str,default='1,4',help='Comma-separated list of nproc values to run each case with (default: 1,4)')
+    parser.add_argument('-f','--files',type=str,default='8',help='Comma-separated list of numbers of granules (default: 8)')
+    parser.add_argument('-s','--file-size',type=float,default=10,help='Size of each synthetic granule in MB (default: 10)')
+    parser.add_argument('--site',type=str,default='ASF',choices=['ASF','AWS','both','auto'],help='download_site for the download case (default: ASF)')
+    parser.add_argument('--engine',type=str,default='python',choices=['python','wget'],help='download_engine for the download case (default: python)')
+    parser.add_argument('--scheduler',type=str,default='pool',choices=['pool','asyncio'],help='scheduler for the download case (default: pool)')
+    parser.add_argument('--segments',type=int,default=1,help='segments for the download case (default: 1)')
+    parser.add_argument('--hedge',type=float,default=0,help='hedge for the download case, with --site auto (default: 0)')
+    parser.add_argument('--aws-index',action='store_true',help='Use the AWS index (aws_index option) in the download case (default: false)')
+    parser.add_argument('--aws-coverage',type=float,default=1.0,help='Fraction of the granules that are in the AWS stand-in (default: 1)')
+    parser.add_argument('--latency',type=float,default=0.05,help='Latency of each response in seconds (default: 0.05)')
+    parser.add_argument('--bandwidth',type=float,default=5,help='Bandwidth of each connection in MB/s, 0 for no limit (default: 5)')
+    parser.add_argument('--failure-rate',type=float,default=0,help='Fraction of requests that fail (default: 0)')
+    parser.add_argument('--aws-latency',type=float,default=None,help='Latency of the AWS stand-in (default: same as --latency)')
+    parser.add_argument('--aws-bandwidth',type=float,default=None,help='Bandwidth per connection of the AWS stand-in (default: same as --bandwidth)')
+    parser.add_argument('--aws-failure-rate',type=float,default=None,help='Failure rate of the AWS stand-in (default: same as --failure-rate)')
+    parser.add_argument('--total-bandwidth',type=float,default=0,help='Total bandwidth of all connections in MB/s, like a shared link; 0 for no limit (default: 0)')
+    parser.add_argument('--seed',type=int,default=0,help='Random seed for the failures (default: 0)')
+    parser.add_argument('-r','--results',type=str,default='benchmark_results.jsonl',help='File to append the results to, and compare with (default: benchmark_results.jsonl)')
+    parser.add_argument('-t','--tolerance',type=float,default=0.2,help='Report a regression if a case is slower than its last run by more than this fraction (default: 0.2)')
+    parser.add_argument('--fail-on-regression',action='store_true',help='Exit with status 1 if any regression is found (default: false)')
+    parser.add_argument('--workdir',type=str,default=None,help='Directory for the benchmark files; kept after the run if given (default: a temporary directory)')
+    parser.add_argument('--serve',action='store_true',help='Only run the stand-in servers until interrupted, and print the environment variables to use them (default: false)')
+    parser.add_argument('--port',type=int,default=0,help='Port for the stand-in servers (default: any free port)')
+    args = parser.parse_args()
+
+    nprocs = [int(i) for i in args.nproc.split(',')]
+    files = [int(i) for i in args.files.split(',')]
+    profile = ServiceProfile(args.latency, args.bandwidth*1e6, args.failure_rate)
+    aws_profile = ServiceProfile(args.latency if args.aws_latency is None else args.aws_latency,
+                                 (args.bandwidth if args.aws_bandwidth is None else args.aws_bandwidth)*1e6,
+                                 args.failure_rate if args.aws_failure_rate is None else args.aws_failure_rate)
+    profiles = {'asf': profile, 'aws': aws_profile, 'orbit': profile}
+    archive = SyntheticArchive(max(files), int(args.file_size*1e6), aws_coverage=args.aws_coverage)
+    server, env = start_servers(archive, profiles, args.total_bandwidth*1e6, args.seed, args.port)
+
+    if args.serve:
+        print('Stand-in servers running with %d granules. Set these environment variables to use them:'%len(archive.names))
+        for key,value in env.items():
+            print('export %s="%s"'%(key,value))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            sys.exit(0)
+
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix='s1_benchmark_')
+    os.makedirs(workdir, exist_ok=True)
+    servers = {name: profiles[name].as_dict() for name in profiles}
+    servers['total_bandwidth'] = args.total_bandwidth*1e6
+    servers['aws_coverage'] = args.aws_coverage
+    previous = load_results(args.results)
+    commit = get_commit()
+    regressions = 0
+    print('Benchmark files in %s\n'%workdir)
+    for case in args.cases:
+        for nfiles in files:
+            for nproc in nprocs:
+                params = {'nproc': nproc, 'files': nfiles, 'file_size': archive.file_size}
+                casedir = os.path.join(workdir, '%s_n%d_f%d_%d'%(case, nproc, nfiles, int(time.time()*1000)))
+                if case == 'download':
+                    params.update({'site': args.site, 'engine': args.engine, 'scheduler': args.scheduler, 'segments': args.segments, 'hedge': args.hedge,
+                                   'aws_index': args.aws_index, 'servers': servers})
+                    results = bench_download(archive, env, casedir, nproc, nfiles, args.site, args.engine, args.scheduler, args.segments, args.hedge, args.aws_index)
+                elif case == 'orbits':
+                    params['servers'] = servers
+                    results = bench_orbits(archive, env, casedir, nproc, nfiles)
+                elif case == 'frames':
+                    results = bench_frames(archive, casedir, nproc, nfiles)
+                else:
+                    raise ValueError('Unknown case %s, must be download, orbits or frames.'%case)
+                result = {'date': datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit,
+                          'case': case, 'params': params, 'results': results}
+                regressions += report(result, previous, args.tolerance)
+                with open(args.results,'a') as f:
+                    f.write(json.dumps(result) + '\n')
+    server.shutdown()
+    if not args.workdir:
+        shutil.rmtree(workdir)
+    print('\nResults appended to %s'%args.results)
+    if regressions:
+        print('%d cases were slower than their last run by more than %d%%.'%(regressions, 100*args.tolerance))
+        if args.fail_on_regression:
+            sys.exit(1)
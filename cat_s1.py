@@ -10,25 +10,42 @@ Created on Mon Oct 23 10:43:44 2017
 @author: elindsey
 """
 
-import s1_frame_func, argparse, multiprocessing, shutil, glob
+import s1_frame_func, s1_metrics_func, s1_journal_func, argparse, multiprocessing, threading, shutil, glob, os
 
 ######################## Command-line execution ########################
 
-if __name__ == '__main__':
+def main(argv=None):
+    """
+    Create the cropped frames described by the command-line arguments argv (default: sys.argv).
+    """
 
     # required arguments: a directory or set of directories to search, orbit directories, latitude bounds, and A/D to specify the orbit direction
     parser = argparse.ArgumentParser(description='Combine bursts from several Sentinel-1 scenes into a single frame, given a min/max lat. bound')
     parser.add_argument('searchdirs',type=str,nargs='+',help='List of directories (or wildcards) containing SAFE or .zip files to be combined.')
-    parser.add_argument('-o','--orbit',type=str,action='append',required=True,help='Path to a directory holding orbit files, required. Repeat option to search multiple directories.')
+    parser.add_argument('-o','--orbit',type=str,action='append',required=True,help='Path to a directory holding orbit files, or an orbit archive made with pack_s1_orbits.py, required. Repeat option to search multiple directories.')
     parser.add_argument('-l','--lonlat',type=str,required=True,help='Lon/Lat pins for the crop script in the GMT R-argument format lon1/lat1/lon2/lat2, required.')
     parser.add_argument('-d','--direction',type=str,required=True,help='Orbit direction (A/D), required.')
     # optional arguments
     parser.add_argument('-n','--nproc',type=int,default=1,help='Number of processors to run in parallel, optional (default: 1)')
-    parser.add_argument('-r','--rerun',action='store_true',default=False,help='Re-run and overwrite existing cropped SAFE directories (default: false, will skip any orbits with an existing SAFE folder)')
+    parser.add_argument('-r','--rerun',action='store_true',default=False,help='Re-run and overwrite existing cropped SAFE directories (default: false, will skip any orbits with an existing SAFE folder whose inputs have not changed)')
     parser.add_argument('-z','--unzipped',action='store_true',default=False,help='Look for unzipped SAFE directories instead of the original zip files (default: false).')
+    parser.add_argument('-s','--swaths',type=str,default=None,help='Comma-separated list of swaths to extract from the zip files, e.g. 1,2 (default: all)')
+    parser.add_argument('-p','--polarizations',type=str,default=None,help='Comma-separated list of polarizations to extract from the zip files, e.g. vv (default: all)')
+    parser.add_argument('-t','--unzip-threads',type=int,default=4,help='Number of zip files to extract in parallel for each orbit (default: 4)')
+    parser.add_argument('-b','--burst-filter',action='store_true',default=False,help='Before processing, read the burst footprints of each image and skip images with no bursts between the pins (default: false)')
+    parser.add_argument('--footprint-cache',type=str,default='burst_footprints.json',help='File to save burst footprints in, for use with --burst-filter (default: burst_footprints.json)')
+    parser.add_argument('--scratch',type=str,default='.',help='Directory for the temporary work directories, e.g. a local SSD or tmpfs (default: current directory)')
+    parser.add_argument('--staged',action='store_true',default=False,help='Run extraction, create_frame_tops.csh and cleanup of each orbit as separate stages with their own limits, so that disk and CPU work overlap. --nproc then sets the number of simultaneous create_frame_tops.csh runs (default: false)')
+    parser.add_argument('--extract-nproc',type=int,default=1,help='Number of orbits to extract at the same time, with --staged (default: 1)')
+    parser.add_argument('--finish-nproc',type=int,default=1,help='Number of orbits to move back and clean up at the same time, with --staged (default: 1)')
+    parser.add_argument('--metrics-log',type=str,default=None,help='Save the time taken by each step (orbit lookup, unzip, create_frame_tops.csh) to this file as JSON lines, and a summary in Prometheus text format to the same name with .prom added (default: none)')
+    parser.add_argument('--state-file',type=str,default='cat_s1_state.json',help='File recording the inputs (images, orbit file, pins) of each cropped SAFE, used to re-run only the orbits whose inputs changed (default: cat_s1_state.json)')
+    parser.add_argument('--journal',type=str,default='cat_s1_journal.jsonl',help='Journal recording when the job of each orbit starts and finishes, used to clean up after an interrupted run (default: cat_s1_journal.jsonl)')
     # parse
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     print(args)
+    if args.metrics_log:
+        s1_metrics_func.enable(args.metrics_log)
 
     # read lons/lats into arrays
     lonlats=[float(i) for i in args.lonlat.split('/')]
@@ -39,14 +56,41 @@ if __name__ == '__main__':
     ll_fname = 'two_pins.ll'
     s1_frame_func.write_ll_pins(ll_fname, lons, lats, args.direction)
 
+    # swaths and polarizations to extract
+    swaths=[int(i) for i in args.swaths.split(',')] if args.swaths else None
+    polarizations=[i.strip().lower() for i in args.polarizations.split(',')] if args.polarizations else None
+
     # find a list of all scenes and organize them by orbit number.
     if args.unzipped:
         ftype='SAFE'
     else:
         ftype='zip'
-    [images_by_orbit, eofs] = s1_frame_func.find_images_by_orbit(args.searchdirs, args.orbit, ftype)
+
+    # skip images that have no bursts between the pins, using the footprints read from each image's annotation files.
+    # This is done before the orbit files are looked up, so that orbits with no images left need no orbit file
+    def burst_filter(allimages):
+        keep=s1_frame_func.filter_images_by_latitude(allimages, min(lats), max(lats), args.footprint_cache, args.unzip_threads)
+        print('burst filter: %d of %d images have bursts between the pins'%(len(keep),len(allimages)))
+        return keep
+    [images_by_orbit, eofs] = s1_frame_func.find_images_by_orbit(args.searchdirs, args.orbit, ftype, burst_filter if args.burst_filter else None)
     print('found %d orbits'%len(images_by_orbit))
-    
+
+    # inputs recorded for each cropped SAFE by previous runs
+    state = s1_frame_func.read_frame_state(args.state_file)
+    pending = dict()
+
+    # jobs that were started but did not finish, because an earlier run was interrupted: their work directories
+    # and any SAFE folder found for them are incomplete
+    journal = s1_journal_func.JobJournal(args.journal)
+    for entry in journal.get_unfinished('frame'):
+        print('Orbit %s was interrupted in an earlier run, cleaning up'%entry['key'])
+        s1_frame_func.remove_stale_workdir(entry['workdir'])
+        for partial_safe in glob.glob('S1*_%s_*_*.SAFE'%entry['key'].split('_')[1]):
+            print('Deleting incomplete %s'%partial_safe)
+            shutil.rmtree(partial_safe)
+        state.pop(entry['key'], None)
+        journal.record('frame', entry['key'], s1_journal_func.state_failed, workdir=entry['workdir'])
+
     argslist=[]
     # for each satellite pass
     for ab_orbit in images_by_orbit:
@@ -54,6 +98,9 @@ if __name__ == '__main__':
         
         #get just the numeric part of the orbit ID
         orbit_num=ab_orbit.split('_')[1]
+        #fingerprint of the inputs for this orbit
+        inputs=s1_frame_func.get_frame_inputs(images_by_orbit[ab_orbit], eofs[ab_orbit], ll_fname, swaths, polarizations)
+        fingerprint=s1_frame_func.get_frame_fingerprint(inputs)
         #look for a matching SAFE folder in this directory
         existing_safe=glob.glob('S1*_%s_*_*.SAFE'%orbit_num)
         if existing_safe:
@@ -61,23 +108,68 @@ if __name__ == '__main__':
               #if a matching safe folder exists, and this is a re-run, delete that safe folder.
               print('Rerun specified, deleting %s'%existing_safe[0])
               shutil.rmtree(existing_safe[0])
-          else:
-              #if a matching safe folder exists, but this is not a re-run, do not reprocess this orbit.
+          elif ab_orbit not in state:
+              #if a matching safe folder exists from a run without a state file, assume it is up to date and record its inputs.
+              print('Existing cropped image found with no record of its inputs, recording the current inputs and skipping orbit %s\n'%ab_orbit)
+              state[ab_orbit]={'safe': existing_safe[0], 'fingerprint': fingerprint, 'inputs': inputs}
+              continue
+          elif state[ab_orbit]['fingerprint'] == fingerprint:
+              #if a matching safe folder exists and its inputs have not changed, do not reprocess this orbit.
               print('Existing cropped image found, skipping orbit %s\n'%ab_orbit)
               continue
+          else:
+              #if the inputs have changed (new images, a newer orbit file, or other pins), delete that safe folder and reprocess.
+              print('Inputs changed for orbit %s (%s), deleting %s'%(ab_orbit, ', '.join(s1_frame_func.describe_frame_changes(state[ab_orbit]['inputs'],inputs)), existing_safe[0]))
+              shutil.rmtree(existing_safe[0])
+        pending[ab_orbit]=(orbit_num, fingerprint, inputs)
 
         print('images: %s'%images_by_orbit[ab_orbit])
         print('EOF: %s\n'%eofs[ab_orbit])
 
         log_fname='log_%s.txt'%ab_orbit
         #safe_fname = 'SAFE_filelist_%s.txt'%ab_orbit
-        temp_workdir = 'temp_cat_orbit_' + ab_orbit
+        temp_workdir = os.path.join(args.scratch, 'temp_cat_orbit_' + ab_orbit)
+        s1_frame_func.remove_stale_workdir(temp_workdir)
 
         # append args to list of tuples for parallel run
-        argslist.append( (images_by_orbit[ab_orbit], eofs[ab_orbit], ll_fname, log_fname, temp_workdir, args.unzipped) )
+        argslist.append( (images_by_orbit[ab_orbit], eofs[ab_orbit], ll_fname, log_fname, temp_workdir, args.unzipped, swaths, polarizations, args.unzip_threads) )
+
+    # record the inputs of each orbit as soon as it is processed successfully, so that an interrupted run keeps the finished orbits
+    orbits_by_workdir = {os.path.abspath(job[4]): ab_orbit for job,ab_orbit in zip(argslist, pending)}
+    state_lock = threading.Lock()
+    def record_result(workdir, success):
+        ab_orbit = orbits_by_workdir[os.path.abspath(workdir)]
+        orbit_num, fingerprint, inputs = pending[ab_orbit]
+        new_safe=glob.glob('S1*_%s_*_*.SAFE'%orbit_num)
+        with state_lock:
+            if success and new_safe:
+                state[ab_orbit]={'safe': new_safe[0], 'fingerprint': fingerprint, 'inputs': inputs}
+            else:
+                state.pop(ab_orbit, None)
+            s1_frame_func.write_frame_state(args.state_file, state)
+            journal.record('frame', ab_orbit, s1_journal_func.state_done if success and new_safe else s1_journal_func.state_failed, workdir=os.path.abspath(workdir))
+
+    # orbits skipped above may have had their existing SAFE recorded
+    s1_frame_func.write_frame_state(args.state_file, state)
+    for job,ab_orbit in zip(argslist, pending):
+        journal.record('frame', ab_orbit, s1_journal_func.state_started, workdir=os.path.abspath(job[4]))
 
     # run GMTSAR function 'create_frame_tops.csh' in parallel
-    multiprocessing.set_start_method("spawn")
-    with multiprocessing.get_context("spawn").Pool(processes=args.nproc) as pool:
-        pool.starmap(s1_frame_func.create_frame_tops_parallel, argslist, chunksize=1)
-        
+    if args.staged:
+        results = s1_frame_func.create_frame_tops_staged(argslist, args.extract_nproc, args.nproc, args.finish_nproc, record_result)
+    else:
+        multiprocessing.set_start_method("spawn", force=True)
+        results = []
+        with multiprocessing.get_context("spawn").Pool(processes=args.nproc) as pool:
+            for workdir,success in pool.imap_unordered(s1_frame_func.create_frame_tops_job, argslist, chunksize=1):
+                record_result(workdir, success)
+                results.append(success)
+    if not all(results):
+        print('Warning: %d of %d orbits failed, see the messages above.'%(results.count(False),len(results)))
+
+    if args.metrics_log:
+        s1_metrics_func.write_summary(args.metrics_log + '.prom')
+
+
+if __name__ == '__main__':
+    main()
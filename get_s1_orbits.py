@@ -3,54 +3,43 @@
 """
 Script to link most recent orbit file for each SAFE file.
 Created on Thu Jul 15 10:00:01 2021
-Last updated April 2023
+Last updated October 2026
 @author: elindsey
 """
-import os,shutil,argparse,multiprocessing
-import s1_orbit_func
+import sys,argparse
+import s1_orbit_func,s1_metrics_func
 
-if __name__ == '__main__':
+def main(argv=None):
+    """
+    Find and download the orbit files for the granules given in the command-line arguments argv (default: sys.argv).
+    """
     parser = argparse.ArgumentParser(description='Find and download a Sentinel-1 Orbit file (Precise or Restituted) matching an input Granule file (SAFE or zip format). Searches in orbit-dir location, and files will be downloaded there too, then copied or linked to the current directory.')
     parser.add_argument('granules',type=str,nargs='+',action='extend',help='supply name of granule(s) for which to find a matching orbit. Required. Example: S1A_IW_SLC__1SDV_20180810T224749_20180810T224816_023190_02850D_0C43.SAFE')
-    parser.add_argument('-o','--orbit-dir',type=str,default='.',help='Directory to download the resulting scenes to (default: current directory)')
+    parser.add_argument('-o','--orbit-dir',type=str,default='.',help='Directory to download the resulting scenes to, or an orbit archive made with pack_s1_orbits.py (default: current directory)')
     parser.add_argument('-p','--precise',action='store_true',help='Precise orbit file only. (default: precise preferred, but will use restituted if no precise orbit is available.)')
     parser.add_argument('-l','--link',action='store_true',help='Link the files instead of copying them (default: will copy the files to the current location from the --orbit-dir location.)')
-    parser.add_argument('-n','--nproc',type=int,default=16,help='Number of processors to run in parallel, optional (default: 16)')
-    args = parser.parse_args()
+    parser.add_argument('-n','--nproc',type=int,default=16,help='Number of orbit files to download in parallel, optional (default: 16)')
+    parser.add_argument('--metrics-log',type=str,default=None,help='Save the time taken by each orbit search and download to this file as JSON lines, and a summary in Prometheus text format to the same name with .prom added (default: none)')
+    args = parser.parse_args(argv)
+    if args.metrics_log:
+        s1_metrics_func.enable(args.metrics_log)
     
-    #set defaults
-    download_missing = True
-    skip_notfound = False
-    print_results = True
-
-    # create orbit dictionary
-    orbitlist = {}
+    # find all orbits at once: existing files are looked up in the orbit index, and the rest are
+    # searched with one API query per satellite and time span, downloading each distinct file only once
     print('Checking for matching orbit files.\n')
-    for granule in args.granules:
-        [sat_ab, sat_mode, start, end, orbit_num] = s1_orbit_func.parse_s1_SAFE_name(granule)
-        if orbit_num in orbitlist:
-        # if the item exists in the dictionary, extend the start/end time as necessary
-            if start < orbitlist[orbit_num]['start']:
-                orbitlist[orbit_num]['start'] = start
-            if end > orbitlist[orbit_num]['end']:
-                orbitlist[orbit_num]['end'] = end
-        else:
-            # if orbit num is not in the orbit dict, add to it
-            orbitlist[orbit_num] = {'sat_ab': sat_ab, 'start': start, 'end': end}
+    eofs = s1_orbit_func.get_orbit_files_batch(args.granules,[args.orbit_dir],download_missing=True,preciseonly=args.precise,nproc=args.nproc)
+    print('Found %d orbits.\n'%len(eofs))
 
-    print('Found %d orbits.\n'%len(orbitlist))
-    # compose the list of argument tuples to pass to the function
-    argslist=[]
-    for orbit,vals in orbitlist.items():
-        sat_ab = vals['sat_ab']
-        start = vals['start']
-        end = vals['end']
-        argslist.append((sat_ab,start,end,[args.orbit_dir],download_missing,skip_notfound,args.precise,print_results))
-
-    # for each identified orbit, look for the file, and download if necessary
-    multiprocessing.set_start_method("spawn")
-    with multiprocessing.get_context("spawn").Pool(processes=args.nproc) as pool:
-        results = pool.starmap(s1_orbit_func.get_latest_orbit_file, argslist, chunksize=1)
+    # nothing was found for some orbits - print an error
+    notfound = [ab_orbit for ab_orbit,eof in eofs.items() if eof is None]
+    for ab_orbit in notfound:
+        print('Error: No matching orbit file found for %s in %s'%(ab_orbit,args.orbit_dir))
+    if args.metrics_log:
+        s1_metrics_func.write_summary(args.metrics_log + '.prom')
+    if notfound:
+        sys.exit(1)
 
     print('\nDone getting orbits.\n')
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pack the EOF files of one or more orbit folders into a single orbit archive (see s1_orbit_func.OrbitArchive).
+The archive can then be given in place of an orbit folder to cat_s1.py (-o), get_s1_orbits.py (-o) and the
+orbit_dir option of sentinel_query_download.py; orbit files are extracted from it only when they are used.
+
+Created October 2026
+"""
+
+import os,sys,argparse
+from concurrent.futures import ThreadPoolExecutor
+import s1_orbit_func
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack Sentinel-1 orbit files (EOF) into a single compressed, indexed orbit archive.')
+    parser.add_argument('archive',type=str,help='Orbit archive to create or add to; the name must end with %s. Required.'%s1_orbit_func.orbit_archive_suffix)
+    parser.add_argument('orbit_dirs',type=str,nargs='+',help='Folders holding the EOF files to add. Required.')
+    parser.add_argument('-v','--state-vectors',action='store_true',help='Also store the state vectors of each file in a memory-mappable array next to the archive (default: false)')
+    parser.add_argument('-r','--remove',action='store_true',help='Delete each EOF file once it is stored in the archive (default: false, keep the files)')
+    parser.add_argument('-n','--nproc',type=int,default=4,help='Number of files to compress in parallel (default: 4)')
+    args = parser.parse_args()
+
+    if not s1_orbit_func.is_orbit_archive(args.archive):
+        print('Error: the orbit archive name must end with %s'%s1_orbit_func.orbit_archive_suffix)
+        sys.exit(1)
+    archive = s1_orbit_func.get_orbit_archive(args.archive)
+    stored = archive.sizes()
+    eofs = sorted(os.path.join(orbit_dir,name) for orbit_dir in args.orbit_dirs for name in os.listdir(orbit_dir)
+                  if name.startswith('S1') and name.endswith('.EOF'))
+    new = [eof for eof in eofs if os.path.basename(eof) not in stored]
+    print('Found %d orbit files, %d not yet in %s.'%(len(eofs),len(new),args.archive))
+
+    def add(eof):
+        try:
+            return archive.add(eof, args.state_vectors)
+        except (OSError, ValueError) as e:
+            print('Warning: could not add %s: %s'%(eof,e))
+            return False
+    with ThreadPoolExecutor(max_workers=args.nproc) as executor:
+        added = list(executor.map(add, new)).count(True)
+    print('Added %d files.'%added)
+
+    if args.remove:
+        # delete only files that are in the archive with the same size
+        stored = archive.sizes()
+        removed = 0
+        for eof in eofs:
+            if stored.get(os.path.basename(eof)) == os.path.getsize(eof):
+                os.remove(eof)
+                removed += 1
+        print('Removed %d files that are stored in the archive.'%removed)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local catalog of granules found by ASF queries, with the download state of each one.
+Used by sentinel_query_download.py to run incremental queries, and to download only new or incomplete granules.
+Also an index of the granules available in the AWS dataset, built from listings of its daily folders.
+
+Created October 2026
+"""
+
+import os,json,time,hashlib,sqlite3,threading
+
+# download states recorded in the catalog
+state_new = 'new'
+state_complete = 'complete'
+state_failed = 'failed'
+
+
+class GranuleCatalog:
+    """
+    SQLite database with one row per granule (name, frame directory, file name, state and the full query result row),
+    the queries that found each granule, and the time of the last successful run of each query.
+    The catalog may be used from several threads of the same process.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, timeout=60, check_same_thread=False)
+        self.db.execute('create table if not exists granules (name text primary key, frame_dir text, file_name text, '
+                        'state text, updated real, row text)')
+        self.db.execute('create table if not exists queries (query_key text primary key, query text, last_run text)')
+        self.db.execute('create table if not exists query_granules (query_key text, name text, primary key (query_key, name))')
+        self.db.commit()
+
+    def add_granule(self, row, frame_dir, key=None):
+        """
+        Record a granule from a query result row, keeping the state of a granule that is already known,
+        and the query (identified by query_key) that found it, if given. Returns the state of the granule.
+        """
+        name = row['Granule Name']
+        with self.lock:
+            found = self.db.execute('select state from granules where name=?', (name,)).fetchone()
+            if found:
+                self.db.execute('update granules set frame_dir=?, row=? where name=?', (frame_dir, json.dumps(row), name))
+            else:
+                self.db.execute('insert into granules values (?,?,?,?,?,?)',
+                                (name, frame_dir, row['URL'].split('/')[-1], state_new, time.time(), json.dumps(row)))
+            if key is not None:
+                self.db.execute('insert or ignore into query_granules values (?,?)', (key, name))
+            self.db.commit()
+        return found[0] if found else state_new
+
+    def is_complete(self, name):
+        """
+        Check whether a granule was downloaded and its file is still in place.
+        """
+        with self.lock:
+            found = self.db.execute('select state, frame_dir, file_name from granules where name=?', (name,)).fetchone()
+        return bool(found) and found[0] == state_complete and os.path.isfile(os.path.join(found[1], found[2]))
+
+    def set_state(self, name, state):
+        with self.lock:
+            self.db.execute('update granules set state=?, updated=? where name=?', (state, time.time(), name))
+            self.db.commit()
+
+    def get_incomplete(self, key=None):
+        """
+        Return the query result rows of the granules that are not yet completely downloaded: those found by the query
+        identified by key (together with any recorded before queries were stored with the granules), or all of them if key is None.
+        """
+        with self.lock:
+            if key is None:
+                rows = self.db.execute('select name, row from granules where state != ? order by name', (state_complete,)).fetchall()
+            else:
+                rows = self.db.execute('select name, row from granules where state != ? and (name in (select name from query_granules where query_key=?) '
+                                       'or name not in (select name from query_granules)) order by name', (state_complete, key)).fetchall()
+        return [json.loads(row) for name,row in rows]
+
+    def get_all(self):
+        """
+        Return the query result rows of all granules in the catalog.
+        """
+        with self.lock:
+            rows = self.db.execute('select row from granules order by name').fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get_last_run(self, arg_list):
+        """
+        Return the start time of the last successful run of a query (as a string in ASF API format), or None.
+        """
+        with self.lock:
+            found = self.db.execute('select last_run from queries where query_key=?', (query_key(arg_list),)).fetchone()
+        return found[0] if found else None
+
+    def set_last_run(self, arg_list, last_run):
+        with self.lock:
+            self.db.execute('insert or replace into queries values (?,?,?)', (query_key(arg_list), json.dumps(arg_list), last_run))
+            self.db.commit()
+
+
+def query_key(arg_list):
+    """
+    Identify a query by a hash of its sorted (keyword, value) pairs.
+    """
+    return hashlib.sha1(json.dumps(sorted([list(item) for item in arg_list])).encode()).hexdigest()
+
+
+class AwsIndex:
+    """
+    SQLite database of the granules found in each daily folder (YYYY/MM/DD/) of the AWS Sentinel-1 dataset.
+    A folder is listed again only once its listing is older than ttl seconds, since new granules may still be added.
+    The index may be used from several threads of the same process.
+    """
+    def __init__(self, filename, ttl=86400):
+        self.filename = filename
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, timeout=60, check_same_thread=False)
+        self.db.execute('create table if not exists days (date text primary key, listed real)')
+        self.db.execute('create table if not exists granules (name text primary key, date text)')
+        self.db.commit()
+
+    def is_listed(self, date):
+        """
+        Check whether the folder for a date (YYYY-MM-DD) has a listing that is still current.
+        """
+        with self.lock:
+            found = self.db.execute('select listed from days where date=?', (date,)).fetchone()
+        return bool(found) and time.time() - found[0] < self.ttl
+
+    def set_day(self, date, names):
+        """
+        Replace the granules recorded for a date with the names found in its folder.
+        """
+        with self.lock:
+            self.db.execute('delete from granules where date=?', (date,))
+            self.db.executemany('insert or replace into granules values (?,?)', [(name, date) for name in names])
+            self.db.execute('insert or replace into days values (?,?)', (date, time.time()))
+            self.db.commit()
+
+    def available(self, name, date):
+        """
+        Return True if a granule is in the AWS dataset, False if it is not, or None if the folder for its date has not been listed.
+        """
+        with self.lock:
+            if not self.db.execute('select 1 from days where date=?', (date,)).fetchone():
+                return None
+            return bool(self.db.execute('select 1 from granules where name=?', (name,)).fetchone())
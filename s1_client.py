@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Thin client for s1_service.py. Sends a job to the running service over its Unix socket, to be run in the current directory,
+prints the output of the job as it arrives, and exits with the exit status of the job.
+Only the standard library is imported, so the client itself starts in a few milliseconds.
+
+Created October 2026
+"""
+
+import os,sys,json,socket,argparse
+
+# Unix socket of the service. May be changed with the environment variable S1_SERVICE_SOCKET
+default_socket = os.environ.get('S1_SERVICE_SOCKET', os.path.join(os.path.expanduser('~'), '.cache', 's1_service.sock'))
+
+# jobs run by the service, and the script whose command-line arguments each one takes
+job_scripts = {'query': 'sentinel_query_download.py', 'download': 'sentinel_query_download.py', 'orbits': 'get_s1_orbits.py', 'frames': 'cat_s1.py'}
+
+
+def send_job(job, argv=None, socket_path=default_socket, out=sys.stdout):
+    """
+    Send a job with its command-line arguments to the service, and write its output to out as it arrives.
+    Returns the exit status of the job and its result (e.g. the state of the service, for the job 'status').
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall((json.dumps({'job': job, 'argv': argv or [], 'cwd': os.getcwd()}) + '\n').encode())
+        with sock.makefile('r') as f:
+            for line in f:
+                message = json.loads(line)
+                if 'output' in message:
+                    out.write(message['output'])
+                    out.flush()
+                else:
+                    return message['status'], message.get('result')
+    raise ConnectionError('The service closed the connection before the job finished.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a job in the running s1_service.py: query or download (arguments of sentinel_query_download.py), orbits (get_s1_orbits.py), frames (cat_s1.py), status, or stop.')
+    parser.add_argument('-S','--socket',type=str,default=default_socket,help='Unix socket of the service (default: %s, or set S1_SERVICE_SOCKET)'%default_socket)
+    parser.add_argument('job',type=str,choices=list(job_scripts) + ['status','stop'],help='Job to run. Required.')
+    parser.add_argument('args',nargs=argparse.REMAINDER,help='Command-line arguments of the script that runs the job, e.g. the config file for query and download.')
+    args = parser.parse_args()
+
+    try:
+        status, result = send_job(args.job, args.args, args.socket)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print('No service running at %s. Start it with: python s1_service.py'%args.socket, file=sys.stderr)
+        sys.exit(2)
+    if result is not None:
+        print(json.dumps(result, indent=1) if isinstance(result, dict) else result)
+    sys.exit(status)
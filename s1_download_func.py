@@ -0,0 +1,620 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Native python download functions for Sentinel-1 granules, used in place of calling wget once per file.
+Each process keeps one pooled HTTP session, files are streamed in chunks to a '.part' file
+that is renamed when complete, and partial downloads are resumed with an HTTP Range request like 'wget -c'.
+Large files may also be split into byte ranges that are fetched over several connections at once,
+and the total download rate of the process may be capped with set_bandwidth_limit.
+Downloaded files can be checked against the size and MD5 checksum given in the ASF query result.
+The throughput and reliability of each download source can be tracked with SourceStats, to choose the faster source.
+Granules are passed to download workers as compact GranuleRecords, with the download settings set once per worker process.
+
+Created October 2026
+"""
+
+import os,time,json,shutil,hashlib,threading,random,sqlite3,requests
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+from urllib.parse import urlparse
+import s1_metrics_func
+
+# size of the chunks streamed from the server and written to disk
+chunk_size = 4*1024*1024
+
+# (connect, read) timeouts in seconds for each request
+request_timeout = (30,300)
+
+# maximum number of open connections kept per host; should be at least the number of segments
+pool_maxsize = 32
+
+# ASF downloads are redirected to this host for login
+earthdata_host = 'urs.earthdata.nasa.gov'
+
+# one session per process, created on first use so that every pool worker keeps its own open connections
+_session = None
+
+# shared bandwidth limit for all downloads in this process, set with set_bandwidth_limit
+_limiter = None
+
+
+class BandwidthLimiter:
+    """
+    Token bucket shared by all download threads of a process. consume() blocks until
+    the requested number of bytes fits under the rate limit.
+    """
+    def __init__(self, rate):
+        self.rate = float(rate)
+        # allow bursts of up to one chunk, or one second of transfer if that is larger
+        self.capacity = max(self.rate, chunk_size)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, nbytes):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last)*self.rate)
+            self.last = now
+            self.tokens -= nbytes
+            wait = -self.tokens/self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+def set_bandwidth_limit(rate):
+    """
+    Limit the total download rate of all downloads in this process to rate bytes/s. A rate of 0 or None removes the limit.
+    """
+    global _limiter
+    _limiter = BandwidthLimiter(rate) if rate else None
+
+
+class EarthdataSession(requests.Session):
+    """
+    requests drops the Authorization header whenever it is redirected to another host.
+    ASF redirects downloads to the Earthdata login host, so keep the credentials for that host only.
+    """
+    def rebuild_auth(self, prepared_request, response):
+        headers = prepared_request.headers
+        if 'Authorization' in headers:
+            original_host = urlparse(response.request.url).hostname
+            redirect_host = urlparse(prepared_request.url).hostname
+            if original_host != redirect_host and redirect_host != earthdata_host and original_host != earthdata_host:
+                del headers['Authorization']
+
+
+def get_session():
+    """
+    Return the HTTP session of the current process, creating it on first use.
+    The session is shared by all downloads, so credentials are never set on it: ASF credentials are passed with each ASF request.
+    """
+    global _session
+    if _session is None:
+        _session = EarthdataSession()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=3)
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
+
+
+class DownloadCancelled(OSError):
+    """
+    Raised inside a download when its cancel event is set.
+    """
+
+
+def download_url(url,dest_dir,auth=None,segments=1,segment_size=0,cancel=None):
+    """
+    Download a file to dest_dir, keeping the remote file name.
+    If segments > 1, the file is fetched over several connections (see download_url_segmented),
+    otherwise it is streamed over a single connection (see download_url_stream).
+    auth is the (user, password) tuple of an ASF download, sent with the requests of this download only; leave it out for AWS.
+    If cancel (a threading.Event) is given, the download stops when it is set, leaving the partial file in place.
+    Returns 0 on success and 1 on failure, matching the exit status convention of wget.
+    """
+    if segments > 1:
+        return download_url_segmented(url,dest_dir,auth,segments,segment_size,cancel)
+    return download_url_stream(url,dest_dir,auth,cancel)
+
+
+def download_url_stream(url,dest_dir,auth=None,cancel=None,continue_segments=True):
+    """
+    Download a file to dest_dir over a single connection, keeping the remote file name.
+    An existing file or '.part' file is continued from its current size, as with 'wget -c'.
+    A '.part' file left by download_url_segmented is preallocated to the full size, so its size says nothing about its contents:
+    it is continued over one connection with download_url_segmented if continue_segments is set, and otherwise deleted.
+    Returns 0 on success and 1 on failure, matching the exit status convention of wget.
+    """
+    filename = os.path.join(dest_dir, url.split('/')[-1])
+    partfile = filename + '.part'
+    statefile = filename + '.segments'
+    if os.path.isfile(statefile):
+        try:
+            with open(statefile) as f:
+                start,end = json.load(f)['ranges'][0]
+        except (ValueError, KeyError, IndexError, TypeError):
+            start,end = 0,0
+        if continue_segments and os.path.isfile(partfile) and end > start:
+            return download_url_segmented(url,dest_dir,auth,1,end - start,cancel)
+        print('Discarding the partial segmented download of %s, starting again.'%filename)
+        for name in [partfile, statefile]:
+            if os.path.isfile(name):
+                os.remove(name)
+    # find any earlier partial (or complete) result to continue from
+    if os.path.isfile(partfile):
+        existing = partfile
+    elif os.path.isfile(filename):
+        existing = filename
+    else:
+        existing = None
+    offset = os.path.getsize(existing) if existing else 0
+    headers = {'Range': 'bytes=%d-'%offset} if offset > 0 else {}
+
+    session = get_session()
+    tstart = time.time()
+    try:
+        with session.get(url, headers=headers, auth=auth, stream=True, timeout=request_timeout) as response:
+            if response.status_code == 416 and offset > 0:
+                # nothing left past our offset: the file was already fully retrieved
+                if existing == partfile:
+                    os.replace(partfile, filename)
+                print('File %s is already fully retrieved.'%filename)
+                return 0
+            response.raise_for_status()
+            if response.status_code != 206:
+                # server ignored the range request, start again from the beginning
+                offset = 0
+            expected = response.headers.get('Content-Length')
+            expected = int(expected) + offset if expected is not None else None
+            if existing and existing != partfile:
+                os.replace(existing, partfile)
+            nbytes = 0
+            with open(partfile, 'ab' if offset > 0 else 'wb') as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    if cancel is not None and cancel.is_set():
+                        raise DownloadCancelled('download cancelled')
+                    if _limiter is not None:
+                        _limiter.consume(len(chunk))
+                    f.write(chunk)
+                    nbytes += len(chunk)
+    except (requests.RequestException, OSError) as e:
+        print('Download of %s failed: %s'%(url,e))
+        return 1
+
+    if expected is not None and os.path.getsize(partfile) != expected:
+        print('Download of %s incomplete: got %d of %d bytes.'%(url,os.path.getsize(partfile),expected))
+        return 1
+    os.replace(partfile, filename)
+    elapsed = max(time.time() - tstart, 1e-6)
+    print('Downloaded %s: %.1f MB in %.1f s (%.2f MB/s)'%(os.path.basename(filename), nbytes/1e6, elapsed, nbytes/1e6/elapsed))
+    return 0
+
+
+def get_downloaded_bytes(filename):
+    """
+    Number of bytes of a file downloaded so far: the size of the file, or of its '.part' file if that is larger.
+    The '.part' file of a segmented download is preallocated to the full size, so its progress is read from the '.segments' file instead.
+    """
+    partfile = filename + '.part'
+    statefile = filename + '.segments'
+    have = os.path.getsize(filename) if os.path.isfile(filename) else 0
+    if os.path.isfile(statefile):
+        try:
+            with open(statefile) as f:
+                return max(have, sum(json.load(f)['done']))
+        except (OSError, ValueError, KeyError, TypeError):
+            # an unreadable state file means the partial download is started again (see download_url_stream)
+            return have
+    if os.path.isfile(partfile):
+        return max(have, os.path.getsize(partfile))
+    return have
+
+
+def get_remote_size(url,auth=None):
+    """
+    Return the size in bytes of a remote file, and whether the server accepts range requests.
+    The size is None if the server does not report it.
+    """
+    session = get_session()
+    # ask for the first byte only; the total size comes back in the Content-Range header
+    with session.get(url, headers={'Range': 'bytes=0-0'}, auth=auth, stream=True, timeout=request_timeout) as response:
+        response.raise_for_status()
+        if response.status_code == 206:
+            total = response.headers.get('Content-Range','').split('/')[-1]
+            if total.isdigit():
+                return int(total),True
+        length = response.headers.get('Content-Length')
+        return (int(length) if length is not None else None),False
+
+
+def download_url_segmented(url,dest_dir,auth=None,segments=4,segment_size=0,cancel=None):
+    """
+    Download a file to dest_dir by fetching byte ranges over several connections at once.
+    The '.part' file is preallocated to the full size and each range is written at its own offset.
+    Progress of each range is kept in a '.segments' file next to it, so an interrupted download
+    resumes each range where it stopped. A partial file left by wget or download_url_stream is also continued.
+    segments is the number of simultaneous connections, and segment_size (in bytes) the size of each range;
+    if segment_size is 0, the file is split into as many ranges as there are segments.
+    Falls back to download_url_stream if the server does not support range requests.
+    Returns 0 on success and 1 on failure.
+    """
+    filename = os.path.join(dest_dir, url.split('/')[-1])
+    partfile = filename + '.part'
+    statefile = filename + '.segments'
+    try:
+        total,ranges_ok = get_remote_size(url,auth)
+    except requests.RequestException as e:
+        print('Download of %s failed: %s'%(url,e))
+        return 1
+    if total is None or not ranges_ok or total == 0:
+        return download_url_stream(url,dest_dir,auth,cancel,continue_segments=False)
+    if os.path.isfile(filename) and os.path.getsize(filename) == total and not os.path.isfile(partfile):
+        print('File %s is already fully retrieved.'%filename)
+        return 0
+
+    # split the file into byte ranges [start, end)
+    if segment_size <= 0:
+        segment_size = -(-total // segments)
+    ranges = [(start, min(start + segment_size, total)) for start in range(0, total, segment_size)]
+
+    # load the progress of each range from an earlier attempt, if it was for the same file size and ranges
+    done = None
+    if os.path.isfile(partfile) and os.path.isfile(statefile):
+        with open(statefile) as f:
+            state = json.load(f)
+        if state.get('size') == total and state.get('ranges') == [list(r) for r in ranges]:
+            done = state['done']
+    if done is None:
+        # a partial file from a single-stream download holds contiguous data from the start
+        existing = partfile if os.path.isfile(partfile) else filename if os.path.isfile(filename) else None
+        have = os.path.getsize(existing) if existing else 0
+        if existing and have < total:
+            os.replace(existing, partfile)
+        else:
+            have = 0
+            open(partfile, 'wb').close()
+        done = [min(max(have - start, 0), end - start) for start,end in ranges]
+    with open(partfile, 'r+b') as f:
+        f.truncate(total)
+
+    lock = threading.Lock()
+    def save_state():
+        tmpfile = statefile + '.tmp'
+        with open(tmpfile, 'w') as f:
+            json.dump({'size': total, 'ranges': ranges, 'done': done}, f)
+        os.replace(tmpfile, statefile)
+
+    save_state()
+
+    session = get_session()
+    fd = os.open(partfile, os.O_WRONLY)
+    def fetch_range(i):
+        start,end = ranges[i]
+        pos = start + done[i]
+        if pos >= end:
+            return 0
+        with session.get(url, headers={'Range': 'bytes=%d-%d'%(pos, end - 1)}, auth=auth, stream=True, timeout=request_timeout) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise requests.HTTPError('server ignored range request for bytes %d-%d'%(pos, end - 1))
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if cancel is not None and cancel.is_set():
+                    raise DownloadCancelled('download cancelled')
+                chunk = chunk[:end - pos]
+                if _limiter is not None:
+                    _limiter.consume(len(chunk))
+                os.pwrite(fd, chunk, pos)
+                pos += len(chunk)
+                with lock:
+                    done[i] = pos - start
+                    save_state()
+        if pos < end:
+            raise requests.HTTPError('connection closed at byte %d of range %d-%d'%(pos, start, end - 1))
+        return end - start
+
+    print('Downloading %s in %d ranges over %d connections.'%(os.path.basename(filename), len(ranges), segments))
+    nbytes_before = sum(done)
+    tstart = time.time()
+    status = 0
+    try:
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            for future in [executor.submit(fetch_range, i) for i in range(len(ranges))]:
+                try:
+                    future.result()
+                except (requests.RequestException, OSError) as e:
+                    print('Download of %s failed: %s'%(url,e))
+                    status = 1
+    finally:
+        os.close(fd)
+    if status != 0:
+        return status
+
+    os.replace(partfile, filename)
+    os.remove(statefile)
+    nbytes = total - nbytes_before
+    elapsed = max(time.time() - tstart, 1e-6)
+    print('Downloaded %s: %.1f MB in %.1f s (%.2f MB/s)'%(os.path.basename(filename), nbytes/1e6, elapsed, nbytes/1e6/elapsed))
+    return 0
+
+
+def list_prefixes(list_url,prefix):
+    """
+    List the sub-folders of a folder in an S3 bucket, with the ListObjectsV2 API at list_url (the REST endpoint of the bucket).
+    Returns the names of the sub-folders, without the prefix or the final '/'. Results are requested in pages of 1000.
+    """
+    session = get_session()
+    s3_ns = '{http://s3.amazonaws.com/doc/2006-03-01/}'
+    names = []
+    params = {'list-type': '2', 'prefix': prefix, 'delimiter': '/'}
+    while True:
+        response = session.get(list_url, params=params, timeout=request_timeout)
+        response.raise_for_status()
+        try:
+            tree = ElementTree.fromstring(response.content)
+        except ElementTree.ParseError as e:
+            raise ValueError('Invalid bucket listing from %s: %s'%(list_url,e))
+        for element in tree.iter(s3_ns + 'CommonPrefixes'):
+            names.append(element.findtext(s3_ns + 'Prefix')[len(prefix):].rstrip('/'))
+        token = tree.findtext(s3_ns + 'NextContinuationToken')
+        if tree.findtext(s3_ns + 'IsTruncated') != 'true' or not token:
+            return names
+        params['continuation-token'] = token
+
+
+######################## Verification of downloaded files ########################
+
+# buffer size for reading files when computing checksums
+hash_buffer_size = 16*1024*1024
+
+# columns of the ASF query result holding the file size in MB (2^20 bytes) and the MD5 checksum
+size_column = 'Size (MB)'
+md5_columns = ['MD5','md5sum','MD5 Checksum']
+
+# allowed difference between the actual and reported size in MB, since ASF rounds the reported value
+size_tolerance = 0.01
+
+# results of verify_file
+verify_ok = 'ok'
+verify_missing = 'missing'
+verify_short = 'short'
+verify_size = 'size mismatch'
+verify_md5 = 'MD5 mismatch'
+
+
+def file_md5(filename):
+    """
+    Compute the MD5 checksum of a file, reading it in large blocks into a reused buffer.
+    hashlib releases the GIL while hashing large blocks, so several files can be checked at once in threads.
+    """
+    md5 = hashlib.md5()
+    buf = bytearray(hash_buffer_size)
+    view = memoryview(buf)
+    with open(filename, 'rb', buffering=0) as f:
+        while True:
+            nbytes = f.readinto(buf)
+            if not nbytes:
+                break
+            md5.update(view[:nbytes])
+    return md5.hexdigest()
+
+
+def get_expected_size(row):
+    """
+    Return the file size in MB reported in a query result row, or None if it is not given.
+    """
+    try:
+        return float(row[size_column])
+    except (KeyError, ValueError):
+        return None
+
+
+def get_expected_md5(row):
+    """
+    Return the MD5 checksum reported in a query result row, or None if it is not given.
+    """
+    for column in md5_columns:
+        if row.get(column):
+            return row[column].strip().lower()
+    return None
+
+
+def verify_file(filename,size_mb=None,md5=None,mode='md5'):
+    """
+    Check a downloaded file against its expected size in MB and MD5 checksum (either may be None if unknown).
+    mode 'size' checks only the file size, which needs no reading of the file; mode 'md5' also checks the checksum.
+    Returns verify_ok, verify_missing, verify_short (smaller than expected, may be resumed), verify_size or verify_md5.
+    """
+    if not os.path.isfile(filename):
+        return verify_missing
+    if size_mb is not None:
+        actual_mb = os.path.getsize(filename)/2**20
+        if actual_mb < size_mb - size_tolerance:
+            return verify_short
+        if actual_mb > size_mb + size_tolerance:
+            return verify_size
+    if mode == 'md5' and md5 is not None:
+        with s1_metrics_func.timed('verify', mode=mode) as info:
+            info['bytes'] = os.path.getsize(filename)
+            if file_md5(filename) != md5:
+                return verify_md5
+    return verify_ok
+
+
+def remove_bad_file(filename,action='refetch',quarantine_dir='quarantine'):
+    """
+    Deal with a file that failed verification: 'refetch' deletes it so it will be downloaded again,
+    'quarantine' moves it to its P###/F#### frame directory under quarantine_dir, and 'none' leaves it in place.
+    The frame directory is taken from the end of the path, so files under any download root are kept inside quarantine_dir.
+    """
+    if action == 'refetch':
+        os.remove(filename)
+    elif action == 'quarantine':
+        target = os.path.join(quarantine_dir, *os.path.normpath(os.path.abspath(filename)).split(os.sep)[-3:])
+        root = os.path.realpath(quarantine_dir)
+        if not os.path.realpath(target).startswith(root + os.sep):
+            print('Warning: not moving %s to %s, which is outside the quarantine directory %s'%(filename,target,quarantine_dir))
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(filename, target)
+        print('Moved %s to %s'%(filename,target))
+
+
+def link_file(source,target,mode='hard'):
+    """
+    Place a copy of a downloaded file at target, as a hard link (mode 'hard', falling back to a symbolic link across file systems),
+    a symbolic link ('symlink') or a full copy ('copy'). A target that is already the same file, or has the same size, is left as it is.
+    """
+    if os.path.exists(target) and (os.path.samefile(source,target) or os.path.getsize(source) == os.path.getsize(target)):
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    # link or copy to a temporary name first, so that an interrupted copy is never taken for a complete file
+    temp = target + '.link'
+    if os.path.lexists(temp):
+        os.remove(temp)
+    if mode == 'hard':
+        try:
+            os.link(source,temp)
+        except OSError:
+            os.symlink(os.path.abspath(source),temp)
+    elif mode == 'symlink':
+        os.symlink(os.path.abspath(source),temp)
+    else:
+        shutil.copyfile(source,temp)
+    os.replace(temp,target)
+
+
+######################## Granule records for download workers ########################
+
+# download settings shared by all granules (site, engine, verification, ASF credentials), set once per process
+download_settings = {}
+
+
+def set_download_settings(settings, bandwidth=None):
+    """
+    Set the download settings used by all GranuleRecords in this process, and optionally its bandwidth limit in bytes/s.
+    Used as the initializer of each worker process, so that the settings and credentials are sent once per worker, not once per granule.
+    """
+    global download_settings
+    download_settings = dict(settings)
+    if bandwidth is not None:
+        set_bandwidth_limit(bandwidth)
+
+
+class GranuleRecord:
+    """
+    The fields of a query result row that are needed to download a granule. Fields are read like a csv row, e.g. record['URL'];
+    keys that are not fields of the record (e.g. 'Verify') are looked up in the download settings of the process.
+    'Download Site' may be set on a single record to override the setting for that granule.
+    """
+    columns = {'Granule Name': 'name', 'URL': 'url', 'Acquisition Date': 'date', 'Path Number': 'path', 'Frame Number': 'frame',
+               size_column: 'size', 'MD5': 'md5', 'Download Site': 'site', 'Download Root': 'root'}
+    __slots__ = list(columns.values())
+
+    def __init__(self, row):
+        for column,slot in self.columns.items():
+            setattr(self, slot, row.get(column))
+        if self.md5 is None:
+            self.md5 = get_expected_md5(row)
+
+    def __getitem__(self, key):
+        slot = self.columns.get(key)
+        value = getattr(self, slot) if slot else None
+        if value is None:
+            if key in download_settings:
+                return download_settings[key]
+            if slot is None:
+                raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        setattr(self, self.columns[key], value)
+
+    def get(self, key, default=None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        return default if value is None else value
+
+    def __getstate__(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __setstate__(self, state):
+        for slot,value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+
+######################## Throughput of each download source ########################
+
+# weight of the newest transfer in the rolling averages of throughput and success rate
+stats_alpha = 0.3
+
+# transfers smaller than this (e.g. the end of a resumed file) are too short to measure throughput
+stats_min_bytes = 1e6
+
+# fraction of granules sent to a source other than the best one, so that its statistics stay current
+explore_fraction = 0.1
+
+
+class SourceStats:
+    """
+    Rolling averages of the throughput (bytes/s) and success rate of each download source, kept in a SQLite database
+    so that they are shared by all worker processes and threads, and kept between runs.
+    The score of a source is its throughput times its success rate; sources without statistics are tried first.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, timeout=60, check_same_thread=False)
+        self.db.execute('create table if not exists sources (source text primary key, rate real, success real, transfers integer, updated real)')
+        self.db.commit()
+
+    def update(self, source, nbytes, seconds, ok, abandoned=False):
+        """
+        Add one transfer from a source: its size in bytes and duration if it succeeded, or only the failure.
+        A transfer that was abandoned for being too slow counts towards the throughput whatever its size.
+        """
+        with self.lock:
+            found = self.db.execute('select rate, success, transfers from sources where source=?', (source,)).fetchone()
+            rate, success, transfers = found if found else (None, 1.0, 0)
+            success = (1 - stats_alpha)*success + stats_alpha*(1.0 if ok else 0.0)
+            if ok and (nbytes >= stats_min_bytes or abandoned) and seconds > 0:
+                rate = nbytes/seconds if rate is None else (1 - stats_alpha)*rate + stats_alpha*nbytes/seconds
+            self.db.execute('insert or replace into sources values (?,?,?,?,?)', (source, rate, success, transfers + 1, time.time()))
+            self.db.commit()
+
+    def get(self, source):
+        """
+        Return the throughput in bytes/s (None if unknown) and the success rate of a source.
+        """
+        with self.lock:
+            found = self.db.execute('select rate, success from sources where source=?', (source,)).fetchone()
+        return found if found else (None, 1.0)
+
+    def score(self, source):
+        rate, success = self.get(source)
+        return float('inf') if rate is None else rate*success
+
+    def choose(self, sources):
+        """
+        Order the sources from best to worst score, except that a small fraction of the time another source is put first,
+        to keep its statistics current.
+        """
+        ranked = sorted(sources, key=self.score, reverse=True)
+        if len(ranked) > 1 and random.random() < explore_fraction:
+            ranked.insert(0, ranked.pop(random.randrange(1, len(ranked))))
+        return ranked
+
+    def expected_time(self, source, nbytes):
+        """
+        Expected duration in seconds of a transfer of nbytes from a source, or None if its throughput is not known.
+        """
+        rate, success = self.get(source)
+        return nbytes/rate if rate else None
+
+    def summary(self):
+        with self.lock:
+            rows = self.db.execute('select source, rate, success, transfers from sources order by source').fetchall()
+        return ', '.join('%s %s MB/s (%.0f%% ok, %d transfers)'%(source, '%.2f'%(rate/1e6) if rate else 'unknown', 100*success, transfers)
+                         for source,rate,success,transfers in rows)
@@ -6,79 +6,210 @@ Created on Wed Oct 25 11:45:24 2017
 @author: elindsey
 """
 
-import os,sys,shutil,glob,datetime
+import os,sys,shutil,glob,datetime,subprocess,zipfile,re,json,threading,hashlib
+from concurrent.futures import ThreadPoolExecutor
 from xml.etree import ElementTree
-import s1_orbit_func
+import s1_orbit_func,s1_metrics_func
 
 ######################## Sentinel-specific functions ########################
 # This satellite is a real nightmare for my attempts at standardization 
 
 
-def unzip_images_to_dir(filelist,unzip_dir):
+# buffer size for writing extracted files
+unzip_buffer_size = 16*1024*1024
+
+# swath and polarization in the names of measurement, annotation, calibration and noise files, e.g. s1a-iw2-slc-vv-...
+swath_pol_pattern = re.compile(r's1[a-z]-iw([1-3])-slc-([hv][hv])-')
+
+
+def unzip_images_to_dir(filelist,unzip_dir,swaths=None,polarizations=None,nproc=1):
+    """
+    For a list of zipped S1 SLC files, extract them to a directory, using nproc threads.
+    Only the parts needed by create_frame_tops.csh are extracted: preview images are skipped, and if swaths (e.g. [1,2])
+    or polarizations (e.g. ['vv']) are given, files for other swaths and polarizations are skipped too.
+    """
+    with ThreadPoolExecutor(max_workers=nproc) as executor:
+        for image in executor.map(lambda image: unzip_image(image,unzip_dir,swaths,polarizations), filelist):
+            print('Extracted %s'%os.path.basename(image))
+
+
+def unzip_image(image,unzip_dir,swaths=None,polarizations=None):
+    """
+    Extract one zipped S1 SLC file to a directory, skipping unneeded members as described in unzip_images_to_dir.
+    """
+    with s1_metrics_func.timed('unzip', image=os.path.basename(image)) as info, zipfile.ZipFile(image) as zf:
+        for member in zf.infolist():
+            if member.is_dir() or not keep_safe_member(member.filename,swaths,polarizations):
+                continue
+            target = os.path.join(unzip_dir, member.filename)
+            # do not write outside the output directory
+            if not os.path.abspath(target).startswith(os.path.abspath(unzip_dir) + os.sep):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with zf.open(member) as src, open(target, 'wb') as dst:
+                shutil.copyfileobj(src, dst, unzip_buffer_size)
+            info['bytes'] += member.file_size
+    return image
+
+
+def keep_safe_member(filename,swaths=None,polarizations=None):
     """
-    For a list of zipped S1 SLC files, unzip them to a temporary directory (not parallel).
+    Check whether a file inside a SAFE zip is needed: skip previews, and files for swaths or polarizations not in the given lists.
     """
-    cmds=[]
-    owd=os.getcwd()
-    # go to the output directory so the unzipped results will fall there:
-    os.chdir(unzip_dir)
-    for image in filelist:
-        item=os.path.abspath(image)
-        filename=os.path.basename(item)
-        cmd = 'unzip %s'%item
-        run_command(cmd,logFile='log_%s.txt'%filename)
-    os.chdir(owd)
+    if '/preview/' in filename:
+        return False
+    match = swath_pol_pattern.search(os.path.basename(filename))
+    if match:
+        if swaths and int(match.group(1)) not in swaths:
+            return False
+        if polarizations and match.group(2) not in polarizations:
+            return False
+    return True
 
 
-def find_images_by_orbit(dirlist,s1_orbit_dirs,ftype='SAFE'):
+def get_burst_footprints(image,swaths=None):
     """
-    For each Sentinel-1 satellite, find all images that were acquired on the same orbit, and order them by time
+    Read the latitude and longitude extent of each burst from the annotation files of a zipped or unzipped SAFE, without extracting it.
+    Burst geometry is the same for all polarizations, so only the first polarization found is read.
+    Returns a list of [swath, burst number, minlat, maxlat, minlon, maxlon], which is empty if any annotation file has no geolocation grid.
+    """
+    # open the annotation files (not the calibration or noise files) from the zip or the SAFE folder
+    if os.path.isdir(image):
+        names = [os.path.relpath(name,image) for name in glob.glob(os.path.join(image,'annotation','*.xml'))]
+        read_file = lambda name: open(os.path.join(image,name),'rb')
+        zf = None
+    else:
+        zf = zipfile.ZipFile(image)
+        names = [name for name in zf.namelist() if os.path.basename(os.path.dirname(name)) == 'annotation' and name.endswith('.xml')]
+        read_file = zf.open
+    footprints = []
+    polarization = None
+    try:
+        for name in sorted(names):
+            match = swath_pol_pattern.search(os.path.basename(name))
+            if not match or (swaths and int(match.group(1)) not in swaths):
+                continue
+            if polarization is None:
+                polarization = match.group(2)
+            elif match.group(2) != polarization:
+                continue
+            with read_file(name) as f:
+                root = ElementTree.parse(f).getroot()
+            lines_per_burst = int(root.findtext('swathTiming/linesPerBurst'))
+            nbursts = len(root.findall('swathTiming/burstList/burst'))
+            points = [(int(point.findtext('line')), float(point.findtext('latitude')), float(point.findtext('longitude')))
+                      for point in root.iter('geolocationGridPoint')]
+            grid_lines = sorted(set(point[0] for point in points))
+            if not grid_lines:
+                # the bursts of this swath cannot be located, so the image must not be filtered out
+                return []
+            for burst in range(nbursts):
+                # use the grid lines just outside the burst, so the footprint is never too small
+                first = max([line for line in grid_lines if line <= burst*lines_per_burst], default=grid_lines[0])
+                last = min([line for line in grid_lines if line >= (burst + 1)*lines_per_burst], default=grid_lines[-1])
+                lats = [point[1] for point in points if first <= point[0] <= last]
+                lons = [point[2] for point in points if first <= point[0] <= last]
+                footprints.append([int(match.group(1)), burst + 1, min(lats), max(lats), min(lons), max(lons)])
+    finally:
+        if zf is not None:
+            zf.close()
+    return footprints
+
+
+def filter_images_by_latitude(images,minlat,maxlat,cache_file=None,nproc=1,margin=0.05):
+    """
+    Keep only the images that have at least one burst between minlat and maxlat (extended by margin degrees).
+    Burst footprints are read from the annotation files of each image with nproc threads, and saved by granule name
+    in the JSON file cache_file, if given, so that later runs with other pins do not need to read them again.
+    Images whose footprints cannot be read, or that have no matching annotation files, are kept and not saved in the cache.
+    """
+    cache = {}
+    if cache_file and os.path.isfile(cache_file):
+        with open(cache_file) as f:
+            cache = json.load(f)
+    names = [os.path.basename(image).split('.')[0] for image in images]
+    missing = [image for image,name in zip(images,names) if name not in cache]
+    def read_footprints(image):
+        try:
+            return get_burst_footprints(image)
+        except (OSError, zipfile.BadZipFile, ElementTree.ParseError, TypeError, ValueError) as e:
+            print('Warning: cannot read burst footprints from %s, keeping it: %s'%(image,e))
+            return None
+    with ThreadPoolExecutor(max_workers=nproc) as executor:
+        for image,footprints in zip(missing, executor.map(read_footprints, missing)):
+            if footprints:
+                cache[os.path.basename(image).split('.')[0]] = footprints
+            elif footprints is not None:
+                print('Warning: no burst footprints found in %s, keeping it'%image)
+    # replace the cache only once it is completely written
+    if cache_file and missing:
+        with open(cache_file + '.tmp','w') as f:
+            json.dump(cache,f)
+        os.replace(cache_file + '.tmp', cache_file)
+    kept = []
+    for image,name in zip(images,names):
+        if name not in cache or any(burst[2] <= maxlat + margin and burst[3] >= minlat - margin for burst in cache[name]):
+            kept.append(image)
+    return kept
+
+
+def find_images_by_orbit(dirlist,s1_orbit_dirs,ftype='SAFE',image_filter=None):
+    """
+    For each Sentinel-1 satellite, find all images that were acquired on the same orbit, and order them by time.
+    Directories are listed with os.scandir, and file names are split by position without parsing any dates, so that
+    large archives are scanned quickly. Images are grouped by orbit in a single pass, and the orbit file is found
+    once for each orbit (see s1_orbit_func.get_orbit_files_for_windows).
+    If given, image_filter is called with the list of all images found, and only the images it returns are kept.
+    It runs before the orbit files are looked up, so orbits that have no images left need no orbit file.
+    Returns two dictionaries with the orbit ID (e.g. 'S1A_023190') as key: the list of images, and the orbit file.
     """
     valid_modes = ['IW_SLC'] #we match only IW_SLC data
     
+    # group the images by orbit as (start, end, full path). Dates stay as 'YYYYMMDDTHHMMSS' strings, which sort in time order
+    groups = dict()
+    for pattern in dirlist:
+        # search directories may also contain wildcards
+        for searchdir in glob.glob(pattern):
+            try:
+                entries = list(os.scandir(searchdir))
+            except (NotADirectoryError, FileNotFoundError):
+                continue
+            for entry in entries:
+                file = entry.name
+                if not (file.startswith('S1') and file.endswith(ftype)) or file[4:10] not in valid_modes:
+                    continue
+                #add A or B to the orbit number and use as the unique ID for identifying orbits
+                ab_orbit = 'S1%s_%s'%(file[2],file[49:55])
+                groups.setdefault(ab_orbit,[]).append((file[17:32],file[33:48],os.path.abspath(entry.path)))
+
+    if image_filter is not None:
+        keep = set(image_filter([image[2] for images in groups.values() for image in images]))
+        for ab_orbit in list(groups):
+            groups[ab_orbit] = [image for image in groups[ab_orbit] if image[2] in keep]
+            if not groups[ab_orbit]:
+                print('no images left after filtering, skipping orbit %s'%ab_orbit)
+                del groups[ab_orbit]
+
+    # keep the images in time order, and find the time window covered by each orbit
+    windows = dict()
+    for ab_orbit,images in groups.items():
+        images.sort()
+        start = datetime.datetime.strptime(images[0][0],'%Y%m%dT%H%M%S')
+        end = datetime.datetime.strptime(max(image[1] for image in images),'%Y%m%dT%H%M%S')
+        windows[ab_orbit] = [ab_orbit[2], start, end]
+
+    #Find matching EOF for each orbit
+    found_eofs = s1_orbit_func.get_orbit_files_for_windows(windows,s1_orbit_dirs)
+
     #dictionaries will keep track of the results
     names       = dict()
-    start_times = dict()
     eofs        = dict()
-    
-    for searchdir in dirlist:
-        list_of_images=glob.glob('%s/S1*%s'%(searchdir,ftype))
-        #print('in',searchdir)
-        #print('found list',list_of_images,'\n')
-        
-        for item in list_of_images:
-            # we want the full path and also just the file name
-            item=os.path.abspath(item)
-            file=os.path.basename(item)
-            
-            # get A/B, sat. mode, dates, orbit ID from the file name
-            [sat_ab,sat_mode,image_start,image_end,orbit_num] = s1_orbit_func.parse_s1_SAFE_name(file)
-            #print('Read file:',file,'parameters:',sat_ab,sat_mode,image_start,image_end,orbit_num)
-
-            if sat_mode in valid_modes:
-                #Find matching EOF
-                eof_name = s1_orbit_func.get_latest_orbit_file(sat_ab,image_start,image_end,s1_orbit_dirs,skip_notfound=True)
-                if eof_name is not None:
-                    #print('Got EOF:',eof_name)
-                
-                    #add A or B to the orbit number and use as the unique ID for identifying orbits
-                    ab_orbit='S1%s_%06d'%(sat_ab,orbit_num)
-                    if ab_orbit not in names:
-                        names[ab_orbit] = []
-                        start_times[ab_orbit] = []
-                        eofs[ab_orbit] = eof_name
-                    elif eof_name != eofs[ab_orbit]:
-                        #we've already found one scene from this orbit. check that it matches the same orbit file 
-                        print('Error: found two scenes from same orbit number matching different EOFs. Check your data.')
-                        sys.exit(1)
-                    
-                    #keep the images in time order. Find the index of the first time that is later than the image's time
-                    timeindx=0
-                    for starttime in start_times[ab_orbit]:
-                        if starttime < image_start:
-                            timeindx+=1
-                    names[ab_orbit].insert(timeindx,item)
-                    start_times[ab_orbit].insert(timeindx,image_start)
+    for ab_orbit,images in groups.items():
+        if found_eofs[ab_orbit] is None:
+            print("Warning: No matching orbit file found for %s in %s - skipping"%(ab_orbit,s1_orbit_dirs))
+            continue
+        names[ab_orbit] = [image[2] for image in images]
+        eofs[ab_orbit] = found_eofs[ab_orbit]
     return names, eofs
 
 
@@ -94,67 +225,349 @@ def write_ll_pins(fname, lons, lats, asc_desc):
     write_list(fname,lonlats)
 
 
-def create_frame_tops_parallel(filelist,eof,llpins,logfile,workdir,unzipped):
+def get_frame_inputs(images,eof,llpins,swaths=None,polarizations=None):
+    """
+    Describe the inputs of one cropped frame: the name and size of each image (for SAFE directories, the size of the manifest),
+    the orbit file, the contents of the pins file, and the swaths and polarizations extracted.
+    """
+    files = []
+    for image in images:
+        if os.path.isdir(image):
+            manifest = os.path.join(image,'manifest.safe')
+            size = os.path.getsize(manifest) if os.path.isfile(manifest) else 0
+        else:
+            size = os.path.getsize(image)
+        files.append([os.path.basename(image), size])
+    with open(llpins) as f:
+        pins = f.read()
+    return {'images': sorted(files), 'eof': os.path.basename(eof), 'pins': pins,
+            'swaths': sorted(swaths) if swaths else None, 'polarizations': sorted(polarizations) if polarizations else None}
+
+
+def get_frame_fingerprint(inputs):
+    """
+    Hash of the inputs of a frame (see get_frame_inputs), used to decide whether the frame must be created again.
+    """
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def describe_frame_changes(old_inputs,new_inputs):
+    """
+    List the differences between the recorded and current inputs of a frame, as text for the log.
+    """
+    changes = []
+    old_images = dict(old_inputs.get('images',[]))
+    new_images = dict(new_inputs['images'])
+    for name in sorted(set(new_images) - set(old_images)):
+        changes.append('new image %s'%name)
+    for name in sorted(set(old_images) - set(new_images)):
+        changes.append('image removed %s'%name)
+    for name in sorted(set(old_images) & set(new_images)):
+        if old_images[name] != new_images[name]:
+            changes.append('image size changed %s'%name)
+    for key in ['eof','pins','swaths','polarizations']:
+        if old_inputs.get(key) != new_inputs[key]:
+            changes.append('%s changed'%key if key != 'eof' else 'orbit file changed to %s'%new_inputs['eof'])
+    return changes
+
+
+def read_frame_state(state_file):
+    """
+    Read the inputs recorded for each cropped frame by previous runs, as a dictionary with the orbit ID as key.
+    """
+    if not os.path.isfile(state_file):
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def write_frame_state(state_file,state):
+    """
+    Save the frame state, replacing the file only once it is completely written.
+    """
+    with open(state_file + '.tmp','w') as f:
+        json.dump(state,f,indent=1,sort_keys=True)
+    os.replace(state_file + '.tmp', state_file)
+
+
+def create_frame_tops_parallel(filelist,eof,llpins,logfile,workdir,unzipped,swaths=None,polarizations=None,unzip_nproc=1,outdir=None):
     """
     Run the GMTSAR command create_frame_tops.csh to combine bursts within the given latitude bounds
     Modified version enables running in parallel by running in a temporary subdirectory.
+    Zipped files are extracted with unzip_nproc threads, keeping only the given swaths and polarizations (default: all).
+    The work directory may be on a separate scratch disk; the result is moved back to outdir (default: the current directory).
     """
-    # to run in parallel, we have to do everything inside a unique directory
-    # this is because GMTSAR uses constant temp filenames that will collide with each other
-    # in this case, the colliding name is the temp folder 'new.SAFE'
-    os.makedirs(workdir, exist_ok=False)
-    cwd=os.getcwd()
-    os.chdir(workdir)
-
-    # If files are not already unzipped, unzip them in a subdirectory first
-    if not unzipped:
-        temp_unzip_dir = 'temp_unzip'
-        os.makedirs(temp_unzip_dir, exist_ok=False)
-        unzip_images_to_dir(filelist,temp_unzip_dir)
-        # need to provide full path to glob to get full paths back
-        #safelist = glob.glob('%s/%s/%s/S1*SAFE'%(cwd,workdir,temp_unzip_dir))
-        safelist = sorted(glob.glob('%s/%s/%s/S1*SAFE'%(cwd,workdir,temp_unzip_dir)), key=os.path.basename)
-    else:
-        #safelist = filelist
-        safelist = sorted(filelist,key=os.path.basename)
+    if outdir is None:
+        outdir=os.getcwd()
+    prepare_frame_workdir(filelist,eof,llpins,workdir,unzipped,swaths,polarizations,unzip_nproc)
+    run_frame_tops(workdir,eof,llpins,logfile)
+    finish_frame_workdir(workdir,logfile,outdir)
 
-    # write file list to the current directory
-    write_list('SAFE.list', safelist)
 
-    # copy orbit file to the current directory, required for create_frame_tops.csh
-    shutil.copy2(eof,os.getcwd())
-    local_eof=os.path.basename(eof)
+def create_frame_tops_job(args):
+    """
+    Run create_frame_tops_parallel with a tuple of its arguments, for use with Pool.imap_unordered.
+    Returns the work directory and True on success. A job that fails is reported and its work directory is kept.
+    """
+    try:
+        create_frame_tops_parallel(*args)
+    except (SystemExit, OSError, IndexError, zipfile.BadZipFile) as e:
+        print('Error: processing failed in %s, skipping this orbit (%s)'%(args[4],e))
+        return args[4], False
+    return args[4], True
 
-    # copy llpins file to current directory
-    shutil.copy2(os.path.join(cwd,llpins),llpins)
 
+def remove_stale_workdir(workdir):
+    """
+    Delete a work directory left behind by an interrupted or failed run, so that the orbit can be processed again.
+    """
+    if os.path.isdir(workdir):
+        print('Removing work directory %s left by an earlier run'%workdir)
+        shutil.rmtree(workdir)
+
+
+def prepare_frame_workdir(filelist,eof,llpins,workdir,unzipped,swaths=None,polarizations=None,unzip_nproc=1):
+    """
+    First stage of create_frame_tops_parallel: create the work directory, extract the images (if zipped)
+    and copy the orbit and pins files into it. This stage is mostly disk I/O.
+    """
+    with s1_metrics_func.timed('frame_extract', workdir=os.path.basename(workdir), images=len(filelist)):
+        # to run in parallel, we have to do everything inside a unique directory
+        # this is because GMTSAR uses constant temp filenames that will collide with each other
+        # in this case, the colliding name is the temp folder 'new.SAFE'
+        workdir=os.path.abspath(workdir)
+        os.makedirs(workdir, exist_ok=False)
+
+        # If files are not already unzipped, unzip them in a subdirectory first
+        if not unzipped:
+            temp_unzip_dir = os.path.join(workdir,'temp_unzip')
+            os.makedirs(temp_unzip_dir, exist_ok=False)
+            unzip_images_to_dir(filelist,temp_unzip_dir,swaths,polarizations,unzip_nproc)
+            # glob with the full path to get full paths back
+            safelist = sorted(glob.glob('%s/S1*SAFE'%temp_unzip_dir), key=os.path.basename)
+        else:
+            safelist = sorted(filelist,key=os.path.basename)
+
+        # write file list to the work directory
+        write_list(os.path.join(workdir,'SAFE.list'), safelist)
+
+        # copy orbit file to the work directory, required for create_frame_tops.csh
+        shutil.copy2(eof,workdir)
+
+        # copy llpins file to the work directory
+        shutil.copy2(llpins,os.path.join(workdir,os.path.basename(llpins)))
+
+
+def run_frame_tops(workdir,eof,llpins,logfile):
+    """
+    Second stage of create_frame_tops_parallel: run create_frame_tops.csh inside the work directory. This stage is mostly CPU.
+    """
     # create GMTSAR command and run it
     #cmd = '/home/share/insarscripts/automate/gmtsar_functions/create_frame_tops.csh SAFE.list %s %s 1 %s'%(local_eof, llpins, logfile)
-    cmd = 'create_frame_tops.csh SAFE.list %s %s 1'%(local_eof, llpins)
-    run_command(cmd,logFile=logfile)
+    cmd = 'create_frame_tops.csh SAFE.list %s %s 1'%(os.path.basename(eof), os.path.basename(llpins))
+    with s1_metrics_func.timed('frame_tops', workdir=os.path.basename(workdir)):
+        run_command(cmd,logFile=os.path.join(workdir,logfile),cwd=workdir)
+
+
+def finish_frame_workdir(workdir,logfile,outdir):
+    """
+    Last stage of create_frame_tops_parallel: move the resulting SAFE and the log file to outdir, and delete the work directory.
+    """
+    with s1_metrics_func.timed('frame_finish', workdir=os.path.basename(workdir)):
+        # copy result back to main directory
+        result_safe=glob.glob(os.path.join(workdir,'S1*SAFE'))[0]
+        shutil.move(result_safe,os.path.join(outdir,os.path.basename(result_safe)))
+        shutil.move(os.path.join(workdir,logfile),os.path.join(outdir,logfile))
+
+        # clean up
+        shutil.rmtree(workdir)
+
+
+def create_frame_tops_staged(argslist,extract_nproc=1,frame_nproc=1,finish_nproc=1,callback=None):
+    """
+    Run create_frame_tops_parallel for a list of argument tuples, with each of its three stages (extract, create_frame_tops.csh,
+    move back and clean up) limited to its own number of simultaneous jobs, so that disk-bound and CPU-bound work overlap
+    without all jobs competing for the disk at once.
+    A job waits after each stage until the next stage has room, so at most extract_nproc + frame_nproc + finish_nproc
+    orbits are in progress, which also limits the space used in the work directories.
+    A job that fails is reported and its work directory is kept; the other jobs continue.
+    If given, callback(workdir, success) is called as each job finishes.
+    """
+    outdir=os.getcwd()
+    extract_limit=threading.Semaphore(extract_nproc)
+    frame_limit=threading.Semaphore(frame_nproc)
+    finish_limit=threading.Semaphore(finish_nproc)
+
+    def run_job(args):
+        filelist,eof,llpins,logfile,workdir,unzipped = args[0:6]
+        try:
+            with extract_limit:
+                prepare_frame_workdir(filelist,eof,llpins,workdir,unzipped,*args[6:])
+            with frame_limit:
+                run_frame_tops(workdir,eof,llpins,logfile)
+            with finish_limit:
+                finish_frame_workdir(workdir,logfile,outdir)
+        except (SystemExit, OSError, IndexError, zipfile.BadZipFile) as e:
+            print('Error: processing failed in %s, skipping this orbit (%s)'%(workdir,e))
+            success=False
+        else:
+            success=True
+        if callback is not None:
+            callback(workdir, success)
+        return success
+
+    with ThreadPoolExecutor(max_workers=extract_nproc + frame_nproc + finish_nproc) as executor:
+        return list(executor.map(run_job, argslist))
+
+
+class FramePipeline:
+    """
+    Create the cropped frame of each orbit while its scenes are being downloaded, as soon as all of them have arrived.
+    Each downloaded granule is registered with add() and reported with finished(); once the query is complete (query_done())
+    and every granule registered for an orbit has finished, the orbit file is found (and downloaded if needed) and
+    create_frame_tops_parallel runs for that orbit in one of nproc threads, using all zip files of that orbit in the frame
+    directories seen so far. Orbits whose inputs have not changed since the last run are skipped, as in cat_s1.py.
+    """
+    def __init__(self, s1_orbit_dirs, llpins, outdir='.', nproc=1, swaths=None, polarizations=None, unzip_nproc=1, scratch=None, preciseonly=False):
+        self.s1_orbit_dirs = s1_orbit_dirs
+        self.llpins = os.path.abspath(llpins)
+        self.outdir = os.path.abspath(outdir)
+        self.scratch = os.path.abspath(scratch) if scratch else self.outdir
+        self.swaths = swaths
+        self.polarizations = polarizations
+        self.unzip_nproc = unzip_nproc
+        self.preciseonly = preciseonly
+        self.state_file = os.path.join(self.outdir,'cat_s1_state.json')
+        self.state = read_frame_state(self.state_file)
+        self.lock = threading.Lock()
+        self.orbit_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=nproc)
+        # for each orbit: the granules not yet finished, the frame directories, and whether any download failed
+        self.waiting = dict()
+        self.frame_dirs = dict()
+        self.failed = set()
+        self.orbits = dict()
+        self.futures = dict()
+        self.complete = False
+
+    def add(self, name, frame_dir):
+        """
+        Register a granule that will be downloaded to frame_dir. Only IW SLC granules are used.
+        """
+        if name[4:10] != 'IW_SLC':
+            return
+        ab_orbit = 'S1%s_%s'%(name[2],name[49:55])
+        with self.lock:
+            self.orbits[name] = ab_orbit
+            self.waiting.setdefault(ab_orbit,set()).add(name)
+            self.frame_dirs.setdefault(ab_orbit,set()).add(os.path.abspath(frame_dir))
+
+    def finished(self, name, status):
+        """
+        Record the exit status of a granule download, and start its orbit if this was the last one.
+        """
+        with self.lock:
+            ab_orbit = self.orbits.get(name)
+            if ab_orbit is None:
+                return
+            self.waiting[ab_orbit].discard(name)
+            if status != 0:
+                self.failed.add(ab_orbit)
+            self.start_ready()
+
+    def query_done(self):
+        """
+        Mark the query as complete: no more granules will be registered, so orbits whose downloads have all finished can start.
+        """
+        with self.lock:
+            self.complete = True
+            self.start_ready()
+
+    def start_ready(self):
+        # called with self.lock held
+        if not self.complete:
+            return
+        for ab_orbit,waiting in self.waiting.items():
+            if waiting or ab_orbit in self.futures:
+                continue
+            if ab_orbit in self.failed:
+                print('Some downloads failed for orbit %s, not creating its frame.'%ab_orbit)
+                self.futures[ab_orbit] = None
+                continue
+            print('All scenes downloaded for orbit %s, creating its frame.'%ab_orbit)
+            self.futures[ab_orbit] = self.executor.submit(self.run_orbit, ab_orbit, sorted(self.frame_dirs[ab_orbit]))
+
+    def run_orbit(self, ab_orbit, frame_dirs):
+        """
+        Find the images and orbit file for one orbit, and create its frame unless the existing one is up to date. Returns True on success.
+        """
+        orbit_num = ab_orbit.split('_')[1]
+        images = set()
+        for frame_dir in frame_dirs:
+            for image in glob.glob(os.path.join(frame_dir,'S1%s_IW_SLC__*.zip'%ab_orbit[2])):
+                if os.path.basename(image)[49:55] == orbit_num:
+                    images.add(image)
+        images = sorted(images, key=os.path.basename)
+        # the orbit index and query cache are shared, so orbits are looked up one at a time
+        try:
+            with self.orbit_lock:
+                eof = s1_orbit_func.get_orbit_files_batch(images,self.s1_orbit_dirs,download_missing=True,preciseonly=self.preciseonly)[ab_orbit]
+        except OSError as e:
+            print('Error: orbit file search failed for %s (%s)'%(ab_orbit,e))
+            eof = None
+        if eof is None:
+            print('Error: No matching orbit file found for %s in %s, not creating its frame.'%(ab_orbit,self.s1_orbit_dirs))
+            return False
+
+        inputs = get_frame_inputs(images, eof, self.llpins, self.swaths, self.polarizations)
+        fingerprint = get_frame_fingerprint(inputs)
+        existing_safe = glob.glob(os.path.join(self.outdir,'S1*_%s_*_*.SAFE'%orbit_num))
+        with self.lock:
+            record = self.state.get(ab_orbit)
+        if existing_safe:
+            if record and record['fingerprint'] == fingerprint:
+                print('Existing cropped image found, skipping orbit %s'%ab_orbit)
+                return True
+            print('Inputs changed for orbit %s, deleting %s'%(ab_orbit,existing_safe[0]))
+            shutil.rmtree(existing_safe[0])
 
-    # copy result back to main directory
-    result_safe=glob.glob('S1*SAFE')[0]
-    shutil.move(result_safe,os.path.join(cwd,result_safe))
-    shutil.move(logfile,os.path.join(cwd,logfile))
+        workdir = os.path.join(self.scratch, 'temp_cat_orbit_' + ab_orbit)
+        try:
+            remove_stale_workdir(workdir)
+            create_frame_tops_parallel(images, eof, self.llpins, 'log_%s.txt'%ab_orbit, workdir, False,
+                                       self.swaths, self.polarizations, self.unzip_nproc, self.outdir)
+        except (SystemExit, OSError, IndexError, zipfile.BadZipFile) as e:
+            print('Error: processing failed in %s, skipping this orbit (%s)'%(workdir,e))
+            return False
+        new_safe = glob.glob(os.path.join(self.outdir,'S1*_%s_*_*.SAFE'%orbit_num))
+        with self.lock:
+            self.state[ab_orbit] = {'safe': os.path.basename(new_safe[0]), 'fingerprint': fingerprint, 'inputs': inputs}
+            write_frame_state(self.state_file, self.state)
+        print('Created frame for orbit %s'%ab_orbit)
+        return True
 
-    # clean up
-    os.chdir(cwd)
-    shutil.rmtree(workdir)
+    def wait(self):
+        """
+        Wait for all frames to finish. Returns a dictionary with the orbit ID as key and True if its frame was created (or up to date).
+        """
+        self.query_done()
+        self.executor.shutdown(wait=True)
+        return {ab_orbit: future is not None and future.result() for ab_orbit,future in self.futures.items()}
 
 
-def run_command(command, logFile=''):
+def run_command(command, logFile='', cwd=None):
     """
     Use subprocess.call to run a command.
     If optional argument logFile is passed, redirect stdout and stderr to that file.
+    If optional argument cwd is passed, run the command in that directory.
     """
     print('running', command)
     if not logFile.strip():
         #no logging, just run command as-is
-        status=subprocess.call(command, shell=True)
+        status=subprocess.call(command, shell=True, cwd=cwd)
     else:
         with open(logFile,'w') as outFile:
-            status=subprocess.call(command, shell=True, stdout=outFile, stderr=outFile)
+            status=subprocess.call(command, shell=True, stdout=outFile, stderr=outFile, cwd=cwd)
     if status != 0:
         print('Python encountered an error in the command:')
         print(command)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Append-only journal of the jobs of a run (granule downloads, orbit frames), used to resume a run that was interrupted.
+Each change in the state of a job is appended as one JSON line and written to disk before the run continues, so after a crash
+the journal still holds the last state reached by every job. Replaying the journal gives that last state for each job.
+
+Created October 2026
+"""
+
+import os,json,time,threading
+
+# states of a job
+state_started = 'started'
+state_done = 'done'
+state_failed = 'failed'
+
+
+class JobJournal:
+    """
+    Journal of jobs, each identified by its kind (e.g. 'run', 'granule', 'frame') and a key (e.g. a granule name or orbit ID).
+    The file is replayed when the journal is opened; a last line cut short by a crash is ignored.
+    Entries are only written by the process that opened the journal, from any of its threads.
+    """
+    def __init__(self, filename):
+        self.filename = os.path.abspath(filename)
+        self.lock = threading.Lock()
+        self.jobs = dict()
+        lines = self.replay()
+        # keep only the last entry of each job once the file is mostly superseded entries
+        if lines > 2*len(self.jobs) + 100:
+            self.compact()
+
+    def replay(self):
+        """
+        Read the last entry of each job from the file. Returns the number of lines read.
+        """
+        if not os.path.isfile(self.filename):
+            return 0
+        lines = 0
+        with open(self.filename) as f:
+            for line in f:
+                lines += 1
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self.jobs[(entry['kind'], entry['key'])] = entry
+        # start on a new line if the last one was cut short
+        if lines and not line.endswith('\n'):
+            with open(self.filename,'a') as f:
+                f.write('\n')
+        return lines
+
+    def compact(self):
+        """
+        Rewrite the file with only the last entry of each job, replacing it only once the new file is completely written.
+        """
+        with self.lock:
+            with open(self.filename + '.tmp','w') as f:
+                for entry in sorted(self.jobs.values(), key=lambda entry: entry['time']):
+                    f.write(json.dumps(entry) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self.filename + '.tmp', self.filename)
+
+    def record(self, kind, key, state, **info):
+        """
+        Append the new state of a job, with any other information needed to resume it, and wait until it is on disk.
+        """
+        entry = {'time': round(time.time(),3), 'kind': kind, 'key': key, 'state': state}
+        entry.update(info)
+        line = json.dumps(entry) + '\n'
+        with self.lock:
+            with open(self.filename,'a') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.jobs[(kind, key)] = entry
+
+    def get(self, kind, key):
+        """
+        The last entry of a job, or None if it is not in the journal.
+        """
+        with self.lock:
+            return self.jobs.get((kind, key))
+
+    def get_state(self, kind, key):
+        """
+        The last state of a job, or None if it is not in the journal.
+        """
+        entry = self.get(kind, key)
+        return entry['state'] if entry else None
+
+    def get_unfinished(self, kind):
+        """
+        The last entries of all jobs of the given kind that were started but neither finished nor failed, i.e. that were interrupted.
+        """
+        with self.lock:
+            return [entry for (entry_kind, key),entry in self.jobs.items() if entry_kind == kind and entry['state'] == state_started]
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Timing and throughput of each processing stage (query, download, orbit lookup and download, unzip, create_frame_tops.csh).
+Each timed step is appended as one JSON line to an event log, which is shared by all worker processes and threads, and by
+repeated runs. Each event carries the ID of its run, and at the end of a run its events are summarized per stage in Prometheus text format.
+
+Instrumentation is off unless an event log is set with enable(), or with the environment variable S1_METRICS_LOG.
+The environment variables (S1_METRICS_LOG and S1_METRICS_RUN) are also how worker processes started by multiprocessing find the event log and run ID.
+
+Created October 2026
+"""
+
+import os,json,time,threading,contextlib,uuid
+
+# event log (JSON lines), or None if instrumentation is off
+metrics_log = os.environ.get('S1_METRICS_LOG') or None
+# ID of the current run, recorded with each event
+metrics_run = os.environ.get('S1_METRICS_RUN') or None
+_lock = threading.Lock()
+
+# labels that are kept in the summary; others (e.g. granule names) appear only in the event log
+summary_labels = ['source','status']
+
+
+def enable(log_file):
+    """
+    Start writing events to log_file, in this process and in any worker processes started afterwards, under a new run ID.
+    """
+    global metrics_log, metrics_run
+    metrics_log = os.path.abspath(log_file)
+    metrics_run = '%s-%s'%(time.strftime('%Y%m%dT%H%M%S'), uuid.uuid4().hex[:8])
+    os.environ['S1_METRICS_LOG'] = metrics_log
+    os.environ['S1_METRICS_RUN'] = metrics_run
+
+
+def record(stage, seconds, nbytes=0, **labels):
+    """
+    Append one event to the event log: the stage, its duration in seconds, the number of bytes transferred or written, the run ID and any labels.
+    """
+    if metrics_log is None:
+        return
+    event = {'time': round(time.time(),3), 'stage': stage, 'seconds': round(seconds,6), 'bytes': int(nbytes), 'pid': os.getpid(), 'run': metrics_run}
+    event.update(labels)
+    line = json.dumps(event) + '\n'
+    # a single write in append mode, so lines from different processes are not mixed
+    with _lock:
+        with open(metrics_log,'a') as f:
+            f.write(line)
+
+
+@contextlib.contextmanager
+def timed(stage, **labels):
+    """
+    Record the time taken by the enclosed block as an event of the given stage. The block may add labels, or the number of bytes,
+    to the yielded dictionary. If the block raises an exception, the event is recorded with status 'error'.
+    """
+    info = {'bytes': 0}
+    info.update(labels)
+    start = time.time()
+    try:
+        yield info
+    except BaseException:
+        info['status'] = 'error'
+        raise
+    finally:
+        nbytes = info.pop('bytes')
+        record(stage, time.time() - start, nbytes, **info)
+
+
+def read_events(log_file, run=None):
+    """
+    Read the events of one run (all runs if run is None, the last one if run is 'last') from an event log,
+    skipping any line that is incomplete.
+    """
+    events = []
+    with open(log_file) as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+    if run == 'last':
+        run = events[-1].get('run') if events else None
+    if run is not None:
+        events = [event for event in events if event.get('run') == run]
+    return events
+
+
+def summarize(events):
+    """
+    Group events by stage and summary labels, with the count, total and maximum time, and total bytes of each group.
+    """
+    groups = {}
+    for event in events:
+        key = (event['stage'],) + tuple((label, str(event[label])) for label in summary_labels if label in event)
+        group = groups.setdefault(key, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'bytes': 0})
+        group['count'] += 1
+        group['seconds'] += event['seconds']
+        group['max_seconds'] = max(group['max_seconds'], event['seconds'])
+        group['bytes'] += event.get('bytes',0)
+    # wall-clock span of each stage, from the start of the first event to the end of the last one
+    spans = {}
+    for event in events:
+        start, end = event['time'] - event['seconds'], event['time']
+        if event['stage'] in spans:
+            spans[event['stage']] = (min(spans[event['stage']][0],start), max(spans[event['stage']][1],end))
+        else:
+            spans[event['stage']] = (start, end)
+    return groups, spans
+
+
+def write_summary(summary_file, log_file=None, run=None):
+    """
+    Summarize the events of one run in an event log in Prometheus text format (see read_events; default: the current run
+    in the current event log). Returns the text, and writes it to summary_file if given.
+    Stages that run in parallel have a total time larger than their wall-clock time; the ratio is the average number running at once.
+    """
+    if log_file is None:
+        log_file, run = metrics_log, metrics_run
+    if log_file is None or not os.path.isfile(log_file):
+        return ''
+    groups, spans = summarize(read_events(log_file, run))
+    metrics = [('s1_stage_events_total','counter','Number of timed steps in each stage','count'),
+               ('s1_stage_seconds_total','counter','Total time spent in each stage, summed over parallel steps','seconds'),
+               ('s1_stage_seconds_max','gauge','Longest single step in each stage','max_seconds'),
+               ('s1_stage_bytes_total','counter','Total bytes transferred or written in each stage','bytes')]
+    lines = []
+    for name,kind,text,field in metrics:
+        lines += ['# HELP %s %s'%(name,text), '# TYPE %s %s'%(name,kind)]
+        for key in sorted(groups):
+            lines.append('%s{%s} %s'%(name, format_labels(key), format_value(groups[key][field])))
+    lines += ['# HELP s1_stage_bytes_per_second Average throughput of each step in each stage (total bytes / total time)',
+              '# TYPE s1_stage_bytes_per_second gauge']
+    for key in sorted(groups):
+        if groups[key]['bytes'] and groups[key]['seconds'] > 0:
+            lines.append('s1_stage_bytes_per_second{%s} %s'%(format_labels(key), format_value(groups[key]['bytes']/groups[key]['seconds'])))
+    lines += ['# HELP s1_stage_wall_seconds Wall-clock time from the start of the first step to the end of the last step of each stage',
+              '# TYPE s1_stage_wall_seconds gauge']
+    for stage in sorted(spans):
+        lines.append('s1_stage_wall_seconds{stage="%s"} %s'%(stage, format_value(spans[stage][1]-spans[stage][0])))
+    text = '\n'.join(lines) + '\n'
+    if summary_file:
+        with open(summary_file + '.tmp','w') as f:
+            f.write(text)
+        os.replace(summary_file + '.tmp', summary_file)
+    return text
+
+
+def format_labels(key):
+    labels = [('stage',key[0])] + list(key[1:])
+    return ','.join('%s="%s"'%(label,str(value).replace('\\','\\\\').replace('"','\\"')) for label,value in labels)
+
+
+def format_value(value):
+    return ('%.6f'%value).rstrip('0').rstrip('.') if isinstance(value,float) else str(value)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Summarize a stage timing event log (JSON lines) in Prometheus text format.')
+    parser.add_argument('log_file',type=str,help='Event log written with the metrics_log config option or the --metrics-log option. Required.')
+    parser.add_argument('-o','--output',type=str,default=None,help='File to write the summary to (default: print to the screen)')
+    parser.add_argument('-r','--run',type=str,default=None,help='Summarize only the events of this run (the "run" field of each event), or of the last run with "last" (default: all runs)')
+    args = parser.parse_args()
+    text = write_summary(args.output, args.log_file, args.run)
+    if not args.output:
+        print(text, end='')
@@ -6,8 +6,20 @@ Created on Wed Oct 25 11:45:24 2017
 @author: elindsey
 """
 
-import os,sys,glob,datetime,requests,cgi
+import os,io,sys,mmap,zlib,array,datetime,requests,cgi,json,bisect,calendar,time,sqlite3,threading
 from xml.etree import ElementTree
+from concurrent.futures import ThreadPoolExecutor
+import s1_metrics_func
+
+# Copernicus GNSS products API. May be changed with the environment variable S1_ORBIT_API_URL, e.g. to point to a local test server
+copernicus_api_url = os.environ.get('S1_ORBIT_API_URL', 'https://scihub.copernicus.eu/gnss/odata/v1/Products')
+
+# database of previous API query results. May be changed with the environment variable S1_ORBIT_QUERY_CACHE; set it to an empty string to disable the cache
+orbit_query_cache = os.environ.get('S1_ORBIT_QUERY_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 's1_orbit_query_cache.sqlite'))
+
+# time in seconds after which a cached restituted orbit, or a query that found nothing, is sent to the API again.
+# Precise orbits do not change once published, so a query that found one is never repeated.
+orbit_query_ttl = float(os.environ.get('S1_ORBIT_QUERY_TTL', 86400))
 
 
 def parse_s1_SAFE_name(safe_name):
@@ -34,33 +46,16 @@ def get_latest_orbit_file(sat_ab,imagestart,imageend,s1_orbit_dirs,download_miss
     If none is found, look for the file from ESA by default.
     Return string includes absolute path to file.
     """
-    eoflist=[]
-    eofprodlist=[]
-    latest_eof=None
     # add a half hour to the image start/end times to ensure we have enough coverage in the orbit file
     imagestart_pad = imagestart - datetime.timedelta(hours=0.5)
     imageend_pad = imageend + datetime.timedelta(hours=0.5)
     
     # first, we check if this file has already been downloaded - look in the provided folders
-    # loop over multiple orbit folders, if provided
-    for s1_orbit_dir in s1_orbit_dirs:
-        # loop over orbit files in this folder
-        for item in glob.glob(s1_orbit_dir+"/S1"+sat_ab+"*.EOF"):
-            #get basename, and read dates from string
-            eof=os.path.basename(item)
-            [eofprod,eofstart,eofend] = get_dates_from_eof(eof)
-            #check if the EOF validity dates span the entire image
-            if eofstart < imagestart_pad and eofend > imageend_pad:
-                # exclude case where preciseonly is set and image is RESORB type
-                if not (preciseonly and 'AUX_RESORB' in eof):
-                    eoflist.append(os.path.abspath(os.path.join(s1_orbit_dir,eof)))
-                    #record the production time to ensure we get the most recent one
-                    eofprodlist.append(eofprod)       
+    latest_eof = find_local_orbit_file(sat_ab,imagestart_pad,imageend_pad,s1_orbit_dirs,preciseonly)
 
     #print the most recent valid EOF found in the folders
-    if eoflist:
+    if latest_eof:
         found_existing=True
-        latest_eof = eoflist[eofprodlist.index(max(eofprodlist))]
     # if no file was found locally, download from ESA if this is requested
     elif download_missing:
         found_existing=False
@@ -97,6 +92,30 @@ def get_latest_orbit_file(sat_ab,imagestart,imageend,s1_orbit_dirs,download_miss
     return latest_eof,found_existing
 
 
+def find_local_orbit_file(sat_ab,start,end,s1_orbit_dirs,preciseonly=False):
+    """
+    Find the most recently produced EOF file in the orbit folders whose validity range includes start to end (no padding is added).
+    Uses the orbit index of each folder. Returns the absolute path to the file, or None if no file is found.
+    """
+    latest_eof=None
+    latest_prod=None
+    start=datetime_to_epoch(start)
+    end=datetime_to_epoch(end)
+    # loop over multiple orbit folders, if provided. A folder may also be an orbit archive
+    for s1_orbit_dir in s1_orbit_dirs:
+        index = get_orbit_archive(s1_orbit_dir) if is_orbit_archive(s1_orbit_dir) else get_orbit_index(s1_orbit_dir)
+        found = index.find_latest(sat_ab,start,end,preciseonly)
+        # keep the file with the latest production time; the first folder wins a tie
+        if found and (latest_prod is None or found[1] > latest_prod):
+            latest_eof = (index,found[0])
+            latest_prod = found[1]
+    if latest_eof is None:
+        return None
+    index,name = latest_eof
+    # files in an archive are extracted only once they are chosen
+    return index.extract(name) if isinstance(index,OrbitArchive) else os.path.join(index.orbit_dir,name)
+
+
 def download_latest_orbit(granule,target_dir,preciseonly):
 
     # parse the SAFE filename to get sat_ab and start/end dates
@@ -121,21 +140,35 @@ def download_latest_orbit(granule,target_dir,preciseonly):
         else:
             orbit = get_latest_orbit_copernicus_api(sat_ab,tstart,tend,'AUX_RESORB')        
 
-    # download the orbit file
-    eof_filename = download_copernicus_orbit_file(target_dir, orbit['remote_url'])
+    # download the orbit file, unless it is already in the target folder
+    eof_filename = os.path.abspath(os.path.join(target_dir, '%s.EOF'%orbit['name']))
+    if not os.path.exists(eof_filename):
+        eof_filename = download_copernicus_orbit_file(target_dir, orbit['remote_url'])
     return eof_filename
 
 
 def get_latest_orbit_copernicus_api(sat_ab,start_time,end_time,orbit_type):
     """
-    Use the Copernicus GNSS products API to find the latest orbit file.
+    Use the Copernicus GNSS products API to find the latest orbit file, using the local query cache when possible.
     Input example formats: 'A', '2018-08-10T22:47:19', '2018-08-10T22:48:16', 'AUX_POEORB'
-    Returns a python dictionary, with elements 'orbit_type' (matching the input orbit_type) and 'remote_url'.
+    Returns a python dictionary, with elements 'name', 'orbit_type' (matching the input orbit_type) and 'remote_url', or None if no orbit is found.
+    """
+    key = (sat_ab,orbit_type,start_time,end_time)
+    found,orbit = read_orbit_query_cache(key)
+    if not found:
+        orbit = query_copernicus_api(sat_ab,start_time,end_time,orbit_type)
+        write_orbit_query_cache(key,orbit)
+    return orbit
+
+
+def query_copernicus_api(sat_ab,start_time,end_time,orbit_type):
+    """
+    Send a query to the Copernicus GNSS products API to find the latest orbit file (see get_latest_orbit_copernicus_api).
     """
     # modified by E. Lindsey, April 2021
     
     # some hard-coded URLs to make the API work
-    scihub_url='https://scihub.copernicus.eu/gnss/odata/v1/Products'
+    scihub_url=copernicus_api_url
     # these are from the namespaces of the XML file returned in the query. Hopefully not subject to change?
     w3_url='{http://www.w3.org/2005/Atom}'
     m_url='{http://schemas.microsoft.com/ado/2007/08/dataservices/metadata}'
@@ -146,8 +179,10 @@ def get_latest_orbit_copernicus_api(sat_ab,start_time,end_time,orbit_type):
     
     # create HTTPS request and get response
     params = { '$top': 1, '$orderby': 'ContentDate/Start asc', '$filter': filterstring }
-    search_response = requests.get(url='https://scihub.copernicus.eu/gnss/odata/v1/Products', params=params, auth=('gnssguest','gnssguest'))
-    search_response.raise_for_status()
+    with s1_metrics_func.timed('orbit_query', orbit_type=orbit_type) as info:
+        search_response = requests.get(url=scihub_url, params=params, auth=('gnssguest','gnssguest'))
+        search_response.raise_for_status()
+        info['bytes'] = len(search_response.content)
 
     # parse XML tree from response
     tree = ElementTree.fromstring(search_response.content)
@@ -167,19 +202,239 @@ def get_latest_orbit_copernicus_api(sat_ab,start_time,end_time,orbit_type):
         orbit=None
     return orbit
 
+
+def get_orbits_copernicus_api_range(sat_ab,start_time,end_time,orbit_type):
+    """
+    Find all orbit files of one type whose validity overlaps start_time to end_time (see query_copernicus_api_range),
+    using the local query cache when possible.
+    """
+    key = (sat_ab,orbit_type,start_time,end_time)
+    found,orbits = read_orbit_query_cache(key,'orbit_range_queries')
+    if not found:
+        orbits = query_copernicus_api_range(sat_ab,start_time,end_time,orbit_type)
+        write_orbit_query_cache(key,orbits,'orbit_range_queries')
+    return orbits
+
+
+def query_copernicus_api_range(sat_ab,start_time,end_time,orbit_type,page_size=100):
+    """
+    Send a query to the Copernicus GNSS products API to find all orbit files of one type whose validity overlaps start_time to end_time.
+    Input formats are the same as get_latest_orbit_copernicus_api. Results are requested in pages of page_size files.
+    Returns a list of python dictionaries, with elements 'name', 'orbit_type' and 'remote_url'.
+    """
+    scihub_url=copernicus_api_url
+    w3_url='{http://www.w3.org/2005/Atom}'
+    m_url='{http://schemas.microsoft.com/ado/2007/08/dataservices/metadata}'
+    d_url='{http://schemas.microsoft.com/ado/2007/08/dataservices}'
+
+    # note the start and end times are swapped compared to get_latest_orbit_copernicus_api: we want any overlap, not full coverage
+    filterstring = f"startswith(Name,'S1{sat_ab}') and substringof('{orbit_type}',Name) and ContentDate/Start lt datetime'{end_time}' and ContentDate/End gt datetime'{start_time}'"
+
+    orbits=[]
+    while True:
+        params = { '$top': page_size, '$skip': len(orbits), '$orderby': 'ContentDate/Start asc', '$filter': filterstring }
+        with s1_metrics_func.timed('orbit_query', orbit_type=orbit_type) as info:
+            search_response = requests.get(url=scihub_url, params=params, auth=('gnssguest','gnssguest'))
+            search_response.raise_for_status()
+            info['bytes'] = len(search_response.content)
+        tree = ElementTree.fromstring(search_response.content)
+        entries = tree.findall(f'{w3_url}entry')
+        for entry in entries:
+            product_ID=entry.findtext(f'{m_url}properties/{d_url}Id')
+            product_name=entry.findtext(f'{w3_url}title')
+            orbits.append({'name':product_name, 'orbit_type':orbit_type, 'remote_url':f"{scihub_url}('{product_ID}')/$value"})
+        if len(entries) < page_size:
+            break
+    return orbits
+
+
+def get_orbit_files_batch(granules,s1_orbit_dirs,download_missing=True,preciseonly=False,nproc=1,max_gap=datetime.timedelta(days=14)):
+    """
+    Find the orbit files for a list of granules at once.
+    Granules from the same absolute orbit are merged into one window, padded by a half hour as in get_latest_orbit_file,
+    and each window is first looked up in the orbit folders. For the remaining windows, nearby windows of each satellite
+    (separated by less than max_gap) are merged into time spans, and each span is searched with a single API query.
+    A precise orbit file covers about a day, so one file usually serves many windows, and each distinct file is downloaded
+    only once (using nproc parallel downloads).
+    Returns a dictionary with the orbit ID (e.g. 'S1A_023190') as key, and the absolute path to the orbit file (or None if not found) as value.
+    """
+    # merge the granules into one window per absolute orbit
+    windows = {}
+    for granule in granules:
+        [sat_ab, sat_mode, start, end, orbit_num] = parse_s1_SAFE_name(granule)
+        ab_orbit = 'S1%s_%06d'%(sat_ab,orbit_num)
+        if ab_orbit in windows:
+            windows[ab_orbit][1] = min(windows[ab_orbit][1], start)
+            windows[ab_orbit][2] = max(windows[ab_orbit][2], end)
+        else:
+            windows[ab_orbit] = [sat_ab, start, end]
+    return get_orbit_files_for_windows(windows,s1_orbit_dirs,download_missing,preciseonly,nproc,max_gap)
+
+
+def get_orbit_files_for_windows(windows,s1_orbit_dirs,download_missing=True,preciseonly=False,nproc=1,max_gap=datetime.timedelta(days=14)):
+    """
+    Find the orbit files for a dictionary of time windows, with the orbit ID (e.g. 'S1A_023190') as key and [sat_ab, start, end] as value.
+    Each window is padded by a half hour, then searched as described in get_orbit_files_batch.
+    Returns a dictionary with the orbit ID as key, and the absolute path to the orbit file (or None if not found) as value.
+    """
+    pad = datetime.timedelta(hours=0.5)
+    windows = {ab_orbit: [sat_ab, start - pad, end + pad] for ab_orbit,(sat_ab,start,end) in windows.items()}
+
+    # look for existing files first
+    eofs = {}
+    missing = []
+    with s1_metrics_func.timed('orbit_lookup', orbits=len(windows)) as info:
+        for ab_orbit,(sat_ab,start,end) in windows.items():
+            eofs[ab_orbit] = find_local_orbit_file(sat_ab,start,end,s1_orbit_dirs,preciseonly)
+            if eofs[ab_orbit] is None:
+                missing.append(ab_orbit)
+        info['missing'] = len(missing)
+    if not missing or not download_missing:
+        return eofs
+
+    # search the remaining windows, precise orbits first
+    downloads = {}
+    orbit_types = ['AUX_POEORB'] if preciseonly else ['AUX_POEORB','AUX_RESORB']
+    for orbit_type in orbit_types:
+        for span in merge_orbit_windows([(ab_orbit,) + tuple(windows[ab_orbit]) for ab_orbit in missing], max_gap):
+            sat_ab = span[0][1]
+            tstart = min(window[2] for window in span).strftime('%Y-%m-%dT%H:%M:%S')
+            tend = max(window[3] for window in span).strftime('%Y-%m-%dT%H:%M:%S')
+            print('Searching for %s files for Sentinel-1%s from %s to %s (%d orbits)'%(orbit_type,sat_ab,tstart,tend,len(span)))
+            candidates = []
+            for orbit in get_orbits_copernicus_api_range(sat_ab,tstart,tend,orbit_type):
+                [eofprod,eofstart,eofend] = get_dates_from_eof(orbit['name'])
+                candidates.append((eofprod,eofstart,eofend,orbit))
+            # for each window, take the most recently produced file that covers it
+            for ab_orbit,sat_ab,start,end in span:
+                covering = [candidate for candidate in candidates if candidate[1] < start and candidate[2] > end]
+                if covering:
+                    orbit = max(covering, key=lambda candidate: candidate[0])[3]
+                    downloads.setdefault(orbit['name'],(orbit,[]))[1].append(ab_orbit)
+                    missing.remove(ab_orbit)
+
+    # download each distinct file once. Set download location as in get_latest_orbit_file
+    def download(orbit):
+        if len(s1_orbit_dirs)>1 and orbit['orbit_type'] == 'AUX_RESORB':
+            target_dir=s1_orbit_dirs[1]
+        else:
+            target_dir=s1_orbit_dirs[0]
+        return download_copernicus_orbit_file(target_dir,orbit['remote_url'])
+    print('Downloading %d orbit files for %d orbits.'%(len(downloads),sum(len(ab_orbits) for orbit,ab_orbits in downloads.values())))
+    with ThreadPoolExecutor(max_workers=nproc) as executor:
+        results = executor.map(download, [orbit for orbit,ab_orbits in downloads.values()])
+        for eof_filename,(orbit,ab_orbits) in zip(results, downloads.values()):
+            print(f'Downloaded new file: {eof_filename}')
+            for ab_orbit in ab_orbits:
+                eofs[ab_orbit] = eof_filename
+    return eofs
+
+
+def merge_orbit_windows(windows,max_gap):
+    """
+    Group a list of windows (orbit ID, sat_ab, start, end) into spans of nearby windows from the same satellite,
+    where each window starts less than max_gap after the end of the previous one. Returns a list of lists of windows.
+    """
+    spans = []
+    for window in sorted(windows, key=lambda window: (window[1],window[2])):
+        if spans and spans[-1][-1][1] == window[1] and window[2] - max(w[3] for w in spans[-1]) < max_gap:
+            spans[-1].append(window)
+        else:
+            spans.append([window])
+    return spans
+
+
+######################## Orbit API query cache ########################
+
+# connection to the query cache database, opened on first use in each process
+_query_db = None
+
+
+def get_orbit_query_db():
+    """
+    Open the query cache database, creating it if needed. Returns None if the cache is disabled or cannot be opened.
+    """
+    global _query_db
+    if _query_db is None and orbit_query_cache:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(orbit_query_cache)), exist_ok=True)
+            _query_db = sqlite3.connect(orbit_query_cache, timeout=60)
+            # results of single-orbit queries, and lists of results of range queries
+            for table in ['orbit_queries','orbit_range_queries']:
+                _query_db.execute('create table if not exists %s (sat_ab text, orbit_type text, start_time text, end_time text, '
+                                  'result text, query_time real, primary key (sat_ab, orbit_type, start_time, end_time))'%table)
+            _query_db.commit()
+        except (OSError, sqlite3.Error) as e:
+            print('Warning: cannot open orbit query cache %s, not using it: %s'%(orbit_query_cache,e))
+            _query_db = None
+    return _query_db
+
+
+def read_orbit_query_cache(key,table='orbit_queries'):
+    """
+    Look up a query (sat_ab, orbit_type, start_time, end_time) in the cache: a single-orbit query in the table orbit_queries,
+    or a range query in orbit_range_queries. Returns a tuple (found, result), where result is the cached orbit (possibly None)
+    or list of orbits if found is True.
+    """
+    db = get_orbit_query_db()
+    if db is None:
+        return False,None
+    try:
+        row = db.execute('select result, query_time from %s where sat_ab=? and orbit_type=? and start_time=? and end_time=?'%table, key).fetchone()
+    except sqlite3.Error:
+        return False,None
+    if row is None:
+        return False,None
+    result = json.loads(row[0])
+    if not is_final_query_result(key,result) and time.time() - row[1] > orbit_query_ttl:
+        return False,None
+    return True,result
+
+
+def is_final_query_result(key,result):
+    """
+    Check whether a cached query result can be kept forever. Only a query that found a precise orbit is final;
+    for a range query, the precise orbits found must also cover the range up to its end, since later files may still be published.
+    """
+    if isinstance(result,list):
+        return key[1] == 'AUX_POEORB' and bool(result) and max(get_dates_from_eof(orbit['name'])[2] for orbit in result) >= datetime.datetime.strptime(key[3],'%Y-%m-%dT%H:%M:%S')
+    return bool(result) and result['orbit_type'] == 'AUX_POEORB'
+
+
+def write_orbit_query_cache(key,result,table='orbit_queries'):
+    """
+    Save the result of a query (sat_ab, orbit_type, start_time, end_time) to the cache (see read_orbit_query_cache).
+    """
+    db = get_orbit_query_db()
+    if db is None:
+        return
+    try:
+        db.execute('insert or replace into %s values (?,?,?,?,?,?)'%table, key + (json.dumps(result), time.time()))
+        db.commit()
+    except sqlite3.Error as e:
+        print('Warning: cannot write to orbit query cache %s: %s'%(orbit_query_cache,e))
+
+
 def download_copernicus_orbit_file(dest_folder,remote_url):
     """
     Download orbit file returned by the Copernicus GNSS products API.
     Inputs: destination folder (absolute or relative path) and the remote URL, with a format like: https://scihub.copernicus.eu/gnss/odata/v1/Products('3a773f7a-0602-44e4-b4c0-609b7f4291f0')/$value
+    If the destination is an orbit archive, the file is saved in orbit_extract_dir and added to the archive.
     Returns the absolute path of the saved file.
     """
     # created by E. Lindsey, April 2021
 
+    archive = get_orbit_archive(dest_folder) if is_orbit_archive(dest_folder) else None
+    if archive is not None:
+        dest_folder = orbit_extract_dir
+
     # check that the output folder exists
     os.makedirs(dest_folder, exist_ok = True)
 
     # download the orbit file
-    dl_response = requests.get(url=remote_url, auth=('gnssguest','gnssguest'))
+    with s1_metrics_func.timed('orbit_download') as info:
+        dl_response = requests.get(url=remote_url, auth=('gnssguest','gnssguest'))
+        info['bytes'] = len(dl_response.content)
 
     # find the filename in the header
     header = dl_response.headers['content-disposition']
@@ -190,6 +445,8 @@ def download_copernicus_orbit_file(dest_folder,remote_url):
 
     # save the file with the correct filename
     open(eof_filename, 'wb').write(dl_response.content)
+    if archive is not None:
+        archive.add(eof_filename)
 
     return eof_filename
 
@@ -207,3 +464,297 @@ def get_dates_from_eof(eof_name):
     date3=datetime.datetime.strptime(eof_name[58:73],'%Y%m%dT%H%M%S')
     return [date1,date2,date3]
 
+
+
+######################## Orbit file index ########################
+
+# name of the index file saved in each orbit folder
+orbit_index_name = '.s1_orbit_index.json'
+
+# orbit indexes loaded by this process, by absolute folder path
+_orbit_indexes = {}
+
+
+class OrbitIndex:
+    """
+    Index of the EOF files in one orbit folder, grouped by satellite and sorted by start of validity.
+    Dates are stored as integer seconds since 1970, read from each file name only once.
+    The index is saved to a file in the orbit folder, and refreshed when the folder modification time changes.
+    """
+    def __init__(self, orbit_dir):
+        self.orbit_dir = os.path.abspath(orbit_dir)
+        self.index_file = os.path.join(self.orbit_dir, orbit_index_name)
+        self.mtime = None
+        # file name -> [production, start, end]
+        self.files = {}
+        # satellite A/B -> list of (start, end, production, file name) sorted by start, and the list of start times
+        self.entries = {}
+        self.starts = {}
+        # satellite A/B -> longest validity range of any file, used to bound the search
+        self.max_span = {}
+
+    def refresh(self):
+        """
+        Update the index if the folder has changed since it was last read.
+        """
+        try:
+            mtime = os.stat(self.orbit_dir).st_mtime
+        except OSError:
+            return
+        if mtime == self.mtime:
+            return
+        if self.mtime is None:
+            self.load()
+            if mtime == self.mtime:
+                self.sort()
+                return
+        # list the folder, and read dates only from files we have not seen before
+        names = [name for name in os.listdir(self.orbit_dir) if name.startswith('S1') and name.endswith('.EOF')]
+        changed = len(names) != len(self.files)
+        files = {}
+        for name in names:
+            if name in self.files:
+                files[name] = self.files[name]
+            else:
+                try:
+                    files[name] = [datetime_to_epoch(date) for date in get_dates_from_eof(name)]
+                except ValueError:
+                    continue
+                changed = True
+        self.files = files
+        self.mtime = mtime
+        self.sort()
+        if changed:
+            self.save()
+
+    def sort(self):
+        self.entries = {}
+        self.starts = {}
+        self.max_span = {}
+        for name,(prod,start,end) in self.files.items():
+            self.entries.setdefault(name[2],[]).append((start,end,prod,name))
+        for sat_ab,entries in self.entries.items():
+            entries.sort()
+            self.starts[sat_ab] = [entry[0] for entry in entries]
+            self.max_span[sat_ab] = max(entry[1] - entry[0] for entry in entries)
+
+    def load(self):
+        try:
+            with open(self.index_file) as f:
+                saved = json.load(f)
+            self.files = saved['files']
+            self.mtime = saved['mtime']
+        except (OSError, ValueError, KeyError):
+            # missing or unreadable index file, rebuild it from the folder
+            self.files = {}
+            self.mtime = None
+
+    def save(self):
+        """
+        Write the index to the orbit folder. An existing index file is rewritten in place, since creating
+        a new file would change the folder modification time that marks the index as up to date.
+        """
+        try:
+            if not os.path.exists(self.index_file):
+                open(self.index_file, 'w').close()
+                self.mtime = os.stat(self.orbit_dir).st_mtime
+            with open(self.index_file, 'r+') as f:
+                json.dump({'mtime': self.mtime, 'files': self.files}, f)
+                f.truncate()
+        except OSError:
+            # the orbit folder may be read-only, in which case the index is only kept in memory
+            pass
+
+    def find_latest(self, sat_ab, start, end, preciseonly=False):
+        """
+        Find the most recently produced file whose validity range includes start to end (in seconds since 1970).
+        Returns a tuple (file name, production time), or None if no file is found.
+        """
+        if sat_ab not in self.entries:
+            return None
+        entries = self.entries[sat_ab]
+        starts = self.starts[sat_ab]
+        # only files starting after start - max_span can extend past start, and they must start before it
+        lo = bisect.bisect_left(starts, start - self.max_span[sat_ab])
+        hi = bisect.bisect_left(starts, start)
+        latest = None
+        for eofstart,eofend,eofprod,eof in entries[lo:hi]:
+            if eofend > end and not (preciseonly and 'AUX_RESORB' in eof):
+                if latest is None or eofprod > latest[1]:
+                    latest = (eof,eofprod)
+        return latest
+
+
+def get_orbit_index(orbit_dir):
+    """
+    Return the orbit index for a folder, loading or building it the first time it is used in this process,
+    and updating it if the folder has changed since.
+    """
+    orbit_dir = os.path.abspath(orbit_dir)
+    if orbit_dir not in _orbit_indexes:
+        _orbit_indexes[orbit_dir] = OrbitIndex(orbit_dir)
+    index = _orbit_indexes[orbit_dir]
+    index.refresh()
+    return index
+
+
+def datetime_to_epoch(date):
+    """
+    Convert a (UTC) datetime object to integer seconds since 1970.
+    """
+    return calendar.timegm(date.utctimetuple())
+
+
+######################## Orbit archive ########################
+
+# an orbit 'folder' whose name ends with this suffix is an orbit archive (see OrbitArchive)
+orbit_archive_suffix = '.sqlite'
+
+# folder for EOF files extracted from orbit archives. May be changed with the environment variable S1_ORBIT_EXTRACT_DIR.
+# Extracted files are only a cache, and may be deleted at any time.
+orbit_extract_dir = os.environ.get('S1_ORBIT_EXTRACT_DIR', os.path.join(os.path.expanduser('~'), '.cache', 's1_orbit_eofs'))
+
+# orbit archives opened by this process, by absolute path
+_orbit_archives = {}
+
+# values stored for each orbit state vector: UTC time (seconds since 1970), X, Y, Z (m), VX, VY, VZ (m/s)
+state_vector_fields = ['UTC','X','Y','Z','VX','VY','VZ']
+
+
+def is_orbit_archive(s1_orbit_dir):
+    return s1_orbit_dir.endswith(orbit_archive_suffix)
+
+
+class OrbitArchive:
+    """
+    A single SQLite file holding many EOF files, each compressed with zlib, indexed by satellite and validity range
+    so that the file covering a time range is found without listing or reading any folder.
+    EOF files are extracted on demand to orbit_extract_dir.
+    Optionally, the state vectors of each file are also kept in a companion file (archive name + '.osv') as a flat array
+    of float64 values (see state_vector_fields), which can be memory-mapped (see get_state_vectors).
+    The archive may be used from several threads of the same process.
+    """
+    def __init__(self, filename):
+        self.filename = os.path.abspath(filename)
+        self.osv_file = self.filename + '.osv'
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        self.db = sqlite3.connect(self.filename, timeout=60, check_same_thread=False)
+        self.db.execute('create table if not exists orbits (name text primary key, sat text, start integer, end integer, production integer, '
+                        'size integer, data blob, osv_offset integer, osv_count integer)')
+        self.db.execute('create index if not exists orbits_by_start on orbits (sat, start)')
+        self.db.commit()
+        self.osv_map = None
+        # satellite A/B -> longest validity range of any file, used to bound the search as in OrbitIndex
+        self.max_span = {}
+
+    def add(self, eof_filename, state_vectors=False):
+        """
+        Store an EOF file in the archive, unless a file of the same name is already there. Returns True if the file was added.
+        If state_vectors is set, its state vectors are also stored.
+        """
+        name = os.path.basename(eof_filename)
+        with open(eof_filename, 'rb') as f:
+            data = f.read()
+        prod,start,end = [datetime_to_epoch(date) for date in get_dates_from_eof(name)]
+        osv = parse_state_vectors(data) if state_vectors else []
+        # compress outside the lock, so that several threads can add files at once
+        compressed = zlib.compress(data)
+        with self.lock:
+            # hold the write lock of the database while appending state vectors, so that their offsets are unique
+            self.db.execute('begin immediate')
+            try:
+                if self.db.execute('select 1 from orbits where name=?', (name,)).fetchone():
+                    self.db.rollback()
+                    return False
+                osv_offset = None
+                if osv:
+                    with open(self.osv_file, 'ab') as f:
+                        osv_offset = f.tell()//(8*len(state_vector_fields))
+                        f.write(array.array('d', [value for vector in osv for value in vector]).tobytes())
+                self.db.execute('insert into orbits values (?,?,?,?,?,?,?,?,?)', (name, name[2], start, end, prod, len(data),
+                                compressed, osv_offset, len(osv) if osv else None))
+                self.db.commit()
+            except BaseException:
+                self.db.rollback()
+                raise
+            self.max_span.pop(name[2], None)
+        return True
+
+    def sizes(self):
+        """
+        Return a dictionary with the name and uncompressed size of each file in the archive.
+        """
+        with self.lock:
+            return dict(self.db.execute('select name, size from orbits'))
+
+    def find_latest(self, sat_ab, start, end, preciseonly=False):
+        """
+        Find the most recently produced file whose validity range includes start to end (in seconds since 1970).
+        Returns a tuple (file name, production time), or None if no file is found.
+        """
+        query = 'select name, production from orbits where sat=? and start<? and start>=? and end>?'
+        if preciseonly:
+            query += " and name not like '%AUX_RESORB%'"
+        with self.lock:
+            if sat_ab not in self.max_span:
+                self.max_span[sat_ab] = self.db.execute('select max(end-start) from orbits where sat=?', (sat_ab,)).fetchone()[0] or 0
+            return self.db.execute(query + ' order by production desc limit 1', (sat_ab, start, start - self.max_span[sat_ab], end)).fetchone()
+
+    def extract(self, name, dest_dir=None):
+        """
+        Write one EOF file from the archive to dest_dir (default: orbit_extract_dir), unless it is already there.
+        Returns the absolute path of the file.
+        """
+        dest_dir = dest_dir or orbit_extract_dir
+        eof_filename = os.path.abspath(os.path.join(dest_dir, name))
+        with self.lock:
+            size,data = self.db.execute('select size, data from orbits where name=?', (name,)).fetchone()
+        if os.path.isfile(eof_filename) and os.path.getsize(eof_filename) == size:
+            return eof_filename
+        os.makedirs(dest_dir, exist_ok=True)
+        # write to a temporary name first, so that other processes never see a partial file
+        temp = '%s.%d.tmp'%(eof_filename, os.getpid())
+        with open(temp, 'wb') as f:
+            f.write(zlib.decompress(data))
+        os.replace(temp, eof_filename)
+        return eof_filename
+
+    def get_state_vectors(self, name):
+        """
+        Return the state vectors of a file as a memoryview of shape (number of vectors, 7), backed by a memory map
+        of the state vector file (e.g. numpy.asarray(view) makes an array without copying). Returns None if they were not stored.
+        """
+        with self.lock:
+            offset,count = self.db.execute('select osv_offset, osv_count from orbits where name=?', (name,)).fetchone()
+            if offset is None:
+                return None
+            nvalues = len(state_vector_fields)
+            # map the file again if it has grown since it was mapped
+            if self.osv_map is None or len(self.osv_map) < (offset + count)*8*nvalues:
+                with open(self.osv_file, 'rb') as f:
+                    self.osv_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self.osv_map)[offset*8*nvalues:(offset + count)*8*nvalues].cast('d', [count, nvalues])
+
+
+def get_orbit_archive(filename):
+    """
+    Return the orbit archive for a file, opening it the first time it is used in this process.
+    """
+    filename = os.path.abspath(filename)
+    if filename not in _orbit_archives:
+        _orbit_archives[filename] = OrbitArchive(filename)
+    return _orbit_archives[filename]
+
+
+def parse_state_vectors(data):
+    """
+    Read the orbit state vectors from the contents of an EOF file. Returns a list of tuples of the values in state_vector_fields.
+    """
+    vectors = []
+    for event,element in ElementTree.iterparse(io.BytesIO(data)):
+        if element.tag == 'OSV':
+            utc = datetime.datetime.strptime(element.findtext('UTC').split('=')[-1], '%Y-%m-%dT%H:%M:%S.%f')
+            vectors.append((calendar.timegm(utc.utctimetuple()) + utc.microsecond*1e-6,) + tuple(float(element.findtext(field)) for field in state_vector_fields[1:]))
+            element.clear()
+    return vectors
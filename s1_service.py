@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Long-running local service that runs query, download, orbit and frame jobs sent by s1_client.py over a Unix socket.
+Each job takes the same command-line arguments as sentinel_query_download.py, get_s1_orbits.py or cat_s1.py.
+Between jobs the service keeps the imported modules, the HTTP session with its open connections, the orbit folder indexes,
+and the open granule catalogs, AWS indexes and source statistics in memory, so a small job costs milliseconds instead of
+the seconds needed to start python, start worker processes, connect to each server again and rescan the orbit folders.
+
+Jobs run one at a time, in the order received, each in the directory the client was run from, and the output of each job
+is sent back to its client. Downloads always use the asyncio scheduler (threads in the service process, sharing one HTTP session),
+and cat_s1.py jobs always use --staged (threads), so no worker processes are started.
+
+Created October 2026
+"""
+
+import os,sys,io,json,time,queue,socket,argparse,threading,traceback,contextlib,socketserver
+import sentinel_query_download,get_s1_orbits,cat_s1,s1_orbit_func,s1_metrics_func
+from s1_client import default_socket,job_scripts
+
+
+class JobOutput(io.TextIOBase):
+    """
+    Stream that sends everything written to it to the client of a job, as JSON lines. Output is dropped if the client has gone.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.lock = threading.Lock()
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if text:
+            with self.lock:
+                try:
+                    self.connection.sendall((json.dumps({'output': text}) + '\n').encode())
+                except OSError:
+                    pass
+        return len(text)
+
+
+def run_job(job, argv, cwd, out):
+    """
+    Run one job in the directory cwd, with all output written to out. Returns the exit status of the job.
+    """
+    # jobs may turn on the stage timing log, which should not stay on for the next job
+    metrics_log, metrics_run = s1_metrics_func.metrics_log, s1_metrics_func.metrics_run
+    metrics_env = {name: os.environ.get(name) for name in ['S1_METRICS_LOG','S1_METRICS_RUN']}
+    service_dir = os.getcwd()
+    service_argv = sys.argv
+    status = 0
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+        try:
+            os.chdir(cwd)
+            # so that usage and error messages show the name of the script
+            sys.argv = [job_scripts[job]] + argv
+            if job == 'query':
+                sentinel_query_download.main([arg for arg in argv if arg != '--download'], scheduler='asyncio')
+            elif job == 'download':
+                sentinel_query_download.main(argv if '--download' in argv else argv + ['--download'], scheduler='asyncio')
+            elif job == 'orbits':
+                get_s1_orbits.main(argv)
+            elif job == 'frames':
+                cat_s1.main(argv if '--staged' in argv else argv + ['--staged'])
+        except SystemExit as e:
+            # scripts exit on errors, and argparse on invalid arguments
+            status = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            os.chdir(service_dir)
+            sys.argv = service_argv
+            s1_metrics_func.metrics_log, s1_metrics_func.metrics_run = metrics_log, metrics_run
+            for name,value in metrics_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+    return status
+
+
+class S1Service:
+    """
+    Queue of jobs, run one at a time by a single worker thread.
+    """
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.running = None
+        self.completed = 0
+        self.failed = 0
+        self.started = time.time()
+        self.worker = threading.Thread(target=self.run_jobs)
+        self.worker.start()
+
+    def run_jobs(self):
+        while True:
+            item = self.jobs.get()
+            if item is None:
+                return
+            request, connection, result = item
+            self.running = {'job': request['job'], 'argv': request.get('argv',[]), 'cwd': request.get('cwd','.'), 'started': time.time()}
+            status = run_job(request['job'], self.running['argv'], self.running['cwd'], JobOutput(connection))
+            print('%s job %s %s in %s: exit status %d, %.2f s'%(time.strftime('%Y-%m-%dT%H:%M:%S'), request['job'], ' '.join(self.running['argv']),
+                                                              self.running['cwd'], status, time.time() - self.running['started']), flush=True)
+            self.running = None
+            self.completed += 1
+            if status != 0:
+                self.failed += 1
+            result['status'] = status
+            result['done'].set()
+
+    def submit(self, request, connection):
+        """
+        Queue a job, and wait for it to finish. Returns its exit status.
+        """
+        result = {'done': threading.Event()}
+        self.jobs.put((request, connection, result))
+        result['done'].wait()
+        return result['status']
+
+    def status(self):
+        return {'pid': os.getpid(), 'uptime': round(time.time() - self.started, 1), 'running': self.running,
+                'queued': self.jobs.qsize(), 'completed': self.completed, 'failed': self.failed}
+
+    def stop(self):
+        """
+        Finish the queued jobs, then stop the worker thread.
+        """
+        self.jobs.put(None)
+        self.worker.join()
+
+
+class ServiceHandler(socketserver.StreamRequestHandler):
+    """
+    Handle one client connection: a single JSON line with the job, its arguments and directory.
+    """
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        service = self.server.service
+        if request.get('job') == 'status':
+            self.reply(0, service.status())
+        elif request.get('job') == 'stop':
+            self.reply(0, 'Service stopping after %d queued jobs.'%service.jobs.qsize())
+            threading.Thread(target=self.server.shutdown).start()
+        elif request.get('job') in job_scripts:
+            self.reply(service.submit(request, self.connection))
+        else:
+            self.reply(2, 'Unknown job %s, must be one of %s, status or stop.'%(request.get('job'), ', '.join(job_scripts)))
+
+    def reply(self, status, result=None):
+        try:
+            self.connection.sendall((json.dumps({'status': status, 'result': result}) + '\n').encode())
+        except OSError:
+            pass
+
+
+def start_server(socket_path):
+    """
+    Listen on a Unix socket that only the current user can connect to. A socket file left behind by a service that
+    did not exit cleanly is removed, but a socket with a running service is an error.
+    """
+    if os.path.exists(socket_path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(socket_path)
+            except OSError:
+                os.remove(socket_path)
+            else:
+                raise RuntimeError('A service is already running at %s.'%socket_path)
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(socket_path, ServiceHandler)
+    finally:
+        os.umask(umask)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run query, download, orbit and frame jobs sent by s1_client.py, keeping HTTP sessions and orbit indexes in memory between jobs.')
+    parser.add_argument('-S','--socket',type=str,default=default_socket,help='Unix socket to listen on (default: %s, or set S1_SERVICE_SOCKET)'%default_socket)
+    parser.add_argument('-o','--orbit-dir',type=str,action='append',default=[],help='Orbit directory to index at startup, so that the first orbit job does not wait for it. Repeat option for multiple directories.')
+    args = parser.parse_args()
+
+    for orbit_dir in args.orbit_dir:
+        s1_orbit_func.get_orbit_index(orbit_dir)
+    server = start_server(args.socket)
+    server.service = S1Service()
+    print('Service listening on %s (pid %d)'%(args.socket, os.getpid()), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.stop()
+        os.remove(args.socket)
+    print('Service stopped after %d jobs.'%server.service.completed)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run the ASF searches of many config files (one per area of interest, or AOI) at once, and download each granule found only once,
+with a single limit on the number of parallel downloads. Each granule is downloaded into the P###/F#### tree of the first AOI
+that needs it (the directory containing its config file), and linked into the tree of every other AOI that found it.
+
+Download settings ([download] and [asf_download] sections) are read from the first config file, or from --settings.
+The [api_search] section and the search_windows option are read from each config file.
+
+Created October 2026
+
+@author: Eric Lindsey, University of New Mexico
+"""
+
+import configparser,argparse,os,time
+from concurrent.futures import ThreadPoolExecutor
+import sentinel_query_download,s1_download_func,s1_catalog_func,s1_metrics_func
+
+def read_config(filename):
+    config=configparser.ConfigParser()
+    config.optionxform = str #make the config file case-sensitive
+    if not config.read(filename):
+        raise ValueError('Could not read config file %s.'%filename)
+    return config
+
+def query_aoi(config_file, logtime, verbose=False):
+    """
+    Run the ASF search of one config file, saving the result as a csv file in the directory of the config file.
+    Returns the query result rows.
+    """
+    config=read_config(config_file)
+    # the result must be parsed, so always ask for csv
+    arg_list=[item for item in config.items('api_search') if item[0] != 'output'] + [('output','csv')]
+    search_windows=config.getint('download','search_windows',fallback=1)
+    query_log=os.path.join(os.path.dirname(os.path.abspath(config_file)),'asf_query_%s.csv'%logtime)
+    rows=[]
+    with open(query_log,'w',newline='') as f:
+        list(sentinel_query_download.save_query_rows(sentinel_query_download.query_asf_csv(arg_list,search_windows),f,verbose,rows))
+    print('Found %d scenes for %s, saved to %s'%(len(rows),config_file,query_log))
+    return rows
+
+def merge_queries(config_files, results):
+    """
+    Merge the query results of all config files. Returns a dictionary of the unique granules, each with the first row found for it,
+    and a dictionary with the list of AOI directories that found each granule.
+    """
+    granules={}
+    aoi_dirs={}
+    for config_file,rows in zip(config_files,results):
+        aoi_dir=os.path.dirname(os.path.abspath(config_file))
+        for row in rows:
+            name=row['Granule Name']
+            granules.setdefault(name,row)
+            if aoi_dir not in aoi_dirs.setdefault(name,[]):
+                aoi_dirs[name].append(aoi_dir)
+    return granules, aoi_dirs
+
+def choose_download_root(row, aoi_dirs):
+    """
+    The AOI directory to download a granule into: the first one that already has the file (or part of it), otherwise the first one.
+    """
+    frame_dir=sentinel_query_download.get_frame_dir(row)
+    filename=row['URL'].split('/')[-1]
+    for aoi_dir in aoi_dirs:
+        if any(os.path.exists(os.path.join(aoi_dir,frame_dir,filename + suffix)) for suffix in ['','.part']):
+            return aoi_dir
+    return aoi_dirs[0]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search and download data from the ASF archive for several config files at once, downloading each scene only once.')
+    parser.add_argument('configs',type=str,nargs='+',help='Config files, one per area of interest. Scenes are saved in P###/F#### directories next to each config file. Required.')
+    parser.add_argument('--download',action='store_true',help='Download the resulting scenes (default: false)')
+    parser.add_argument('--verbose',action='store_true',help='Print the query result to the screen (default: false)')
+    parser.add_argument('-s','--settings',type=str,default=None,help='Config file to read the [download] and [asf_download] sections from (default: the first config file)')
+    parser.add_argument('--link',type=str,default='hard',choices=['hard','symlink','copy'],help='How to place a scene in the directories of the other AOIs that found it: hard link (or symbolic link across file systems), symbolic link or copy (default: hard)')
+    parser.add_argument('-q','--query-nproc',type=int,default=8,help='Number of config files to search at the same time (default: 8)')
+    args = parser.parse_args()
+
+    config=read_config(args.settings or args.configs[0])
+    nproc=config.getint('download','nproc',fallback=1)
+    scheduler=config.get('download','scheduler',fallback='pool')
+    if scheduler not in ['pool','asyncio']:
+        raise ValueError('Unknown scheduler %s in config file, must be pool or asyncio.'%scheduler)
+    aws_nproc=config.getint('download','aws_nproc',fallback=nproc)
+    asf_nproc=config.getint('download','asf_nproc',fallback=nproc)
+    max_bandwidth=config.getfloat('download','max_bandwidth',fallback=0)*1e6
+    aws_index_file=config.get('download','aws_index',fallback='')
+    aws_index_threads=config.getint('download','aws_index_threads',fallback=8)
+    download_order=config.get('download','order',fallback='query')
+    if download_order not in sentinel_query_download.download_orders:
+        raise ValueError('Unknown order %s in config file, must be one of %s.'%(download_order,', '.join(sentinel_query_download.download_orders)))
+    min_free_space=config.getfloat('download','min_free_space',fallback=0)*1e9
+    metrics_log=config.get('download','metrics_log',fallback='')
+    metrics_summary=config.get('download','metrics_summary',fallback='')
+    if metrics_log:
+        s1_metrics_func.enable(metrics_log)
+    download_info=sentinel_query_download.read_download_info(config, args.download)
+
+    # run all searches at once
+    print('\nRunning ASF API queries for %d config files.\n'%len(args.configs))
+    logtime=time.strftime("%Y_%m_%d-%H_%M_%S")
+    with ThreadPoolExecutor(max_workers=args.query_nproc) as executor:
+        results=list(executor.map(lambda config_file: query_aoi(config_file,logtime,args.verbose), args.configs))
+    granules,aoi_dirs=merge_queries(args.configs,results)
+    print('\nFound %d scenes in total, %d unique.\n'%(sum(len(rows) for rows in results),len(granules)))
+
+    if args.download:
+        rows=list(granules.values())
+        for row in rows:
+            row['Download Root']=choose_download_root(row,aoi_dirs[row['Granule Name']])
+        downloadList=sentinel_query_download.prepare_downloads(rows,download_info)
+        if aws_index_file and download_info['Download Site'] != 'ASF':
+            aws_index=s1_catalog_func.AwsIndex(aws_index_file)
+            sentinel_query_download.list_aws_days([row['Acquisition Date'][0:10] for row in rows],aws_index,aws_index_threads)
+            downloadList=sentinel_query_download.route_downloads(downloadList,aws_index)
+        plan=sentinel_query_download.DownloadPlan(download_order, min_free_space,
+                                                  sentinel_query_download.estimate_rate(download_info, aws_nproc + asf_nproc if scheduler == 'asyncio' else nproc, max_bandwidth))
+        downloadList=plan.plan(list(downloadList))
+        # link each finished granule into the directories of the other AOIs that found it
+        failed=[]
+        def link_result(name, status):
+            if status != 0:
+                failed.append(name)
+                return
+            row=granules[name]
+            source=os.path.join(sentinel_query_download.get_frame_dir(row),row['URL'].split('/')[-1])
+            for aoi_dir in aoi_dirs[name]:
+                if aoi_dir != row['Download Root']:
+                    target=os.path.join(aoi_dir,os.path.relpath(source,row['Download Root']))
+                    try:
+                        s1_download_func.link_file(source,target,args.link)
+                    except OSError as e:
+                        print('Could not place %s in %s: %s'%(name,aoi_dir,e))
+                        failed.append(name)
+        sentinel_query_download.run_downloads(downloadList, scheduler, nproc, aws_nproc, asf_nproc, max_bandwidth, download_info['Segments'], link_result, plan)
+        if failed:
+            print('\n%d downloads failed.'%len(failed))
+        print('\nDownload complete.\n')
+    else:
+        print('Not downloading.\n')
+
+    if metrics_log:
+        s1_metrics_func.write_summary(metrics_summary or metrics_log + '.prom')
+        print('Stage timings saved to %s, summary in %s\n'%(metrics_log, metrics_summary or metrics_log + '.prom'))
+
+    print('Sentinel batch query complete.\n')
@@ -10,84 +10,908 @@ Modified June 2019 to enable parallel downloads
 Modified Oct 2019 to enable multiple file types (e.g. csv,json,kml)
 Modified July 2021, minor fixes
 Modified April 2023, change multiprocessing start method to spawn to avoid race conditions
+Modified October 2026, add native python download engine as an alternative to wget, with optional multi-connection downloads
+Modified October 2026, add asyncio download scheduler with per-source concurrency limits and a bandwidth cap
+Modified October 2026, stream query results, optionally split into parallel time windows, and start downloads as results arrive
+Modified October 2026, add incremental mode using a local catalog of granules and their download state
+Modified October 2026, add verification of new and existing downloads against the size and MD5 from the query result
+Modified October 2026, optionally create the cropped frame of each orbit with cat_s1 functions as soon as its scenes are downloaded
+Modified October 2026, add optional timing and throughput event log for each stage, with a Prometheus text summary
+Modified October 2026, add download_site = auto, choosing AWS or ASF for each granule from their recent throughput, with optional hedging
+Modified October 2026, add an index of the granules in the AWS dataset from its daily folder listings, to send missing granules directly to ASF
+Modified October 2026, move download settings and the download schedulers into functions, shared with sentinel_batch_download.py
+Modified October 2026, pass compact granule records to download workers, with the download settings and credentials sent once per worker
+Modified October 2026, move the command-line script into main(), so that s1_service.py can run it as a job
+Modified October 2026, add a journal of the query result and the state of each download, so that an interrupted run is resumed
+Modified October 2026, order downloads by size or by satellite pass, report the estimated time left, and pause new downloads when the disk is nearly full
 
 @author: Eric Lindsey, University of New Mexico
 """
 
-import configparser,argparse,requests,csv,subprocess,os,multiprocessing,time
-#optional use urllib instead of wget
-#from urllib.request import urlopen
+import configparser,argparse,requests,csv,subprocess,os,shutil,multiprocessing,time,asyncio,datetime,queue,threading,contextlib,urllib.parse
+from concurrent.futures import ThreadPoolExecutor,wait,FIRST_COMPLETED,TimeoutError as FutureTimeoutError
+import s1_download_func,s1_catalog_func,s1_frame_func,s1_orbit_func,s1_metrics_func,s1_journal_func
 
-# hard-coded ASF query URL:
-asf_baseurl='https://api.daac.asf.alaska.edu/services/search/param?'
+# hard-coded ASF query URL. May be changed with the environment variable S1_ASF_SEARCH_URL, e.g. to point to a local test server
+asf_baseurl=os.environ.get('S1_ASF_SEARCH_URL','https://api.daac.asf.alaska.edu/services/search/param?')
 
-# hard-coded AWS base URL for public dataset downloads:
-aws_baseurl = 'http://sentinel1-slc-seasia-pds.s3-website-ap-southeast-1.amazonaws.com/datasets/slc/v1.1/'
+# hard-coded AWS base URL for public dataset downloads. May be changed with the environment variable S1_AWS_BASE_URL
+aws_baseurl = os.environ.get('S1_AWS_BASE_URL','http://sentinel1-slc-seasia-pds.s3-website-ap-southeast-1.amazonaws.com/datasets/slc/v1.1/')
+
+# REST endpoint of the same bucket, used to list its daily folders. May be changed with the environment variable S1_AWS_LIST_URL
+aws_listurl = os.environ.get('S1_AWS_LIST_URL','https://sentinel1-slc-seasia-pds.s3.ap-southeast-1.amazonaws.com/')
+aws_prefix = urllib.parse.urlparse(aws_baseurl).path.lstrip('/')
 
 def downloadGranule(row):
-    orig_dir=os.getcwd()
     download_site = row['Download Site']
-    frame_dir='P' + row['Path Number'].zfill(3) + '/F' + row['Frame Number'].zfill(4)
-    print('Downloading granule ', row['Granule Name'], 'to directory', frame_dir)
+    frame_dir = get_frame_dir(row)
     #create frame directory
     os.makedirs(frame_dir, exist_ok=True)
-    os.chdir(frame_dir)
+    # skip granules that are already downloaded and pass verification
+    if checkExistingGranule(row, frame_dir):
+        return 0
+    print('Downloading granule ', row['Granule Name'], 'to directory', frame_dir)
+    if download_site == 'auto':
+        return downloadGranule_auto(row, frame_dir)
     status=0
     if(download_site == 'AWS' or download_site == 'both'):
         print('Try AWS download first.')
-        # create url for AWS download, based on the granule name
-        row_date=row['Acquisition Date']
-        row_year=row_date[0:4]
-        row_month=row_date[5:7]
-        row_day=row_date[8:10]
-        datefolder= row_year + '/' + row_month + '/' + row_day +'/'
-        aws_url = aws_baseurl + datefolder + row['Granule Name'] + '/' + row['Granule Name'] + '.zip'
-        # run the download command
-        status = downloadGranule_wget(aws_url)
+        status = downloadGranule_aws(row, frame_dir)
         if status != 0:
             if download_site == 'AWS':
                 print('AWS download failed. Granule not downloaded.')
             else:
                 print('AWS download failed. Trying ASF download instead.')
     if((status != 0 and download_site == 'both') or download_site == 'ASF'):
-        asf_url = row['asf_wget_str'] + ' ' + row['URL']
-        # run the download command
-        status = downloadGranule_wget(asf_url)
+        status = downloadGranule_asf(row, frame_dir)
         if status != 0:
             print('ASF download failed. Granule not downloaded.')
-    os.chdir(orig_dir)
-
-## urllib not currently used. Test for speed?
-#def downloadGranule_urllib(url):
-#    fzip = url.split('/')[-1]
-#    if os.path.isfile(fzip) == False:
-#        print("Using python urllib to download "+url+" to file "+fzip)
-#        with urlopen(url) as response, open(fzip, 'wb') as ofile:
-#            shutil.copyfileobj(response, ofile)
-#    return 0
-
-def downloadGranule_wget(options_and_url):
-    cmd='wget -c --no-check-certificate -q ' + options_and_url
+    return status
+
+def downloadGranule_status(row):
+    """
+    Run downloadGranule, and return the granule name with the exit status, for use with pool.imap_unordered.
+    """
+    return row['Granule Name'], downloadGranule(row)
+
+async def downloadGranule_async(row, executor, aws_sem, asf_sem):
+    """
+    Same as downloadGranule, for use with the asyncio scheduler. Each source has its own concurrency limit,
+    and the blocking transfer runs in a thread of the executor so the event loop can keep many downloads in flight.
+    """
+    loop = asyncio.get_running_loop()
+    download_site = row['Download Site']
+    frame_dir = get_frame_dir(row)
+    os.makedirs(frame_dir, exist_ok=True)
+    # skip granules that are already downloaded and pass verification
+    if await loop.run_in_executor(executor, checkExistingGranule, row, frame_dir):
+        return 0
+    if download_site == 'auto':
+        # take the first free transfer slot, from the source that is ranked best among those with a free slot,
+        # so that the granules waiting for a slot are spread over both sources
+        sems = {'AWS': aws_sem, 'ASF': asf_sem}
+        primary = await acquire_first(sems, get_source_stats(row['Source Stats']).choose(['AWS','ASF']))
+        other = 'ASF' if primary == 'AWS' else 'AWS'
+        def hedge_slot(source):
+            # called from the executor: take a transfer of the other source only if one is free now
+            try:
+                if not asyncio.run_coroutine_threadsafe(try_acquire(sems[source]), loop).result(timeout=10):
+                    return None
+            except FutureTimeoutError:
+                return None
+            return lambda: loop.call_soon_threadsafe(sems[source].release)
+        try:
+            print('Downloading granule ', row['Granule Name'], 'to directory', frame_dir, 'from', primary)
+            status, hedged = await loop.run_in_executor(executor, downloadGranule_first, row, frame_dir, primary, other, hedge_slot)
+        finally:
+            sems[primary].release()
+        if status != 0 and not hedged:
+            async with sems[other]:
+                print('%s download of %s failed. Trying %s download instead.'%(primary,row['Granule Name'],other))
+                status = await loop.run_in_executor(executor, downloadGranule_source, row, frame_dir, other)
+        return status
+    status=0
+    if(download_site == 'AWS' or download_site == 'both'):
+        async with aws_sem:
+            print('Downloading granule ', row['Granule Name'], 'to directory', frame_dir, 'from AWS')
+            status = await loop.run_in_executor(executor, downloadGranule_aws, row, frame_dir)
+        if status != 0:
+            if download_site == 'AWS':
+                print('AWS download failed. Granule not downloaded.')
+            else:
+                print('AWS download of %s failed. Trying ASF download instead.'%row['Granule Name'])
+    if((status != 0 and download_site == 'both') or download_site == 'ASF'):
+        async with asf_sem:
+            print('Downloading granule ', row['Granule Name'], 'to directory', frame_dir, 'from ASF')
+            status = await loop.run_in_executor(executor, downloadGranule_asf, row, frame_dir)
+        if status != 0:
+            print('ASF download of %s failed. Granule not downloaded.'%row['Granule Name'])
+    return status
+
+async def try_acquire(sem):
+    """
+    Acquire an asyncio semaphore only if that does not need to wait. Returns True if it was acquired.
+    """
+    if sem.locked():
+        return False
+    await sem.acquire()
+    return True
+
+async def acquire_first(sems, ranked):
+    """
+    Wait until one of the asyncio semaphores in sems (a dictionary by source) is free, and acquire it.
+    If several are free, the first one in the list ranked is taken. Returns its source.
+    """
+    for source in ranked:
+        if not sems[source].locked():
+            await sems[source].acquire()
+            return source
+    tasks = [asyncio.ensure_future(sems[source].acquire()) for source in ranked]
+    await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    # a waiter cancelled after it was woken gives its slot back; any others that acquired in the meantime are released here
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    acquired = [source for source,task in zip(ranked, tasks) if not task.cancelled()]
+    for source in acquired[1:]:
+        sems[source].release()
+    return acquired[0]
+
+def downloadGranules_asyncio(downloadList, aws_nproc, asf_nproc, max_bandwidth=0, segments=1, callback=None):
+    """
+    Download all granules from a single process and event loop, with at most aws_nproc transfers from AWS
+    and asf_nproc transfers from ASF running at the same time, and a total rate of at most max_bandwidth bytes/s (0 for no limit).
+    downloadList may be any iterable, including one that is still receiving query results; each download starts as soon as its row arrives.
+    If given, callback(granule name, exit status) is called as each download finishes.
+    Returns the list of exit statuses.
+    """
+    s1_download_func.set_bandwidth_limit(max_bandwidth)
+    # keep enough open connections for every transfer that may run at once
+    s1_download_func.pool_maxsize = max(s1_download_func.pool_maxsize, (aws_nproc + asf_nproc)*segments)
+    async def run_all():
+        loop = asyncio.get_running_loop()
+        aws_sem = asyncio.Semaphore(aws_nproc)
+        asf_sem = asyncio.Semaphore(asf_nproc)
+        async def run_one(row, executor):
+            status = await downloadGranule_async(row, executor, aws_sem, asf_sem)
+            if callback is not None:
+                callback(row['Granule Name'], status)
+            return status
+        with ThreadPoolExecutor(max_workers=aws_nproc + asf_nproc) as executor:
+            tasks = []
+            rows = iter(downloadList)
+            while True:
+                # rows may still be arriving from the query, so wait for them without blocking the event loop
+                row = await loop.run_in_executor(None, next, rows, None)
+                if row is None:
+                    break
+                tasks.append(asyncio.ensure_future(run_one(row, executor)))
+            return await asyncio.gather(*tasks)
+    return asyncio.run(run_all())
+
+def run_downloads(downloadList, scheduler, nproc, aws_nproc, asf_nproc, max_bandwidth=0, segments=1, callback=None, plan=None):
+    """
+    Download all granules with the given scheduler: 'pool' runs nproc worker processes, and 'asyncio' runs all downloads
+    from this process (see downloadGranules_asyncio). callback(granule name, exit status) is called in this process as each download finishes.
+    If a DownloadPlan is given, it decides when each download may start, and reports the progress.
+    """
+    # wget cannot share a limit between transfers, so each one is limited to an even share of the total
+    if max_bandwidth and s1_download_func.download_settings.get('Download Engine') == 'wget':
+        s1_download_func.download_settings['Wget Rate'] = int(max_bandwidth/(aws_nproc + asf_nproc if scheduler == 'asyncio' else nproc))
+    if plan is not None:
+        # hand out only as many rows as can run at once, so that the plan can hold back the next one
+        plan.max_active = aws_nproc + asf_nproc if scheduler == 'asyncio' else nproc
+        user_callback = callback
+        def callback(name, status):
+            if user_callback is not None:
+                user_callback(name, status)
+            plan.finished(name, status)
+        downloadList = plan.gate(downloadList, callback)
+    if scheduler == 'asyncio':
+        print('\nRunning up to %d AWS and %d ASF downloads in parallel.'%(aws_nproc,asf_nproc))
+        downloadGranules_asyncio(downloadList, aws_nproc, asf_nproc, max_bandwidth, segments, callback)
+        return
+    if nproc > 1:
+        print('\nRunning %d downloads in parallel.'%nproc)
+    else:
+        print('\nDownloading 1 at a time.')
+    # map list to multiprocessing pool. Each worker process gets the download settings once, and an even share of the bandwidth limit
+    multiprocessing.set_start_method("spawn", force=True)
+    with multiprocessing.get_context("spawn").Pool(processes=nproc, initializer=s1_download_func.set_download_settings,
+                                                   initargs=(s1_download_func.download_settings, max_bandwidth/nproc)) as pool:
+        for name,status in pool.imap_unordered(downloadGranule_status, downloadList, chunksize=1):
+            if callback is not None:
+                callback(name, status)
+
+def read_download_info(config, download=True):
+    """
+    Read the settings of each granule download from the [download] and [asf_download] sections of a config file,
+    as the dictionary that is added to each query result row. ASF credentials are required only if download is set.
+    """
+    download_site=config.get('download','download_site',fallback='both')
+    if download_site not in ['AWS','ASF','both','auto']:
+        raise ValueError('Unknown download_site %s in config file, must be AWS, ASF, both or auto.'%download_site)
+    download_engine=config.get('download','download_engine',fallback='wget')
+    if download_engine not in ['wget','python']:
+        raise ValueError('Unknown download_engine %s in config file, must be wget or python.'%download_engine)
+    # number of connections per granule, and the size of each byte range in MB (python engine only)
+    segments=config.getint('download','segments',fallback=1)
+    segment_size=int(config.getfloat('download','segment_size',fallback=0)*1e6)
+    # check downloads against the size (verify = size) or size and MD5 (verify = md5) given in the query result
+    verify=config.get('download','verify',fallback='none')
+    if verify not in ['none','size','md5']:
+        raise ValueError('Unknown verify option %s in config file, must be none, size or md5.'%verify)
+    # files that fail are deleted and downloaded again (refetch), or moved to quarantine_dir first (quarantine)
+    verify_action=config.get('download','verify_action',fallback='refetch')
+    if verify_action not in ['refetch','quarantine']:
+        raise ValueError('Unknown verify_action %s in config file, must be refetch or quarantine.'%verify_action)
+    quarantine_dir=config.get('download','quarantine_dir',fallback='quarantine')
+    # download_site = auto: throughput statistics of each source, and when to start a second transfer from the other source
+    source_stats=os.path.abspath(config.get('download','source_stats',fallback='source_stats.sqlite'))
+    hedge=config.getfloat('download','hedge',fallback=0)
+
+    # need to pass http-user and http-password for ASF downloads.
+    # this section should contain 'http-user', 'http-password', plus any other wget options.
+    # we join them (naively) as a single argument string
+    if download and download_site != 'AWS':
+        # first, check for missing values:
+        if not (config.has_section('asf_download') and config.has_option('asf_download','http-user') \
+            and config.has_option('asf_download','http-password') and len(config.get('asf_download','http-user'))>0 \
+            and len(config.get('asf_download','http-password')) > 0):
+            raise ValueError('ASF username or password missing in config file.')
+        asf_wget_options=config.items('asf_download')
+        asf_wget_str=' '.join('--%s=%s'%(item[0],item[1]) for item in asf_wget_options)
+        # the python engine takes only the username and password
+        asf_auth=(config.get('asf_download','http-user'), config.get('asf_download','http-password'))
+    else:
+        asf_wget_str=''
+        asf_auth=None
+    return {'Download Site': download_site, 'Download Engine': download_engine, 'Segments': segments,
+            'Segment Size': segment_size, 'Verify': verify, 'Verify Action': verify_action, 'Quarantine Dir': quarantine_dir,
+            'asf_wget_str': asf_wget_str, 'asf_auth': asf_auth, 'Source Stats': source_stats, 'Hedge': hedge}
+
+def query_asf_csv(arg_list, search_windows=1):
+    """
+    Run the ASF API query given by arg_list, a list of (keyword, value) pairs with csv output, and yield each
+    result row as a dictionary as soon as it arrives, without waiting for the full response.
+    If search_windows > 1, the start/end time range is split into that many windows that are queried in parallel.
+    Granules found by more than one window are returned only once.
+    """
+    windows = split_search_window(arg_list, search_windows)
+    rowqueue = queue.Queue()
+    def run_query(window_args):
+        try:
+            url = asf_baseurl + '&'.join('%s=%s'%(item[0],item[1]) for item in window_args)
+            # the read timeout applies to each wait for more of the result, not to the whole query
+            with s1_metrics_func.timed('query', rows=0) as info, requests.post(url, stream=True, timeout=s1_download_func.request_timeout) as r:
+                r.raise_for_status()
+                r.encoding = r.encoding or 'utf-8'
+                for row in csv.DictReader(r.iter_lines(decode_unicode=True)):
+                    rowqueue.put(row)
+                    info['rows'] += 1
+        except requests.RequestException as e:
+            rowqueue.put(e)
+        rowqueue.put(None)
+    for window_args in windows:
+        threading.Thread(target=run_query, args=(window_args,), daemon=True).start()
+    seen = set()
+    finished = 0
+    while finished < len(windows):
+        row = rowqueue.get()
+        if row is None:
+            finished += 1
+        elif isinstance(row, Exception):
+            raise row
+        elif row['Granule Name'] not in seen:
+            seen.add(row['Granule Name'])
+            yield row
+
+def split_search_window(arg_list, search_windows):
+    """
+    Split the query options in arg_list into search_windows queries covering equal parts of the start/end time range.
+    Returns a list of argument lists. The query is not split if it has no start and end time in the format YYYY-MM-DDTHH:MM:SSUTC.
+    """
+    args = dict(arg_list)
+    timeformat = '%Y-%m-%dT%H:%M:%SUTC'
+    if search_windows <= 1:
+        return [arg_list]
+    try:
+        start = datetime.datetime.strptime(args['start'], timeformat)
+        end = datetime.datetime.strptime(args['end'], timeformat)
+    except (KeyError, ValueError):
+        print('Warning: cannot split query into time windows without start and end times in the format YYYY-MM-DDTHH:MM:SSUTC.')
+        return [arg_list]
+    step = (end - start)/search_windows
+    windows = []
+    for i in range(search_windows):
+        args['start'] = (start + i*step).strftime(timeformat)
+        args['end'] = (start + (i + 1)*step).strftime(timeformat) if i < search_windows - 1 else end.strftime(timeformat)
+        windows.append(list(args.items()))
+    return windows
+
+def save_query_rows(rows, f, verbose=False, found=None):
+    """
+    Pass through query result rows, writing each one to the open csv file f, printing it if verbose is set,
+    and appending it to the list found if given.
+    """
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(f, fieldnames=list(row.keys()), quoting=csv.QUOTE_ALL)
+            writer.writeheader()
+        writer.writerow(row)
+        f.flush()
+        if verbose:
+            print('Scene %s, Path %s / Frame %s' %(row['Granule Name'], row['Path Number'], row['Frame Number']))
+        if found is not None:
+            found.append(row)
+        yield row
+
+def catalog_downloads(rows, catalog, key):
+    """
+    Record each query result row in the granule catalog, and pass through only the granules that are not yet downloaded.
+    Afterwards, also pass through any granules found by earlier runs of the same query (identified by key) that are still incomplete.
+    """
+    seen = set()
+    for row in rows:
+        catalog.add_granule(row, get_frame_dir(row), key)
+        if catalog.is_complete(row['Granule Name']):
+            print('Granule %s already downloaded, skipping.'%row['Granule Name'])
+        else:
+            seen.add(row['Granule Name'])
+            yield row
+    for row in catalog.get_incomplete(key):
+        if row['Granule Name'] not in seen:
+            print('Retrying incomplete granule %s from an earlier run.'%row['Granule Name'])
+            catalog.add_granule(row, get_frame_dir(row), key)
+            yield row
+
+def read_query_rows(filename):
+    """
+    Yield the rows of a query result saved in a csv file.
+    """
+    with open(filename,newline='') as f:
+        for row in csv.DictReader(f):
+            yield row
+
+def journal_query(rows, journal, run_key, query_log, **info):
+    """
+    Pass through query result rows, and once the query is complete, record in the journal that this run has started,
+    with the file holding its query result and any other information given, so that an interrupted run can be resumed without querying again.
+    """
+    count = 0
+    for row in rows:
+        count += 1
+        yield row
+    journal.record('run', run_key, s1_journal_func.state_started, query=os.path.abspath(query_log), scenes=count, **info)
+
+def journal_downloads(rows, journal, run_key):
+    """
+    Pass through only the granules that this run has not yet downloaded according to the journal, and whose file is still there.
+    """
+    for row in rows:
+        entry = journal.get('granule', row['Granule Name'])
+        if entry and entry['state'] == s1_journal_func.state_done and entry.get('run') == run_key \
+                and os.path.isfile(os.path.join(get_frame_dir(row), row['URL'].split('/')[-1])):
+            print('Granule %s already downloaded by the interrupted run, skipping.'%row['Granule Name'])
+        else:
+            yield row
+
+def prepare_downloads(rows, download_info):
+    """
+    Set the download settings in the dictionary download_info for this process (and the worker processes started later),
+    and turn each query result row into a compact record with only the fields needed for downloading.
+    """
+    # set here rather than in a generator, so that the settings are in place before any worker processes start
+    s1_download_func.set_download_settings(download_info)
+    return (row if isinstance(row, s1_download_func.GranuleRecord) else s1_download_func.GranuleRecord(row) for row in rows)
+
+def track_frames(rows, frames):
+    """
+    Pass through query result rows, registering each granule with the frame pipeline, and tell it when the query is complete.
+    """
+    for row in rows:
+        frames.add(row['Granule Name'], get_frame_dir(row))
+        yield row
+    frames.query_done()
+
+def make_frame_pipeline(config):
+    """
+    Set up the frame pipeline from the [frames] section of the config file, with the same options as cat_s1.py.
+    """
+    s1_orbit_dirs=[item.strip() for item in config.get('frames','orbit_dir',fallback='orbits').split(',')]
+    if not s1_orbit_func.is_orbit_archive(s1_orbit_dirs[0]):
+        os.makedirs(s1_orbit_dirs[0], exist_ok=True)
+    outdir=config.get('frames','output_dir',fallback='frames')
+    os.makedirs(outdir, exist_ok=True)
+    lonlats=[float(i) for i in config.get('frames','lonlat').split('/')]
+    ll_fname=os.path.join(outdir,'two_pins.ll')
+    s1_frame_func.write_ll_pins(ll_fname, lonlats[0::2], lonlats[1::2], config.get('frames','direction'))
+    swaths=config.get('frames','swaths',fallback='')
+    polarizations=config.get('frames','polarizations',fallback='')
+    return s1_frame_func.FramePipeline(s1_orbit_dirs, ll_fname, outdir,
+                                       nproc=config.getint('frames','nproc',fallback=1),
+                                       swaths=[int(i) for i in swaths.split(',')] if swaths.strip() else None,
+                                       polarizations=[i.strip().lower() for i in polarizations.split(',')] if polarizations.strip() else None,
+                                       unzip_nproc=config.getint('frames','unzip_threads',fallback=4),
+                                       scratch=config.get('frames','scratch',fallback='') or None,
+                                       preciseonly=config.getboolean('frames','precise',fallback=False))
+
+def list_aws_days(dates, index, nthreads):
+    """
+    List the daily folders of the AWS dataset for the given dates (YYYY-MM-DD) into the AWS index, using nthreads concurrent requests.
+    Dates whose listing in the index is less than a day old are skipped.
+    """
+    dates = sorted(date for date in set(dates) if not index.is_listed(date))
+    if dates:
+        print('Listing %d daily folders of the AWS dataset.'%len(dates))
+        with ThreadPoolExecutor(max_workers=nthreads) as executor:
+            list(executor.map(lambda date: list_aws_day(date, index), dates))
+
+def list_aws_day(date, index):
+    """
+    List the granules in the AWS folder for one date and record them in the AWS index. Returns False if the listing failed.
+    """
+    prefix = aws_prefix + date.replace('-','/') + '/'
+    try:
+        with s1_metrics_func.timed('aws_list', date=date):
+            names = s1_download_func.list_prefixes(aws_listurl, prefix)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print('Could not list AWS folder %s: %s'%(prefix,e))
+        return False
+    index.set_day(date, names)
+    return True
+
+def route_downloads(rows, index):
+    """
+    Send each granule that the AWS index shows is not in the AWS dataset directly to ASF, when download_site is both or auto.
+    Dates that are not yet in the index are listed as they appear; granules on dates that could not be listed are left as they are.
+    """
+    failed_dates = set()
+    for row in rows:
+        date = row['Acquisition Date'][0:10]
+        if date not in failed_dates and not index.is_listed(date) and not list_aws_day(date, index):
+            failed_dates.add(date)
+        if index.available(row['Granule Name'], date) is False:
+            if row['Download Site'] in ['both','auto']:
+                print('Granule %s is not in the AWS dataset, downloading from ASF.'%row['Granule Name'])
+                row['Download Site'] = 'ASF'
+            else:
+                print('Warning: granule %s is not in the AWS dataset.'%row['Granule Name'])
+        yield row
+
+download_orders = ['query','size','orbit']
+
+def get_row_bytes(row):
+    """
+    Size of a granule in bytes from its query result row, or 0 if it is not given.
+    """
+    size = s1_download_func.get_expected_size(row)
+    return int(size*2**20) if size else 0
+
+def get_pass(row):
+    """
+    Satellite and absolute orbit (satellite pass) of a granule, e.g. S1A_025000, from its name.
+    """
+    name = row['Granule Name']
+    return 'S1%s_%s'%(name[2],name[49:55])
+
+def order_rows(rows, order):
+    """
+    Order a complete list of query result rows for downloading: 'query' keeps the order of the query result, 'size' puts the largest
+    scenes first, so that the run does not end with a few large scenes downloading alone, and 'orbit' keeps the scenes of each
+    satellite pass together (passes in the order of the query result, largest scenes first), so that their frames can be created early.
+    """
+    if order == 'size':
+        return sorted(rows, key=get_row_bytes, reverse=True)
+    if order == 'orbit':
+        passes = {}
+        for row in rows:
+            passes.setdefault(get_pass(row),[]).append(row)
+        return [row for group in passes.values() for row in sorted(group, key=get_row_bytes, reverse=True)]
+    return list(rows)
+
+def get_free_space(path):
+    """
+    Free space in bytes on the file system that holds path, which need not exist yet.
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return shutil.disk_usage(path).free
+
+def estimate_rate(download_info, parallel, max_bandwidth=0):
+    """
+    Expected total download rate in bytes/s with the given number of parallel downloads, from the source statistics
+    (download_site = auto only) and the bandwidth limit. Returns None if it is not known.
+    """
+    rate = None
+    if download_info['Download Site'] == 'auto':
+        stats = get_source_stats(download_info['Source Stats'])
+        rates = [stats.get(source)[0] for source in ['AWS','ASF'] if stats.get(source)[0]]
+        if rates:
+            rate = max(rates)*parallel
+    if max_bandwidth:
+        rate = min(rate or max_bandwidth, max_bandwidth)
+    return rate
+
+class DownloadPlan:
+    """
+    Size-aware plan of the downloads of a run, using the size of each scene in the query result.
+    plan() orders a complete list of rows (see order_rows) and prints the bytes left to download, the free space and the expected time.
+    gate() then hands the rows to the scheduler with at most max_active downloads started but not finished, and holds back
+    the next download while the free space where it will be saved, less what the running downloads still have to write,
+    is less than its size plus min_free bytes. A download that does not fit even with no other download running is skipped
+    and reported as failed. The progress and the estimated time left are printed as each download finishes.
+    """
+    def __init__(self, order='query', min_free=0, rate=None, max_active=None):
+        self.order = order
+        self.min_free = min_free
+        self.rate = rate
+        self.max_active = max_active
+        self.condition = threading.Condition()
+        # bytes left to download for each granule when it was planned, and the granules now downloading, with their frame directory
+        self.remaining = dict()
+        self.active = dict()
+        self.total = 0
+        self.finished_bytes = 0
+        self.done = 0
+        self.failed = 0
+        self.start = None
+        self.paused = False
+
+    def add(self, row):
+        remaining = max(get_row_bytes(row) - get_downloaded_size(row, get_frame_dir(row)), 0)
+        self.remaining[row['Granule Name']] = remaining
+        self.total += remaining
+
+    def plan(self, rows):
+        """
+        Order a complete list of rows, and print a summary of the downloads. Returns the ordered list.
+        """
+        rows = order_rows(rows, self.order)
+        for row in rows:
+            self.add(row)
+        if not rows:
+            return rows
+        size = sum(get_row_bytes(row) for row in rows)
+        free = get_free_space(get_frame_dir(rows[0]))
+        print('\nDownload plan: %d scenes in %s order, %.1f GB to download (%.1f GB already downloaded), %.1f GB free.'%(
+            len(rows), self.order, self.total/1e9, (size - self.total)/1e9, free/1e9))
+        unknown = [row for row in rows if not get_row_bytes(row)]
+        if unknown:
+            print('%d scenes have no size in the query result and are not counted.'%len(unknown))
+        if self.rate:
+            print('Expected download time: %s at %.1f MB/s.'%(format_duration(self.total/self.rate), self.rate/1e6))
+        if self.total + self.min_free > free:
+            print('Warning: not enough free space for all downloads. New downloads will pause when the free space runs out.')
+        return rows
+
+    def gate(self, rows, callback=None):
+        """
+        Pass through rows, each one only once there is room to start its download. A row that is skipped for lack of space
+        is reported with callback(granule name, 1) if given, or else only recorded as failed in the plan.
+        """
+        for row in rows:
+            name = row['Granule Name']
+            if name not in self.remaining:
+                # rows still arriving from the query are not planned in advance
+                self.add(row)
+            frame_dir = get_frame_dir(row)
+            with self.condition:
+                if self.start is None:
+                    self.start = time.time()
+                room = self.has_room(name, frame_dir)
+                # check the free space again from time to time, in case space was freed outside this run. Once no download
+                # is running, nothing in this run will free any more space
+                while not room and self.active:
+                    self.condition.wait(timeout=30)
+                    room = self.has_room(name, frame_dir)
+                if room:
+                    self.active[name] = (row, frame_dir)
+            if not room:
+                print('Skipping %s: not enough free space in %s for %.1f GB, even with no other downloads running.'%(name, frame_dir, self.remaining[name]/1e9))
+                (callback or self.finished)(name, 1)
+                continue
+            yield row
+
+    def has_room(self, name, frame_dir):
+        # called with self.condition held
+        if self.max_active and len(self.active) >= self.max_active:
+            return False
+        if not self.min_free:
+            return True
+        needed = self.min_free + self.remaining[name] + sum(max(get_row_bytes(row) - get_downloaded_size(row, row_dir), 0)
+                                                            for row,row_dir in self.active.values())
+        free = get_free_space(frame_dir)
+        if free < needed:
+            if not self.paused:
+                print('Pausing new downloads: %.1f GB free for %s, %.1f GB needed. Downloads continue when space is freed.'%(free/1e9, frame_dir, needed/1e9))
+                self.paused = True
+            return False
+        if self.paused:
+            print('Resuming downloads: %.1f GB free.'%(free/1e9))
+            self.paused = False
+        return True
+
+    def finished(self, name, status):
+        """
+        Record the end of a download, let the next one start, and print the progress.
+        """
+        with self.condition:
+            self.active.pop(name, None)
+            self.finished_bytes += self.remaining.get(name, 0)
+            if status == 0:
+                self.done += 1
+            else:
+                self.failed += 1
+            self.condition.notify_all()
+            elapsed = time.time() - self.start
+            rate = self.finished_bytes/elapsed if self.finished_bytes and elapsed > 0 else self.rate
+            left = ', about %s left'%format_duration((self.total - self.finished_bytes)/rate) if rate else ''
+            print('Progress: %d of %d scenes finished%s, %.1f of %.1f GB, %.1f MB/s%s.'%(self.done + self.failed, len(self.remaining),
+                  ' (%d failed)'%self.failed if self.failed else '', self.finished_bytes/1e9, self.total/1e9, (rate or 0)/1e6, left))
+
+def format_duration(seconds):
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+def get_frame_dir(row):
+    # 'Download Root' is set by sentinel_batch_download.py, to download into the directory of one of several AOIs
+    return os.path.join(row.get('Download Root',''), 'P' + row['Path Number'].zfill(3) + '/F' + row['Frame Number'].zfill(4))
+
+def downloadGranule_auto(row, frame_dir):
+    """
+    Download a granule from the source with the best recent throughput and success rate (see s1_download_func.SourceStats),
+    falling back to the other source if it fails.
+    """
+    primary, other = get_source_stats(row['Source Stats']).choose(['AWS','ASF'])
+    status, hedged = downloadGranule_first(row, frame_dir, primary, other)
+    if status != 0 and not hedged:
+        print('%s download of %s failed. Trying %s download instead.'%(primary,row['Granule Name'],other))
+        status = downloadGranule_source(row, frame_dir, other)
+    return status
+
+def downloadGranule_first(row, frame_dir, primary, other, hedge_slot=None):
+    """
+    Download a granule from the primary source. If hedging is enabled (python engine only), a transfer that takes more than
+    'Hedge' times as long as expected from the throughput of its source is raced against a second transfer from the other source,
+    and whichever finishes first is kept (see downloadGranule_hedged).
+    Returns the exit status, and whether the other source was also tried.
+    """
+    hedge_after = None
+    if row['Hedge'] > 0 and row['Download Engine'] == 'python':
+        expected = get_source_stats(row['Source Stats']).expected_time(primary, (s1_download_func.get_expected_size(row) or 0)*2**20)
+        hedge_after = row['Hedge']*expected if expected else None
+    if hedge_after is None:
+        return downloadGranule_source(row, frame_dir, primary), False
+    return downloadGranule_hedged(row, frame_dir, primary, other, hedge_after, hedge_slot)
+
+def downloadGranule_hedged(row, frame_dir, primary, other, hedge_after, hedge_slot=None):
+    """
+    Download a granule from the primary source, and if it is not done after hedge_after seconds, also from the other source
+    into a separate directory. The first transfer to finish is kept, and the other is cancelled.
+    If given, hedge_slot(source) takes a transfer of the other source from the scheduler without waiting, and returns
+    a function that gives it back, or None if no transfer is free; in that case no second transfer is started.
+    Returns the exit status, and whether a second transfer was started.
+    """
+    hedge_dir = os.path.join(frame_dir, '.hedge')
+    filename = row['URL'].split('/')[-1]
+    cancel = {primary: threading.Event(), other: threading.Event()}
+    winner = None
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = {executor.submit(downloadGranule_source, row, frame_dir, primary, cancel[primary]): primary}
+        done, pending = wait(futures, timeout=hedge_after)
+        release = hedge_slot(other) if hedge_slot is not None and not done else None
+        if done or (hedge_slot is not None and release is None):
+            return list(futures)[0].result(), False
+        print('%s download of %s is slower than expected, also trying %s.'%(primary,row['Granule Name'],other))
+        try:
+            os.makedirs(hedge_dir, exist_ok=True)
+            futures[executor.submit(downloadGranule_source, row, hedge_dir, other, cancel[other])] = other
+            pending = set(futures)
+            while pending and winner is None:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.result() == 0 and winner is None:
+                        winner = futures[future]
+            # stop the slower transfer, and wait for it before giving its transfer back
+            for source in cancel:
+                if source != winner:
+                    cancel[source].set()
+            for future in pending:
+                future.result()
+        finally:
+            if release is not None:
+                release()
+    # keep the winning file in the frame directory, and delete the partial file of the other transfer
+    loser_dir = hedge_dir
+    if winner == other:
+        print('%s download of %s finished first.'%(other,row['Granule Name']))
+        os.replace(os.path.join(hedge_dir, filename), os.path.join(frame_dir, filename))
+        loser_dir = frame_dir
+    for suffix in ['.part','.segments']:
+        if os.path.isfile(os.path.join(loser_dir, filename + suffix)):
+            os.remove(os.path.join(loser_dir, filename + suffix))
+    if not os.listdir(hedge_dir):
+        os.rmdir(hedge_dir)
+    return (0 if winner else 1), True
+
+def downloadGranule_source(row, frame_dir, source, cancel=None):
+    """
+    Download a granule from one source (AWS or ASF), and add the transfer to the statistics of that source.
+    A transfer that was cancelled still counts towards the throughput (it was abandoned for being slow), but not as a failure.
+    """
+    size_before = get_downloaded_size(row, frame_dir)
+    tstart = time.time()
+    if source == 'AWS':
+        status = downloadGranule_aws(row, frame_dir, cancel)
+    else:
+        status = downloadGranule_asf(row, frame_dir, cancel)
+    cancelled = cancel is not None and cancel.is_set()
+    get_source_stats(row['Source Stats']).update(source, get_downloaded_size(row, frame_dir) - size_before, time.time() - tstart, status == 0 or cancelled, cancelled)
+    return status
+
+def get_source_stats(filename):
+    """
+    Open each source statistics database once per process.
+    """
+    if filename not in _source_stats:
+        _source_stats[filename] = s1_download_func.SourceStats(filename)
+    return _source_stats[filename]
+
+_source_stats = {}
+
+def open_database(cls, filename):
+    """
+    Open each granule catalog or AWS index (cls is s1_catalog_func.GranuleCatalog or AwsIndex) once per process.
+    """
+    key = (cls.__name__, os.path.abspath(filename))
+    if key not in _databases:
+        _databases[key] = cls(filename)
+    return _databases[key]
+
+_databases = {}
+
+def get_downloaded_size(row, frame_dir):
+    """
+    Number of bytes of the granule downloaded so far in frame_dir (see s1_download_func.get_downloaded_bytes).
+    """
+    return s1_download_func.get_downloaded_bytes(os.path.join(frame_dir, row['URL'].split('/')[-1]))
+
+def downloadGranule_aws(row, frame_dir, cancel=None):
+    # create url for AWS download, based on the granule name
+    row_date=row['Acquisition Date']
+    row_year=row_date[0:4]
+    row_month=row_date[5:7]
+    row_day=row_date[8:10]
+    datefolder= row_year + '/' + row_month + '/' + row_day +'/'
+    aws_url = aws_baseurl + datefolder + row['Granule Name'] + '/' + row['Granule Name'] + '.zip'
+    # run the download command
+    with timed_download(row, frame_dir, 'AWS') as info:
+        if row['Download Engine'] == 'python':
+            status = s1_download_func.download_url(aws_url, frame_dir, segments=row['Segments'], segment_size=row['Segment Size'], cancel=cancel)
+        else:
+            status = downloadGranule_wget(aws_url, frame_dir, row.get('Wget Rate'))
+        info['status'] = 'ok' if status == 0 else 'failed'
+    return checkDownloadedGranule(row, frame_dir, status)
+
+def downloadGranule_asf(row, frame_dir, cancel=None):
+    # run the download command
+    with timed_download(row, frame_dir, 'ASF') as info:
+        if row['Download Engine'] == 'python':
+            status = s1_download_func.download_url(row['URL'], frame_dir, auth=row['asf_auth'], segments=row['Segments'], segment_size=row['Segment Size'], cancel=cancel)
+        else:
+            asf_url = row['asf_wget_str'] + ' ' + row['URL']
+            status = downloadGranule_wget(asf_url, frame_dir, row.get('Wget Rate'))
+        info['status'] = 'ok' if status == 0 else 'failed'
+    return checkDownloadedGranule(row, frame_dir, status)
+
+@contextlib.contextmanager
+def timed_download(row, frame_dir, source):
+    """
+    Record the time taken by a granule download from the given source, and the number of bytes added to the file
+    (or to its partial download), so resumed downloads count only the new data.
+    """
+    size_before = get_downloaded_size(row, frame_dir)
+    with s1_metrics_func.timed('download', source=source, granule=row['Granule Name'], engine=row['Download Engine']) as info:
+        try:
+            yield info
+        finally:
+            info['bytes'] = max(get_downloaded_size(row, frame_dir) - size_before, 0)
+
+def checkExistingGranule(row, frame_dir):
+    """
+    If verification is enabled, check whether the granule was already downloaded completely. Returns True if the file passes.
+    A file that fails is removed or moved to quarantine, except a file that is only shorter than expected, which is kept so the download can resume.
+    """
+    if row['Verify'] == 'none':
+        return False
+    filename = os.path.join(frame_dir, row['URL'].split('/')[-1])
+    result = s1_download_func.verify_file(filename, s1_download_func.get_expected_size(row), s1_download_func.get_expected_md5(row), row['Verify'])
+    if result == s1_download_func.verify_ok:
+        print('Granule %s already downloaded and verified (%s check), skipping.'%(row['Granule Name'],row['Verify']))
+        return True
+    if result not in [s1_download_func.verify_missing, s1_download_func.verify_short]:
+        print('Existing file %s failed verification: %s.'%(filename,result))
+        s1_download_func.remove_bad_file(filename, row['Verify Action'], row['Quarantine Dir'])
+    return False
+
+def checkDownloadedGranule(row, frame_dir, status):
+    """
+    If verification is enabled and the download succeeded, check the downloaded file. Returns the status, set to 1 if the file fails.
+    """
+    if status != 0 or row['Verify'] == 'none':
+        return status
+    filename = os.path.join(frame_dir, row['URL'].split('/')[-1])
+    result = s1_download_func.verify_file(filename, s1_download_func.get_expected_size(row), s1_download_func.get_expected_md5(row), row['Verify'])
+    if result != s1_download_func.verify_ok:
+        print('Downloaded file %s failed verification: %s.'%(filename,result))
+        if result != s1_download_func.verify_missing:
+            s1_download_func.remove_bad_file(filename, row['Verify Action'], row['Quarantine Dir'])
+        return 1
+    return 0
+
+def downloadGranule_wget(options_and_url, target_dir='.', rate=None):
+    # optional limit on the download rate in bytes/s
+    limit=' --limit-rate=%d'%rate if rate else ''
+    cmd='wget -c --no-check-certificate -q' + limit + ' -P ' + target_dir + ' ' + options_and_url
     print(cmd)
     result = subprocess.run(cmd, shell=True, capture_output=True)
     return result.returncode
 
-if __name__ == '__main__':
+def main(argv=None, scheduler=None):
+    """
+    Run the query (and download) described by the command-line arguments argv (default: sys.argv).
+    scheduler, if given, overrides the scheduler set in the config file; s1_service.py uses this to run all downloads in its own process.
+    """
     # read command line arguments and parse config file.
     parser = argparse.ArgumentParser(description='Use http requests and wget to search and download data from the ASF archive, based on parameters in a config file.')
     parser.add_argument('config',type=str,help='supply name of config file to set up API query. Required.')
     parser.add_argument('--download',action='store_true',help='Download the resulting scenes (default: false)')
     parser.add_argument('--verbose',action='store_true',help='Print the query result to the screen (default: false)')
+    parser.add_argument('--incremental',action='store_true',help='Use the local granule catalog to query only scenes processed since the last successful run, and download only new or incomplete scenes (default: false)')
+    parser.add_argument('--restart',action='store_true',help='Do not resume an interrupted download run of this query from the job journal; query again and check every scene (default: false)')
     #parser.add_argument('--save-csv',action='store_true',help='Save the resulting csv file (default: false)')
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # read config file
     config=configparser.ConfigParser()
     config.optionxform = str #make the config file case-sensitive
     config.read(args.config)
-    download_site=config.get('download','download_site',fallback='both')
     nproc=config.getint('download','nproc',fallback=1)
+    # scheduler: 'pool' runs nproc worker processes, 'asyncio' runs all downloads from one process
+    scheduler=scheduler or config.get('download','scheduler',fallback='pool')
+    if scheduler not in ['pool','asyncio']:
+        raise ValueError('Unknown scheduler %s in config file, must be pool or asyncio.'%scheduler)
+    aws_nproc=config.getint('download','aws_nproc',fallback=nproc)
+    asf_nproc=config.getint('download','asf_nproc',fallback=nproc)
+    # total bandwidth limit in MB/s, 0 for no limit (with wget, each transfer is limited to an even share)
+    max_bandwidth=config.getfloat('download','max_bandwidth',fallback=0)*1e6
     output_format=config.get('api_search','output',fallback='csv')
+    # split the query into this many time windows, searched in parallel
+    search_windows=config.getint('download','search_windows',fallback=1)
+    # start downloading each granule as soon as it is found, instead of waiting for the full query result
+    pipeline=config.getboolean('download','pipeline',fallback=False)
+    # local catalog of granules and their download state, used with --incremental
+    catalog_file=config.get('download','catalog',fallback='granule_catalog.sqlite')
+    # journal of the query result and the state of each download, used to resume an interrupted run (empty to turn off)
+    journal_file=config.get('download','journal',fallback='download_journal.jsonl')
+    # optional index of the granules available on AWS, built from listings of its daily folders (not used with download_site = ASF)
+    aws_index_file=config.get('download','aws_index',fallback='')
+    aws_index_threads=config.getint('download','aws_index_threads',fallback=8)
+    # optional event log with the time taken by each step, and its summary in Prometheus text format
+    metrics_log=config.get('download','metrics_log',fallback='')
+    metrics_summary=config.get('download','metrics_summary',fallback='')
+    if metrics_log:
+        s1_metrics_func.enable(metrics_log)
+    # create the cropped frame of each orbit as soon as all of its scenes are downloaded (requires GMTSAR)
+    assemble=config.getboolean('frames','assemble',fallback=False)
+    # order of the downloads (by default the order of the query result, or by satellite pass when creating frames),
+    # and the free space in GB to keep on the download disk (0 for no check)
+    download_order=config.get('download','order',fallback='orbit' if assemble else 'query')
+    if download_order not in download_orders:
+        raise ValueError('Unknown order %s in config file, must be one of %s.'%(download_order,', '.join(download_orders)))
+    min_free_space=config.getfloat('download','min_free_space',fallback=0)*1e9
     
     # we parse the config options directly into a query... this may be too naive
     arg_list=config.items('api_search')
@@ -99,71 +923,163 @@ if __name__ == '__main__':
     # example query:
     # argurl="https://api.daac.asf.alaska.edu/services/search/param?platform=R1\&absoluteOrbit=25234\&output=CSV"
 
-    # run the ASF query request
-    print('\nRunning ASF API query:')
-    print(argurl + '\n')
-    r=requests.post(argurl)
-    # parse rows if csv, else we just operate on the 'r' object
-    if output_format == 'csv':
-        reader = csv.DictReader(r.text.splitlines())
-        rows=list(reader)
-    
-    # save the results to a file
+    if output_format != 'csv' and args.download:
+        print('Error: cannot download unless output format is set to csv. Doing nothing.')
+    download = output_format == 'csv' and args.download
+
+    # settings of each granule download, including the ASF username and password
+    download_info=read_download_info(config, download)
+    download_site=download_info['Download Site']
+
+    # in incremental mode, query only scenes processed since the last successful run of this query, with one day of overlap
+    query_args=arg_list
+    if args.incremental and output_format == 'csv':
+        catalog=open_database(s1_catalog_func.GranuleCatalog,catalog_file)
+        run_start=datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SUTC')
+        last_run=catalog.get_last_run(arg_list)
+        if last_run:
+            since=datetime.datetime.strptime(last_run,'%Y-%m-%dT%H:%M:%SUTC') - datetime.timedelta(days=1)
+            query_args=[item for item in arg_list if item[0] != 'processingDate'] + [('processingDate',since.strftime('%Y-%m-%dT%H:%M:%SUTC'))]
+            argurl=asf_baseurl + '&'.join('%s=%s'%(item[0],item[1]) for item in query_args)
+            print('\nIncremental mode: last successful run was at %s.'%last_run)
+        else:
+            print('\nIncremental mode: no earlier run of this query found, running the full query.')
+    else:
+        catalog=None
+
+    # resume a download run of this query that did not finish, using its saved query result
+    journal=None
+    resume=None
+    if download and journal_file:
+        journal=s1_journal_func.JobJournal(journal_file)
+        run_key=s1_catalog_func.query_key(arg_list)
+        resume=journal.get('run',run_key)
+        if resume is None or resume['state'] != s1_journal_func.state_started or not os.path.isfile(resume['query']):
+            resume=None
+        elif args.restart:
+            print('\nNot resuming the interrupted run of this query, as --restart is set.')
+            resume=None
+
     logtime=time.strftime("%Y_%m_%d-%H_%M_%S")
     query_log='asf_query_%s.%s'%(logtime,output_format)
-    with open(query_log,'w')as f:
-        print('Query result saved to asf_query_%s.%s'%(logtime,output_format))
-        f.write(r.text)
+    if resume:
+        print('\nResuming the interrupted run of this query from %s, with %d scenes found by its query in %s.'%(
+            time.strftime('%Y-%m-%d %H:%M:%S',time.localtime(resume['time'])),resume['scenes'],resume['query']))
+        print('Use --restart to query again instead.\n')
+        # scenes processed after the interrupted run made its query are not in its result
+        if catalog is not None:
+            run_start=resume['query_start']
+        query_rows=read_query_rows(resume['query'])
+    else:
+        # run the ASF query request
+        print('\nRunning ASF API query:')
+        print(argurl + '\n')
+        query_rows=query_asf_csv(query_args,search_windows) if output_format == 'csv' else None
+    if output_format == 'csv':
+        # parse rows as they arrive, and save them to a file (unless reading the result of an earlier run)
+        rows=[]
+        with open(os.devnull if resume else query_log,'w',newline='') as f:
+            if not resume:
+                print('Query result saved to asf_query_%s.%s'%(logtime,output_format))
+            if journal is not None and not resume:
+                query_rows=journal_query(query_rows,journal,run_key,query_log,query_start=datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SUTC'))
+            if download and pipeline:
+                print('Downloading each scene as soon as it is found.')
+                downloadList=save_query_rows(query_rows,f,args.verbose,rows)
+            else:
+                for row in save_query_rows(query_rows,f):
+                    # keep only the fields needed for downloading, unless the catalog needs the full rows
+                    rows.append(s1_download_func.GranuleRecord(row) if download and catalog is None else row)
+                downloadList=rows
+            # skip granules that were already downloaded
+            if catalog is not None:
+                downloadList=catalog_downloads(downloadList,catalog,s1_catalog_func.query_key(arg_list))
+            downloadList=prepare_downloads(downloadList,download_info)
+            # skip granules that the interrupted run already downloaded
+            if resume:
+                downloadList=journal_downloads(downloadList,journal,run_key)
+            # look up each granule in the AWS index, listing all dates of a complete query result at once
+            if download and aws_index_file and download_site != 'ASF':
+                aws_index=open_database(s1_catalog_func.AwsIndex,aws_index_file)
+                if not pipeline:
+                    list_aws_days([row['Acquisition Date'][0:10] for row in rows],aws_index,aws_index_threads)
+                downloadList=route_downloads(downloadList,aws_index)
+            if download and assemble:
+                frames=make_frame_pipeline(config)
+                downloadList=track_frames(downloadList,frames)
+            else:
+                frames=None
+            # plan the downloads: order a complete query result by size or satellite pass, and pause new downloads when the disk is nearly full
+            if download:
+                plan=DownloadPlan(download_order, min_free_space, estimate_rate(download_info, aws_nproc + asf_nproc if scheduler == 'asyncio' else nproc, max_bandwidth))
+                if not pipeline:
+                    downloadList=plan.plan(list(downloadList))
+                elif config.has_option('download','order'):
+                    print('Scenes are downloaded in the order they are found, as pipeline = true.')
 
-    # print the results to the screen
-    if args.verbose:
-        if output_format == 'csv':
             # print the results in a nice format
-            numscenes=len(rows)
-            plural_s = 's' if numscenes > 1 else ''
-            if numscenes > 0:
-                print("Found %s scene%s." %(numscenes,plural_s))
-                for row in rows:
-                    print('Scene %s, Path %s / Frame %s' %(row['Granule Name'], row['Path Number'], row['Frame Number']))
-        else:
-            print(r.text)
-        
-    # If a download is requested:
-    # parse result into a list of granules, figure out the correct path, and download each one.
-    if output_format != 'csv' and args.download:
-        print('Error: cannot download unless output format is set to csv. Doing nothing.')
-    if output_format == 'csv' and args.download:
-        if nproc > 1:
-            print('\nRunning %d downloads in parallel.'%nproc)
-        else:
-            print('\nDownloading 1 at a time.')
-        # need to pass http-user and http-password for ASF downloads.
-        # this section should contain 'http-user', 'http-password', plus any other wget options.
-        # we join them (naively) as a single argument string
-        if download_site != 'AWS':
-            # first, check for missing values:
-            if not (config.has_section('asf_download') and config.has_option('asf_download','http-user') \
-                and config.has_option('asf_download','http-password') and len(config.get('asf_download','http-user'))>0 \
-                and len(config.get('asf_download','http-password')) > 0):
-                raise ValueError('ASF username or password missing in config file.')
-            asf_wget_options=config.items('asf_download')
-            asf_wget_str=' '.join('--%s=%s'%(item[0],item[1]) for item in asf_wget_options)
-        else:
-            asf_wget_str=''
-        downloadList = []
-        for row in rows:
-            downloadDict = row
-            # add some extra info to the csv row for download purposes
-            downloadDict['Download Site'] = download_site
-            downloadDict['asf_wget_str'] = asf_wget_str
-            downloadList.append(downloadDict)
-        # map list to multiprocessing pool
-        multiprocessing.set_start_method("spawn")
-        with multiprocessing.get_context("spawn").Pool(processes=nproc) as pool:
-            pool.map(downloadGranule, downloadList, chunksize=1)
-        print('\nDownload complete.\n')
+            if args.verbose and not (download and pipeline):
+                numscenes=len(rows)
+                plural_s = 's' if numscenes > 1 else ''
+                if numscenes > 0:
+                    print("Found %s scene%s." %(numscenes,plural_s))
+                    for row in rows:
+                        print('Scene %s, Path %s / Frame %s' %(row['Granule Name'], row['Path Number'], row['Frame Number']))
+
+            # If a download is requested:
+            # figure out the correct path for each granule, and download each one.
+            if download:
+                # keep track of the result of each download
+                failed=[]
+                def record_result(name, status):
+                    if status != 0:
+                        failed.append(name)
+                    if frames is not None:
+                        frames.finished(name, status)
+                    if catalog is not None:
+                        catalog.set_state(name, s1_catalog_func.state_complete if status == 0 else s1_catalog_func.state_failed)
+                    if journal is not None:
+                        journal.record('granule', name, s1_journal_func.state_done if status == 0 else s1_journal_func.state_failed, run=run_key)
+                run_downloads(downloadList, scheduler, nproc, aws_nproc, asf_nproc, max_bandwidth, download_info['Segments'], record_result, plan)
+                if pipeline:
+                    print('\nFound %d scenes.'%len(rows))
+                # the run was not interrupted, so the next run queries again, and retries any failed scenes it finds
+                if journal is not None:
+                    journal.record('run', run_key, s1_journal_func.state_done, failed=len(failed))
+                if failed:
+                    print('\n%d downloads failed.'%len(failed))
+                elif catalog is not None:
+                    # the next incremental run only needs to look for scenes processed after this one started
+                    catalog.set_last_run(arg_list, run_start)
+                print('\nDownload complete.\n')
+                if download_site == 'auto':
+                    print('Download source statistics: %s\n'%get_source_stats(download_info['Source Stats']).summary())
+                if frames is not None:
+                    print('Waiting for frames to finish.')
+                    results=frames.wait()
+                    print('\nCreated %d of %d frames in %s.\n'%(list(results.values()).count(True),len(results),frames.outdir))
+            else:
+                # record the new scenes, so that a later incremental run will download them
+                if catalog is not None:
+                    for row in rows:
+                        catalog.add_granule(row, get_frame_dir(row), s1_catalog_func.query_key(arg_list))
+                print('\nNot downloading.\n')
     else:
+        r=requests.post(argurl, timeout=s1_download_func.request_timeout)
+        # save the results to a file
+        with open(query_log,'w') as f:
+            print('Query result saved to asf_query_%s.%s'%(logtime,output_format))
+            f.write(r.text)
+        # print the results to the screen
+        if args.verbose:
+            print(r.text)
         print('\nNot downloading.\n')
 
+    if metrics_log:
+        s1_metrics_func.write_summary(metrics_summary or metrics_log + '.prom')
+        print('Stage timings saved to %s, summary in %s\n'%(metrics_log, metrics_summary or metrics_log + '.prom'))
+
     print('Sentinel query complete.\n')
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the native python download functions, against a local HTTP server.
+Run with: python -m pytest test_s1_download_func.py
+
+Created October 2026
+"""
+
+import os,threading,http.server
+import s1_download_func
+
+content = b'0123456789'*1000
+
+
+class RecordingHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serve the same content for any path, with range requests, and record the Authorization header of each request.
+    """
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('Authorization')))
+        start = 0
+        if self.headers.get('Range'):
+            start,end = self.headers['Range'].split('=')[1].split('-')
+            start,end = int(start), int(end) if end else len(content) - 1
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d'%(start, end, len(content)))
+            data = content[start:end + 1]
+        else:
+            self.send_response(200)
+            data = content
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RecordingHandler)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:%d'%server.server_address[1]
+
+
+def test_no_credentials_after_asf_download(tmp_path):
+    server, url = start_server()
+    try:
+        for segments in [1, 2]:
+            del server.requests[:]
+            asf_dir, aws_dir = tmp_path/('asf%d'%segments), tmp_path/('aws%d'%segments)
+            os.makedirs(asf_dir)
+            os.makedirs(aws_dir)
+            assert s1_download_func.download_url(url + '/asf/granule.zip', str(asf_dir), auth=('user','password'), segments=segments) == 0
+            assert s1_download_func.download_url(url + '/aws/granule.zip', str(aws_dir), segments=segments) == 0
+            assert (aws_dir/'granule.zip').read_bytes() == content
+            asf_headers = [header for path,header in server.requests if path.startswith('/asf/')]
+            aws_headers = [header for path,header in server.requests if path.startswith('/aws/')]
+            assert asf_headers and all(header is not None for header in asf_headers)
+            assert aws_headers and all(header is None for header in aws_headers)
+        # the shared session never keeps the credentials
+        assert s1_download_func.get_session().auth is None
+    finally:
+        server.shutdown()
+
+
+def test_downloaded_bytes_of_segmented_download(tmp_path):
+    filename = str(tmp_path/'granule.zip')
+    # a segmented download preallocates the whole .part file, but has only fetched part of each range
+    with open(filename + '.part','wb') as f:
+        f.truncate(1000)
+    with open(filename + '.segments','w') as f:
+        f.write('{"size": 1000, "ranges": [[0, 500], [500, 1000]], "done": [100, 50]}')
+    assert s1_download_func.get_downloaded_bytes(filename) == 150
+    os.remove(filename + '.segments')
+    assert s1_download_func.get_downloaded_bytes(filename) == 1000
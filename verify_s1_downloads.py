@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script to check downloaded granules against the size and MD5 checksum reported by ASF, without any network access.
+The expected values are read from saved query results (asf_query_*.csv) or from the granule catalog.
+Created October 2026
+"""
+import os,csv,argparse
+from concurrent.futures import ThreadPoolExecutor
+import s1_download_func,s1_catalog_func
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check downloaded Sentinel-1 granules in the P###/F#### directories against the size and MD5 checksum given in ASF query results.')
+    parser.add_argument('query_files',type=str,nargs='*',help='Saved ASF query results (csv) listing the granules to check. Optional if --catalog is given.')
+    parser.add_argument('-c','--catalog',type=str,default=None,help='Granule catalog (from sentinel_query_download.py --incremental). Granules in the catalog are checked if no query files are given, and their download state is updated (default: none)')
+    parser.add_argument('-m','--mode',type=str,default='md5',choices=['size','md5'],help='Check only the file size, or the size and MD5 checksum (default: md5)')
+    parser.add_argument('-a','--action',type=str,default='none',choices=['none','refetch','quarantine'],help='What to do with files that fail: leave them (none), delete them so they will be downloaded again (refetch), or move them to the quarantine directory (default: none)')
+    parser.add_argument('-q','--quarantine-dir',type=str,default='quarantine',help='Directory for files that fail, with --action quarantine (default: quarantine)')
+    parser.add_argument('-n','--nproc',type=int,default=4,help='Number of files to check in parallel (default: 4)')
+    args = parser.parse_args()
+
+    # read the granules to check
+    catalog = s1_catalog_func.GranuleCatalog(args.catalog) if args.catalog else None
+    rows = {}
+    for query_file in args.query_files:
+        with open(query_file,newline='') as f:
+            for row in csv.DictReader(f):
+                rows[row['Granule Name']] = row
+    if not args.query_files and catalog is not None:
+        rows = {row['Granule Name']: row for row in catalog.get_all()}
+    print('Checking %d granules (%s check).\n'%(len(rows),args.mode))
+
+    def check(row):
+        frame_dir = 'P' + row['Path Number'].zfill(3) + '/F' + row['Frame Number'].zfill(4)
+        filename = os.path.join(frame_dir, row['URL'].split('/')[-1])
+        return row, filename, s1_download_func.verify_file(filename, s1_download_func.get_expected_size(row), s1_download_func.get_expected_md5(row), args.mode)
+
+    # check the files in parallel, and report the results
+    counts = {}
+    with ThreadPoolExecutor(max_workers=args.nproc) as executor:
+        for row,filename,result in executor.map(check, rows.values()):
+            counts[result] = counts.get(result,0) + 1
+            if result != s1_download_func.verify_ok:
+                print('%s: %s'%(filename,result))
+                if result not in [s1_download_func.verify_missing, s1_download_func.verify_short]:
+                    s1_download_func.remove_bad_file(filename, args.action, args.quarantine_dir)
+            if catalog is not None:
+                catalog.add_granule(row, os.path.dirname(filename))
+                catalog.set_state(row['Granule Name'], s1_catalog_func.state_complete if result == s1_download_func.verify_ok else s1_catalog_func.state_failed)
+
+    print('\nResults:')
+    for result,count in sorted(counts.items()):
+        print('  %s: %d'%(result,count))